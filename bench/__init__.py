@@ -0,0 +1 @@
+"""Benchmarks for the probe and publish cycle against local stand-in servers."""
@@ -0,0 +1,183 @@
+"""
+Load-test the collector with stand-in reporters.
+
+Starts a collector on a free local port with its store in a temporary
+directory, then has a number of reporter threads post webhook records over
+keep-alive connections, each one a different host, a share of them with a
+new IP. It reports accepted reports per second and POST latency, then times
+index lookups and the HTTP lookup endpoints against the populated index.
+
+    python -m bench.collector --hosts 5000 --reporters 32 --seconds 10
+    python -m bench.collector --batch 50 --output collector_results.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from bench.run import _git_revision, _percentile
+from ipreport.collector import Collector, serve
+
+LOOKUPS = 100_000  # in-process index lookups timed after the load phase
+HTTP_LOOKUPS = 2_000
+
+
+def _report(host, ip, now):
+    return {'host': host, 'ip': ip, 'timestamp': now.isoformat(), 'changed': False, 'changes': []}
+
+
+def _reporter(port, hosts, args, deadline, rng, out):
+    """Post reports for hosts round-robin until deadline; appends (latencies, reports, errors) to out."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies, reports, errors = [], 0, 0
+    addresses = {host: f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}" for host in hosts}
+    i = 0
+    while time.monotonic() < deadline:
+        batch = []
+        for _ in range(args.batch):
+            host = hosts[i % len(hosts)]
+            i += 1
+            if rng.random() < args.change_rate:
+                addresses[host] = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+            batch.append(json.dumps(_report(host, addresses[host], datetime.now())))
+        body = '\n'.join(batch).encode('utf-8')
+        started = time.perf_counter()
+        try:
+            conn.request('POST', '/report', body, {'Content-Type': 'application/x-ndjson'})
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 300:
+                errors += len(batch)
+            else:
+                reports += len(batch)
+        except (OSError, http.client.HTTPException):
+            errors += len(batch)
+            conn.close()
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    out.append((latencies, reports, errors))
+
+
+def _time_lookups(collector, hosts, rng):
+    names = [rng.choice(hosts) for _ in range(LOOKUPS)]
+    started = time.perf_counter()
+    for name in names:
+        collector.index.get(name)
+    per_get = (time.perf_counter() - started) / LOOKUPS
+
+    since = time.time() - 3600
+    rounds = 100
+    started = time.perf_counter()
+    for _ in range(rounds):
+        changed = collector.index.changed_since(since)
+    per_changes = (time.perf_counter() - started) / rounds
+    return {'get_us': per_get * 1e6, 'changed_last_hour_us': per_changes * 1e6, 'changed_last_hour': len(changed)}
+
+
+def _time_http_lookups(port, hosts, rng):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    for _ in range(HTTP_LOOKUPS):
+        started = time.perf_counter()
+        conn.request('GET', f"/hosts/{rng.choice(hosts)}")
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    return {'p50_ms': _percentile(latencies, 0.5) * 1000, 'p99_ms': _percentile(latencies, 0.99) * 1000}
+
+
+def run(args, workdir):
+    rng = random.Random(args.seed)
+    collector = Collector(os.path.join(workdir, 'collector_changes.log'))
+    server = serve(collector, port=0)
+    port = server.server_port
+    hosts = [f"site-{n:06d}" for n in range(args.hosts)]
+    try:
+        out = []
+        deadline = time.monotonic() + args.seconds
+        threads = [
+            threading.Thread(target=_reporter, args=(port, hosts[n::args.reporters], args, deadline,
+                                                     random.Random(rng.random()), out))
+            for n in range(args.reporters)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        latencies = [latency for result in out for latency in result[0]]
+        reports = sum(result[1] for result in out)
+        errors = sum(result[2] for result in out)
+        return {
+            'reports': reports,
+            'errors': errors,
+            'reports_per_second': reports / elapsed,
+            'post_ms': {
+                'p50': _percentile(latencies, 0.5) * 1000,
+                'p90': _percentile(latencies, 0.9) * 1000,
+                'p99': _percentile(latencies, 0.99) * 1000,
+            },
+            'hosts_indexed': len(collector.index),
+            'store_bytes': os.path.getsize(collector.store.path),
+            'lookup': _time_lookups(collector, hosts, rng),
+            'http_lookup': _time_http_lookups(port, hosts, rng),
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+        collector.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.collector', description=__doc__.splitlines()[1])
+    parser.add_argument('--hosts', type=int, default=5000, help="distinct reporting hosts")
+    parser.add_argument('--reporters', type=int, default=32, help="concurrent reporter connections")
+    parser.add_argument('--seconds', type=float, default=10, help="length of the load phase")
+    parser.add_argument('--batch', type=int, default=1, help="reports per POST (JSON lines)")
+    parser.add_argument('--change-rate', type=float, default=0.05, help="share of reports carrying a new IP")
+    parser.add_argument('--output', help="also write the results here as JSON")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="show the collector's own logging")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.CRITICAL,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    with tempfile.TemporaryDirectory(prefix='ipreport-collector-bench-') as workdir:
+        result = run(args, workdir)
+    result['meta'] = {
+        'revision': _git_revision(),
+        'timestamp': datetime.now().isoformat(),
+        'hosts': args.hosts,
+        'reporters': args.reporters,
+        'seconds': args.seconds,
+        'batch': args.batch,
+        'change_rate': args.change_rate,
+    }
+
+    post = result['post_ms']
+    lookup = result['lookup']
+    print(f"{result['reports']} reports in {args.seconds:.0f}s: {result['reports_per_second']:.0f}/s, "
+          f"{result['errors']} errors, POST p50 {post['p50']:.2f}ms p99 {post['p99']:.2f}ms")
+    print(f"{result['hosts_indexed']} hosts indexed, store {result['store_bytes']} bytes")
+    print(f"index lookup {lookup['get_us']:.2f}us, changed in the last hour ({lookup['changed_last_hour']} hosts) "
+          f"{lookup['changed_last_hour_us']:.0f}us, "
+          f"GET /hosts/<name> p50 {result['http_lookup']['p50_ms']:.2f}ms p99 {result['http_lookup']['p99_ms']:.2f}ms")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
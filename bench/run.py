@@ -0,0 +1,229 @@
+"""
+Benchmark the probe and publish cycle against local stand-in servers.
+
+Each scenario starts three echo services and an FTPS server (see
+bench.standins) and runs the real code path for a number of cycles:
+resolve_public_ip, then FTPSPublisher.attempt with the outbox and publish
+state, retried like the daemon does. It reports cycle latency, and per cycle
+the connections and TLS handshakes opened and the payload bytes moved. The
+history scenarios seed log.txt with a growing number of lines to show what
+log growth costs.
+
+Results are written as JSON so runs can be compared between releases:
+    python -m bench.run --output bench_results.json
+    python -m bench.run --compare old.json --output new.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from bench.standins import EchoServer, Faults, FTPSServer
+from ipreport import httpclient
+from ipreport.ftps import FTPSSession
+from ipreport.lookup import resolve_public_ip
+from ipreport.outbox import Outbox
+from ipreport.providers import ProviderRegistry
+from ipreport.publish import FTPSPublisher
+from ipreport.state import PublishState
+
+ECHO_SERVERS = 3
+PUBLISH_ATTEMPTS = 3  # like MAX_RETRIES, without the backoff sleeps
+
+# change_every: the IP changes every n cycles, 0 = never
+# heartbeat: PublishState heartbeat interval, 0 = lastupdate.txt every cycle
+# log_lines: lines already in log.txt before the first cycle
+SCENARIOS = [
+    {'name': 'steady', 'change_every': 0, 'heartbeat': 3600},
+    {'name': 'heartbeat', 'change_every': 0, 'heartbeat': 0},
+    {'name': 'change', 'change_every': 1, 'heartbeat': 3600},
+    {'name': 'history-10k', 'change_every': 1, 'heartbeat': 3600, 'log_lines': 10_000},
+    {'name': 'history-100k', 'change_every': 1, 'heartbeat': 3600, 'log_lines': 100_000},
+    {'name': 'history-1m', 'change_every': 1, 'heartbeat': 3600, 'log_lines': 1_000_000},
+    {'name': 'lossy-echo', 'change_every': 5, 'heartbeat': 3600,
+     'echo': {'latency': 0.05, 'loss': 0.1, 'failure_rate': 0.1}},
+    {'name': 'flaky-ftps', 'change_every': 1, 'heartbeat': 3600,
+     'ftps': {'latency': 0.005, 'loss': 0.01, 'failure_rate': 0.05}},
+]
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _delta(after, before):
+    return {name: value - before.get(name, 0) for name, value in after.items()}
+
+
+def _seed_log(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(lines):
+            f.write(f"2020-01-01T00:00:00.{i % 1_000_000:06d} - 192.0.2.{i % 250 + 1}\n")
+
+
+def run_scenario(scenario, cycles, workdir, seed=1):
+    """
+    Run one scenario.
+
+    Returns:
+        dict: The scenario's results, ready to be written as JSON.
+    """
+    ftp_root = os.path.join(workdir, 'ftp')
+    os.makedirs(ftp_root)
+    log_lines = scenario.get('log_lines', 0)
+    if log_lines:
+        _seed_log(os.path.join(ftp_root, 'log.txt'), log_lines)
+
+    echo_faults = scenario.get('echo', {})
+    echos = [
+        EchoServer(faults=Faults(seed=seed + i, **echo_faults)).start()
+        for i in range(ECHO_SERVERS)
+    ]
+    ftpd = FTPSServer(ftp_root, Faults(seed=seed, **scenario.get('ftps', {}))).start()
+    urls = [echo.url for echo in echos]
+
+    session = FTPSSession('127.0.0.1', FTPSServer.user, FTPSServer.password, remote_path='/',
+                          port=ftpd.port, timeout=5)
+    state = PublishState(os.path.join(workdir, 'state.json'), heartbeat_interval=scenario['heartbeat'])
+    publisher = FTPSPublisher(session, state)
+    publisher.outbox = Outbox(os.path.join(workdir, 'outbox.jsonl'), 'ftps', state.ip)
+    registry = ProviderRegistry(urls)
+
+    httpclient.close()  # every scenario starts without pooled connections
+    http_before = httpclient.stats()
+    latencies = []
+    failed = 0
+    try:
+        for cycle in range(cycles):
+            if scenario['change_every'] and cycle % scenario['change_every'] == 0:
+                for echo in echos:
+                    echo.ip = f"198.51.100.{cycle % 250 + 1}"
+
+            started = time.perf_counter()
+            ip = resolve_public_ip(services=urls, timeout=2, registry=registry)
+            published = False
+            if ip:
+                publisher.outbox.enqueue(ip, datetime.now())
+                published = any(publisher.attempt(ip) for _ in range(PUBLISH_ATTEMPTS))
+            latencies.append(time.perf_counter() - started)
+            failed += not published
+    finally:
+        publisher.close()
+        http = _delta(httpclient.stats(), http_before)
+        httpclient.close()
+        ftp = ftpd.counters.snapshot()
+        echo = {}
+        for server in echos:
+            for name, value in server.counters.snapshot().items():
+                echo[name] = echo.get(name, 0) + value
+        ftpd.stop()
+        for server in echos:
+            server.stop()
+
+    ftp_connections = ftp.get('control_connections', 0)
+    ftp_data = ftp.get('data_connections', 0)
+    totals = {
+        'http_connections': http['connections'],
+        'http_requests': http['requests'],
+        'tls_handshakes': http['tls_handshakes'] + ftp_connections + ftp_data,
+        'ftps_control_connections': ftp_connections,
+        'ftps_data_connections': ftp_data,
+        'ftps_commands': ftp.get('commands', 0),
+        'ftps_bytes': ftp.get('bytes_received', 0) + ftp.get('bytes_sent', 0),
+        'echo_bytes': echo.get('bytes_sent', 0),
+        'injected_losses': ftp.get('lost', 0) + echo.get('lost', 0),
+        'injected_failures': ftp.get('failed', 0) + echo.get('failed', 0),
+    }
+    return {
+        'name': scenario['name'],
+        'params': scenario,
+        'cycles': cycles,
+        'failed_cycles': failed,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) * 1000,
+            'p50': _percentile(latencies, 0.5) * 1000,
+            'p90': _percentile(latencies, 0.9) * 1000,
+            'p99': _percentile(latencies, 0.99) * 1000,
+            'max': max(latencies) * 1000,
+        },
+        'per_cycle': {name: value / cycles for name, value in totals.items()},
+        'totals': totals,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_results(results, baseline=None):
+    previous = {s['name']: s for s in baseline['scenarios']} if baseline else {}
+    print(f"{'scenario':<14} {'p50 ms':>9} {'p90 ms':>9} {'handshakes':>11} {'ftps bytes':>11} {'failed':>7}")
+    for s in results['scenarios']:
+        line = (f"{s['name']:<14} {s['latency_ms']['p50']:>9.1f} {s['latency_ms']['p90']:>9.1f} "
+                f"{s['per_cycle']['tls_handshakes']:>11.2f} {s['per_cycle']['ftps_bytes']:>11.0f} "
+                f"{s['failed_cycles']:>7}")
+        old = previous.get(s['name'])
+        if old and old['latency_ms']['p50']:
+            line += f"   p50 x{s['latency_ms']['p50'] / old['latency_ms']['p50']:.2f} vs {baseline['meta']['revision']}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.run', description=__doc__.splitlines()[1])
+    parser.add_argument('--cycles', type=int, default=50, help="cycles per scenario")
+    parser.add_argument('--scenario', action='append', help="run only these scenarios (repeatable)")
+    parser.add_argument('--output', default='bench_results.json', help="where to write the JSON results")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--seed', type=int, default=1, help="seed for fault injection")
+    parser.add_argument('--verbose', action='store_true', help="show the reporter's own logging")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.CRITICAL,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    scenarios = [s for s in SCENARIOS if not args.scenario or s['name'] in args.scenario]
+    if not scenarios:
+        parser.error(f"no such scenario, choose from {', '.join(s['name'] for s in SCENARIOS)}")
+
+    results = {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cycles': args.cycles,
+            'seed': args.seed,
+        },
+        'scenarios': [],
+    }
+    for scenario in scenarios:
+        with tempfile.TemporaryDirectory(prefix='ipreport-bench-') as workdir:
+            results['scenarios'].append(run_scenario(scenario, args.cycles, workdir, seed=args.seed))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    _print_results(results, baseline)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Local stand-ins for the echo services and the FTPS server, with injectable faults.
+
+Both servers run on 127.0.0.1 on a free port in a background thread and count
+what clients cost them: connections, TLS handshakes, requests and bytes. Every
+fault is drawn per request from a seeded random generator, so a benchmark run
+can be repeated exactly:
+    latency       seconds added before answering
+    loss          fraction of requests where the connection is dropped without an answer
+    failure_rate  fraction of requests answered with an error (HTTP 503, FTP 451)
+"""
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Faults:
+    """Latency, loss and failure injection shared by the stand-ins."""
+
+    def __init__(self, latency=0.0, loss=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.loss = loss
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """
+        Decide what happens to one request, after sleeping the injected latency.
+
+        Returns:
+            str: 'ok', 'lost' or 'failed'.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            r = self._rng.random()
+        if r < self.loss:
+            return 'lost'
+        if r < self.loss + self.failure_rate:
+            return 'failed'
+        return 'ok'
+
+
+class Counters:
+    """Thread-safe named counters."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class EchoServer:
+    """
+    Plain-text "what is my IP" service answering with self.ip over HTTP/1.1 keep-alive.
+
+    Set ip at any time to simulate an address change.
+    """
+
+    def __init__(self, ip='203.0.113.1', faults=None):
+        self.ip = ip
+        self.faults = faults or Faults()
+        self.counters = Counters()
+        self._server = None
+
+    def start(self):
+        echo = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                echo.counters.inc('connections')
+
+            def do_GET(self):
+                echo.counters.inc('requests')
+                outcome = echo.faults.draw()
+                if outcome == 'lost':
+                    echo.counters.inc('lost')
+                    self.close_connection = True
+                    return
+                status, body = (200, echo.ip.encode()) if outcome == 'ok' else (503, b'injected failure')
+                if outcome == 'failed':
+                    echo.counters.inc('failed')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                echo.counters.inc('bytes_sent', len(body))
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _self_signed_pem(path):
+    """Write a throwaway key and certificate for 127.0.0.1 to path."""
+    from OpenSSL import crypto
+
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    cert = crypto.X509()
+    cert.get_subject().CN = '127.0.0.1'
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(24 * 3600)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+    with open(path, 'wb') as f:
+        f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+        f.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+
+
+class FTPSServer:
+    """
+    Explicit FTPS server (AUTH TLS, protected data channels) over a local directory.
+
+    Needs pyftpdlib and pyOpenSSL (pip install pyftpdlib pyopenssl). Faults are
+    applied to every command; failures only to transfers and renames, which is
+    where a real server's errors hurt.
+    """
+    user = 'bench'
+    password = 'bench'
+    failing_commands = ('STOR', 'APPE', 'RETR', 'RNTO')
+
+    def __init__(self, root, faults=None):
+        try:
+            from pyftpdlib.authorizers import DummyAuthorizer
+            from pyftpdlib.handlers import TLS_DTPHandler, TLS_FTPHandler
+            from pyftpdlib.servers import ThreadedFTPServer
+        except ImportError:
+            raise RuntimeError("The FTPS stand-in needs pyftpdlib and pyOpenSSL: pip install pyftpdlib pyopenssl")
+        self._classes = (DummyAuthorizer, TLS_DTPHandler, TLS_FTPHandler, ThreadedFTPServer)
+        self.root = root
+        self.faults = faults or Faults()
+        self.counters = Counters()
+        self._server = None
+        self._certdir = None
+
+    def start(self):
+        DummyAuthorizer, TLS_DTPHandler, TLS_FTPHandler, ThreadedFTPServer = self._classes
+        standin = self
+        counters = self.counters
+
+        class DTPHandler(TLS_DTPHandler):
+            def __init__(self, sock, cmd_channel):
+                super().__init__(sock, cmd_channel)
+                counters.inc('data_connections')
+
+            def close(self):
+                if not self._closed:
+                    counters.inc('bytes_received', self.tot_bytes_received)
+                    counters.inc('bytes_sent', self.tot_bytes_sent)
+                super().close()
+
+        class Handler(TLS_FTPHandler):
+            def on_connect(self):
+                counters.inc('control_connections')
+
+            def pre_process_command(self, line, cmd, arg):
+                counters.inc('commands')
+                outcome = standin.faults.draw()
+                if outcome == 'lost':
+                    counters.inc('lost')
+                    self.close()
+                    return
+                if outcome == 'failed' and cmd in standin.failing_commands:
+                    counters.inc('failed')
+                    self.respond('451 Injected failure.')
+                    return
+                super().pre_process_command(line, cmd, arg)
+
+        self._certdir = tempfile.TemporaryDirectory(prefix='ipreport-bench-')
+        certfile = os.path.join(self._certdir.name, 'ftpd.pem')
+        _self_signed_pem(certfile)
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_user(self.user, self.password, self.root, perm='elradfmwMT')
+        Handler.authorizer = authorizer
+        Handler.certfile = certfile
+        Handler.tls_control_required = True
+        Handler.tls_data_required = True
+        Handler.dtp_handler = DTPHandler
+
+        self._server = ThreadedFTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, kwargs={'handle_exit': False}, daemon=True).start()
+        return self
+
+    @property
+    def port(self):
+        return self._server.address[1]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close_all()
+            self._server = None
+        if self._certdir is not None:
+            self._certdir.cleanup()
+            self._certdir = None
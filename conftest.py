@@ -0,0 +1 @@
+"""Puts this checkout on sys.path, so a plain `pytest` imports ipreport as python -m pytest does."""
@@ -12,6 +12,9 @@ CHECK_INTERVAL = 200  # seconds
 CONNECTION_TIMEOUT = 30  # seconds for all network operations
 REBOOT_AFTER_FAILURES = 5  # Number of consecutive failures before rebooting
 
+# One keep-alive session for all probes instead of a new connection per request
+http = requests.Session()
+
 def test_internet_connection():
     """
     Test internet connectivity by attempting to connect to multiple IP services.
@@ -31,7 +34,7 @@ def test_internet_connection():
 
     for service in services:
         try:
-            response = requests.get(service, timeout=CONNECTION_TIMEOUT)
+            response = http.get(service, timeout=CONNECTION_TIMEOUT)
             response.raise_for_status()
 
             logging.info(f"Successfully connected to {service}")
@@ -0,0 +1 @@
+"""Shared building blocks for the public IP reporter and connectivity watchdog."""
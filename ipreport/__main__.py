@@ -0,0 +1,3 @@
+from ipreport.daemon import main
+
+main()
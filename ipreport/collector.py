@@ -0,0 +1,530 @@
+"""
+Collector: one place to ask for the current IP of every reporting host.
+
+Reporters send their publish record with the webhook backend
+(PUBLISH_BACKENDS=webhook, WEBHOOK_URL=http://collector:8700/report), or the
+collector imports the ip.txt / lastupdate.txt / log.txt layout that the FTPS
+backend already writes, one directory per host. Every IP change goes into an
+in-memory index, which answers lookups without touching the disk, and into an
+append-only store file that is replayed at start-up.
+
+HTTP API:
+    POST /report              one JSON record, or many as JSON lines, at most 64 KiB
+    GET  /hosts               every host with its current IP
+    GET  /hosts/<name>        one host
+    GET  /changes?within=3600 hosts whose IP changed in the last hour (or ?since=<ISO time>)
+    GET  /metrics             Prometheus metrics
+
+Times are sent and answered as ISO 8601 in UTC (with an offset or Z) or as
+epoch seconds. Times without an offset, from reporters that predate that, are
+taken as the collector's local time.
+
+Run with python -m ipreport.collector; the settings are the COLLECTOR_* keys
+in ipreport.config.
+"""
+import bisect
+import ftplib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from ipreport import logs, metrics
+from ipreport.history import parse_log_line
+from ipreport.state import HEARTBEAT_FILE, IP_FILE, LOG_FILE
+
+MAX_BODY = 64 * 1024  # bytes accepted in one POST
+
+COLLECTOR_REPORTS = metrics.counter(
+    'ipreport_collector_reports_total', 'Reports accepted by the collector.', ['source'])
+COLLECTOR_REJECTED = metrics.counter(
+    'ipreport_collector_rejected_total', 'Reports the collector could not use.', ['source'])
+COLLECTOR_CHANGES = metrics.counter(
+    'ipreport_collector_changes_total', 'IP changes recorded by the collector.')
+COLLECTOR_HOSTS = metrics.gauge(
+    'ipreport_collector_hosts', 'Hosts known to the collector.')
+
+
+class HostState(namedtuple('HostState', ['ip', 'changed_at', 'seen'])):
+    """A host's current IP, when it changed to it and when the host last reported (epoch seconds)."""
+    __slots__ = ()
+
+    def to_dict(self, host):
+        return {
+            'host': host,
+            'ip': self.ip,
+            'changed_at': _format_time(self.changed_at),
+            'seen': _format_time(self.seen),
+        }
+
+
+class Index:
+    """
+    Latest IP per host, plus the time-ordered list of changes.
+
+    Lookups by host are a dict access. "Changed since" is a binary search
+    into the change list, which stays sorted because reports mostly arrive in
+    time order (late ones are inserted in place). A report older than what the
+    index already holds for the host never replaces it, so replaying the store
+    or importing old logs can't move a host backwards.
+    """
+
+    def __init__(self):
+        self._hosts = {}
+        self._changes = []  # (changed_at, host), sorted
+        self._lock = threading.Lock()
+
+    def update(self, host, ip, when, seen=None):
+        """
+        Record that host had ip at when.
+
+        Returns:
+            bool: True if this is a change the index didn't know about.
+        """
+        seen = max(when, seen or when)
+        with self._lock:
+            current = self._hosts.get(host)
+            if current is not None:
+                if current.ip == ip or when < current.changed_at:
+                    if seen > current.seen:
+                        self._hosts[host] = current._replace(seen=seen)
+                    return False
+            self._hosts[host] = HostState(ip, when, seen)
+            if not self._changes or when >= self._changes[-1][0]:
+                self._changes.append((when, host))
+            else:
+                bisect.insort(self._changes, (when, host))
+            return True
+
+    def get(self, host):
+        return self._hosts.get(host)
+
+    def hosts(self):
+        with self._lock:
+            return dict(self._hosts)
+
+    def changed_since(self, since):
+        """Hosts whose current IP was taken on or after since, oldest change first."""
+        with self._lock:
+            start = bisect.bisect_left(self._changes, (since,))
+            found = {}
+            for when, host in self._changes[start:]:
+                state = self._hosts[host]
+                if state.changed_at >= since:
+                    found[host] = state
+        return sorted(found.items(), key=lambda item: item[1].changed_at)
+
+    def prune(self, before):
+        """Forget changes older than before; the current IP of every host is kept."""
+        with self._lock:
+            del self._changes[:bisect.bisect_left(self._changes, (before,))]
+
+    def __len__(self):
+        return len(self._hosts)
+
+
+class Store:
+    """
+    Append-only file of IP changes, one 'timestamp<TAB>host<TAB>ip' line each.
+
+    Writers queue their line and wait() until a background thread has written
+    and fsync'd it. Everything queued while one fsync is in progress goes out
+    with the next (group commit), so a thousand concurrent reporters cost a
+    handful of disk flushes rather than one each.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._pending = []
+        self._queued = 0  # sequence number of the last queued line
+        self._synced = 0  # sequence number of the last line on disk
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._flush_loop, name='collector-store', daemon=True)
+        self._thread.start()
+
+    def replay(self, index):
+        """Load every stored change into index. Returns the number of lines read."""
+        count = 0
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    timestamp, host, ip = line.rstrip('\n').split('\t')
+                    index.update(host, ip, _parse_time(timestamp, None))
+                    count += 1
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    logging.warning(f"Skipping damaged line in {self.path}: {line.strip()!r}")
+        return count
+
+    def append(self, when, host, ip):
+        """Queue a change. Returns: int: the sequence number to wait() for."""
+        line = f"{_format_time(when)}\t{host}\t{ip}\n"
+        with self._cond:
+            self._pending.append(line)
+            self._queued += 1
+            self._cond.notify_all()
+            return self._queued
+
+    def wait(self, seq, timeout=10):
+        """Block until the change with sequence number seq is on disk."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._synced >= seq or self._closed, timeout)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if self._closed and not self._pending:
+                    return
+                lines, self._pending = self._pending, []
+                seq = self._queued
+            try:
+                self._file.write(''.join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                logging.error(f"Could not write to collector store {self.path}: {e}")
+            with self._cond:
+                self._synced = seq
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+
+
+def _format_time(when):
+    return datetime.fromtimestamp(when, timezone.utc).isoformat()
+
+
+def _parse_time(value, default):
+    """Epoch seconds from epoch seconds or an ISO time; one without an offset is local time."""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'  # fromisoformat only takes Z from Python 3.11 on
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _valid_host(host):
+    return isinstance(host, str) and host and len(host) <= 253 and not any(c in host for c in '\t\n/')
+
+
+class Collector:
+    """The index and its store, fed by HTTP reports and layout imports."""
+
+    def __init__(self, store_path, retention=7 * 24 * 3600):
+        self.index = Index()
+        self.retention = retention
+        self.store = Store(store_path)
+        started = time.monotonic()
+        count = self.store.replay(self.index)
+        logging.info(f"Replayed {count} changes for {len(self.index)} hosts from {store_path} "
+                     f"in {(time.monotonic() - started) * 1000:.0f}ms")
+        COLLECTOR_HOSTS.set_function(lambda: len(self.index))
+
+    def record(self, host, ip, when, seen=None):
+        """
+        Add one observation to the index, storing it if it is a change.
+
+        Returns:
+            int: Store sequence number to wait for, or 0 if nothing was stored.
+        """
+        ip = str(ipaddress.ip_address(ip))
+        if not self.index.update(host, ip, when, seen):
+            return 0
+        COLLECTOR_CHANGES.inc()
+        return self.store.append(when, host, ip)
+
+    def ingest(self, report, now=None):
+        """
+        Take one publish record, as sent by WebhookPublisher.
+
+        Changes queued in the reporter's outbox are recorded with their own
+        timestamps before the current IP.
+
+        Returns:
+            int: Store sequence number to wait for, or 0 if nothing was stored.
+        """
+        if now is None:
+            now = time.time()
+        host = report.get('host')
+        if not _valid_host(host):
+            raise ValueError(f"invalid host {host!r}")
+        seq = 0
+        for change in report.get('changes') or []:
+            seq = max(seq, self.record(host, change['ip'], _parse_time(change.get('timestamp'), now)))
+        seq = max(seq, self.record(host, report['ip'], _parse_time(report.get('timestamp'), now), seen=now))
+        return seq
+
+    def import_layout(self, layout):
+        """
+        Read every host directory of an ip.txt/lastupdate.txt/log.txt layout.
+
+        log.txt is only read for hosts the index doesn't know yet, to backfill
+        their history; after that ip.txt and lastupdate.txt are enough.
+
+        Returns:
+            int: The number of hosts read.
+        """
+        count = 0
+        seq = 0
+        for host in layout.hosts():
+            if not _valid_host(host):
+                continue
+            try:
+                raw_ip = layout.read(host, IP_FILE)
+                if raw_ip is None:
+                    continue
+                heartbeat = layout.read(host, HEARTBEAT_FILE)
+                seen = _parse_time(heartbeat.decode('utf-8').strip(), time.time()) if heartbeat else time.time()
+                if self.index.get(host) is None:
+                    log = layout.read(host, LOG_FILE) or b''
+                    for line in log.decode('utf-8', 'replace').splitlines():
+                        entry = parse_log_line(line)
+                        if entry is not None:
+                            seq = max(seq, self.record(host, entry.ip, entry.timestamp.timestamp()))
+                seq = max(seq, self.record(host, raw_ip.decode('utf-8').strip(), seen, seen=seen))
+                COLLECTOR_REPORTS.inc(source='import')
+                count += 1
+            except (ValueError, UnicodeDecodeError) as e:
+                logging.warning(f"Skipping {host} in {layout}: {e}")
+                COLLECTOR_REJECTED.inc(source='import')
+        if seq:
+            self.store.wait(seq)
+        return count
+
+    def prune(self):
+        self.index.prune(time.time() - self.retention)
+
+    def close(self):
+        self.store.close()
+
+
+class DirectoryLayout:
+    """The FTPS layout read from a local directory, e.g. on the FTP server itself."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def hosts(self):
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def read(self, host, filename):
+        try:
+            with open(os.path.join(self.root, host, filename), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def __str__(self):
+        return self.root
+
+
+class FTPSLayout:
+    """The same layout read over FTPS, through an FTPSSession with remote_path=None."""
+
+    def __init__(self, session, root):
+        self.session = session
+        self.root = root.rstrip('/')
+
+    def hosts(self):
+        ftps = self.session.acquire()
+        if not ftps:
+            raise ConnectionError("FTPS server not reachable")
+        try:
+            return sorted(name for name, facts in ftps.mlsd(self.root or '/', facts=['type'])
+                          if facts.get('type') == 'dir')
+        except ftplib.error_perm:
+            # No MLSD: list everything, read() skips what isn't a host directory
+            return sorted(os.path.basename(name) for name in ftps.nlst(self.root or '/'))
+
+    def read(self, host, filename):
+        ftps = self.session.acquire()
+        if not ftps:
+            raise ConnectionError("FTPS server not reachable")
+        try:
+            return self.session.retrieve(ftps, f"{self.root}/{host}/{filename}")
+        except ftplib.error_perm:
+            return None
+
+    def __str__(self):
+        return f"ftps://{self.session.host}{self.root}"
+
+
+def serve(collector, address='127.0.0.1', port=8700, token=None):
+    """Serve the HTTP API from background threads. Returns the server so it can be shut down."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, unquote, urlsplit
+
+    class CollectorHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body in one segment, or delayed ACKs add 40ms to every keep-alive request
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def _send(self, status, body=None):
+            data = json.dumps(body).encode('utf-8') if body is not None else b''
+            self.send_response(status)
+            if body is not None:
+                self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self):
+            given = self.headers.get('Authorization', '').encode('utf-8', 'replace')
+            if token and not hmac.compare_digest(given, f"Bearer {token}".encode('utf-8')):
+                self._send(401, {'error': 'unauthorized'})
+                return False
+            return True
+
+        def _refuse(self, status, error):
+            # The body is left unread, so the connection can't carry another request
+            self.close_connection = True
+            self._send(status, {'error': error})
+
+        def do_POST(self):
+            if not self._authorized():
+                self.close_connection = True
+                return
+            if urlsplit(self.path).path != '/report':
+                self._refuse(404, 'not found')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._refuse(400, 'bad Content-Length')
+                return
+            if length > MAX_BODY:
+                self._refuse(413, f"body over {MAX_BODY} bytes")
+                return
+            body = self.rfile.read(length)
+            accepted, errors, seq = 0, [], 0
+            now = time.time()
+            for line in body.splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    seq = max(seq, collector.ingest(json.loads(line), now))
+                    accepted += 1
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    errors.append(str(e))
+            COLLECTOR_REPORTS.inc(accepted, source='http')
+            if errors:
+                COLLECTOR_REJECTED.inc(len(errors), source='http')
+            if seq:
+                collector.store.wait(seq)
+            if errors and not accepted:
+                self._send(400, {'error': errors[0]})
+            elif errors:
+                self._send(200, {'accepted': accepted, 'errors': errors[:10]})
+            else:
+                self._send(204)
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            url = urlsplit(self.path)
+            if url.path == '/metrics':
+                data = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif url.path == '/hosts':
+                self._send(200, [state.to_dict(host) for host, state in sorted(collector.index.hosts().items())])
+            elif url.path.startswith('/hosts/'):
+                host = unquote(url.path[len('/hosts/'):])
+                state = collector.index.get(host)
+                if state is None:
+                    self._send(404, {'error': f"unknown host {host}"})
+                else:
+                    self._send(200, state.to_dict(host))
+            elif url.path == '/changes':
+                query = parse_qs(url.query)
+                try:
+                    if 'since' in query:
+                        since = _parse_time(query['since'][0], None)
+                    else:
+                        since = time.time() - float(query.get('within', ['3600'])[0])
+                except ValueError as e:
+                    self._send(400, {'error': str(e)})
+                    return
+                self._send(200, [state.to_dict(host) for host, state in collector.index.changed_since(since)])
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            pass  # thousands of reports a second would flood the journal
+
+    server = ThreadingHTTPServer((address, port), CollectorHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, name='collector-http', daemon=True).start()
+    logging.info(f"Collector listening on http://{address}:{server.server_port}/")
+    return server
+
+
+def main(**overrides):
+    """Run the collector until interrupted. Keyword arguments override the configuration."""
+    from ipreport.config import Config
+
+    config = Config.from_env(**overrides)
+    logs.configure(config.log_level, config.log_format, config.log_dedup_window)
+    collector = Collector(config.collector_store, retention=config.collector_retention)
+    server = serve(collector, config.collector_address, config.collector_port, config.collector_token or None)
+
+    layout = None
+    if config.collector_import_dir:
+        layout = DirectoryLayout(config.collector_import_dir)
+    elif config.collector_import_ftps:
+        from ipreport.ftps import FTPSSession
+
+        session = FTPSSession(
+            config.ftp_host, config.ftp_user, config.ftp_pass, remote_path=None,
+            timeout=config.connection_timeout, encoding=config.ftp_encoding
+        )
+        layout = FTPSLayout(session, config.remote_path)
+
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        while True:
+            if layout is not None:
+                try:
+                    count = collector.import_layout(layout)
+                    logging.info(f"Imported {count} hosts from {layout}")
+                except (OSError, EOFError, ftplib.Error) as e:
+                    logging.error(f"Import from {layout} failed: {e}")
+                    if isinstance(layout, FTPSLayout):
+                        layout.session.invalidate()
+            collector.prune()
+            time.sleep(config.collector_import_interval)
+    except KeyboardInterrupt:
+        logging.info("Received interrupt signal. Shutting down gracefully...")
+    finally:
+        server.shutdown()
+        server.server_close()
+        collector.close()
+        logs.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Runtime configuration, read from the environment and an optional .env file."""
+import os
+
+from ipreport.remediation import DEFAULT_LADDER
+
+# Every setting can be overridden by the environment variable of the same name in
+# upper case, e.g. CHECK_INTERVAL=60 or ENABLE_REMEDIATION=yes.
+DEFAULTS = {
+    # FTPS server
+    'ftp_host': None,
+    'ftp_user': None,
+    'ftp_pass': None,
+    'ftp_encoding': 'utf-8',
+    'remote_path': '/ip/',
+    'max_retries': 3,
+    'publish_timeout': 60,  # seconds one upload attempt may take before it is abandoned
+
+    # Publish backends, comma separated: ftps, sftp, webdav, webhook, local
+    'publish_backends': 'ftps',
+    'sftp_host': None,
+    'sftp_port': 22,
+    'sftp_user': None,
+    'sftp_pass': None,
+    'sftp_key_file': None,
+    'sftp_path': '.',
+    'webdav_url': None,
+    'webdav_user': None,
+    'webdav_pass': None,
+    'webhook_url': None,
+    'webhook_token': None,
+    'local_publish_dir': 'published',
+
+    # Timing
+    'check_interval': 30,  # seconds between probes
+    'probe_mode': 'poll',  # or 'events': probe when the local network changes, see ipreport.netevents
+    'safety_poll_interval': 300,  # seconds between probes in events mode, in case a change was missed
+    'event_debounce': 2.0,  # seconds to let a burst of network changes settle before probing
+    'schedule_jitter': 0.1,  # random delay of up to this fraction of the interval on every run
+    'schedule_catch_up': 'skip',  # after an overrun: skip, burst or delay, see ipreport.schedule
+    'connection_timeout': 15,  # seconds for all network operations
+    'heartbeat_interval': 600,  # seconds between lastupdate.txt writes
+
+    # IP lookup
+    'ip_quorum': 1,  # echo services that must agree on the IP
+    'uplinks': '',  # interfaces to look the IP up through separately, e.g. 'eth0,wwan0'
+    'ip_families': '',  # '4', '6' or '4,6' to look up each family separately, empty = whichever answers
+    'provider_state_file': 'ip_providers.json',  # echo service health
+    'probe_cache_file': '',  # share probe results with other ipreport processes here, e.g. /dev/shm/ipreport-probes
+    'probe_cache_ttl': 25,  # seconds a shared result is reused before someone probes again, at most half an interval
+    'state_file': 'publish_state.json',  # last published IP, survives restarts
+    'outbox_file': 'outbox.jsonl',  # IP changes not yet published, see ipreport.outbox
+    'outbox_max_events': 1000,  # oldest queued changes are dropped beyond this
+
+    # Uptime record, see ipreport.uptime
+    'uptime_file': '',  # ring of checks, probes, remediations and outages, e.g. uptime.bin; empty = off
+    'uptime_capacity': 131072,  # records kept (32 bytes each)
+    'uptime_publish': False,  # upload uptime.json with every heartbeat (needs uptime_file)
+    'uptime_report_days': 7,  # period uptime.json covers
+
+    # Fleet mode: publish for many sites from one process, see ipreport.fleet
+    'fleet_file': '',  # JSON description of the sites, empty = single-host mode
+    'fleet_state_dir': 'fleet_state',
+    'fleet_concurrency': 16,  # sites probed / servers written in parallel
+
+    # Small boards
+    'lean': False,  # probe through http.client instead of requests, see ipreport.leanhttp
+
+    # Tasks
+    'enable_publish': True,
+    'enable_watchdog': False,
+    'enable_remediation': False,
+
+    # Logging, see ipreport.logs
+    'log_level': 'INFO',
+    'log_format': 'text',  # or 'json', one object per line
+    'log_dedup_window': 3600,  # seconds over which repeated messages are summarised, 0 = off
+
+    # Metrics
+    'metrics_port': 0,  # serve Prometheus metrics on this port, 0 = off
+    'metrics_address': '127.0.0.1',
+    'metrics_textfile': '',  # also write them here for node_exporter, e.g. /var/lib/node_exporter/ipreport.prom
+
+    # Watchdog and remediation
+    'reboot_after_failures': 3,  # consecutive failed probes before remediating
+    'publish_stale_after': 0,  # seconds without a successful publish before remediating, 0 = off
+    'remediation_ladder': DEFAULT_LADDER,  # action:cooldown steps tried in order, see ipreport.remediation
+    'remediation_verify_delay': 15,  # seconds after a step before checking whether it helped
+    'remediation_interface': '',  # interface to bounce, empty = the default route's (or the last one seen)
+    'remediation_state_file': 'remediation_state.json',
+    'remediation_max_reboots': 3,  # reboots within the window before rebooting is suspended
+    'remediation_reboot_window': 21600,  # seconds
+
+    # Collector service, see ipreport.collector
+    'collector_address': '127.0.0.1',
+    'collector_port': 8700,
+    'collector_token': '',  # required as 'Authorization: Bearer <token>' when set
+    'collector_store': 'collector_changes.log',  # append-only record of every change
+    'collector_import_dir': '',  # also read the per-host FTPS layout from this directory
+    'collector_import_ftps': False,  # ... or from FTP_HOST, under REMOTE_PATH
+    'collector_import_interval': 300,  # seconds between imports
+    'collector_retention': 604800,  # seconds of changes kept for /changes queries
+}
+
+
+def _convert(raw, default):
+    if isinstance(default, bool):
+        return raw.strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(raw)
+    if isinstance(default, float):
+        return float(raw)
+    return raw
+
+
+class Config:
+    """Plain attribute bag of settings, see DEFAULTS for the names."""
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """
+        Build a configuration from DEFAULTS and the environment.
+
+        Keyword overrides win over both, which is how the legacy entry-point
+        scripts pin the tasks they stand for.
+        """
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        values = dict(DEFAULTS)
+        for name, default in DEFAULTS.items():
+            raw = os.getenv(name.upper())
+            if raw is not None:
+                values[name] = _convert(raw, default)
+        values.update(overrides)
+        return cls(**values)
@@ -0,0 +1,247 @@
+"""
+Tiered connectivity check, cheapest signals first.
+
+1. route: is there a default route at all? If not, the link is down and
+   nothing else needs to be tried.
+2. tcp: a raw TCP connect to well-known anycast resolvers on port 53.
+3. dns: a real DNS query sent straight to the same resolvers over UDP.
+4. https: full HTTPS requests, only made when the cheaper tiers disagree or all
+   fail, e.g. on networks that block outbound port 53.
+
+Each tier has its own short timeout, so an outage is detected in about a
+second instead of after several HTTPS timeouts.
+"""
+import concurrent.futures
+import errno
+import logging
+import os
+import selectors
+import socket
+import struct
+import time
+from collections import namedtuple
+
+from ipreport import metrics
+
+RESOLVERS = ['1.1.1.1', '8.8.8.8', '9.9.9.9']
+DNS_QUERY_NAME = 'example.com'
+HTTPS_SERVICES = [
+    'https://api.ipify.org',
+    'https://icanhazip.com',
+    'https://checkip.amazonaws.com'
+]
+
+TCP_TIMEOUT = 0.5  # seconds
+DNS_TIMEOUT = 0.5  # seconds
+HTTPS_TIMEOUT = 0.9  # seconds
+
+TIER_LATENCY = metrics.histogram(
+    'ipreport_connectivity_tier_seconds', 'Duration of each connectivity check tier.', ['tier'])
+TIER_FAILURES = metrics.counter(
+    'ipreport_connectivity_tier_failures_total', 'Connectivity check tiers that failed.', ['tier'])
+
+
+class TierResult(namedtuple('TierResult', ['tier', 'ok', 'latency', 'detail'])):
+    """Outcome of one tier. ok is None when the tier could not tell."""
+    __slots__ = ()
+
+
+class ConnectivityReport(namedtuple('ConnectivityReport', ['up', 'decided_by', 'tiers'])):
+    """Overall verdict, which tier settled it and every tier that ran."""
+    __slots__ = ()
+
+    def verdicts(self):
+        """Each tier's verdict without the timings, the same for every check that failed the same way."""
+        return tuple((t.tier, t.ok) for t in self.tiers)
+
+    def describe(self):
+        return ', '.join(
+            f"{t.tier}={'ok' if t.ok else 'unknown' if t.ok is None else 'fail'} ({t.latency * 1000:.0f}ms)"
+            for t in self.tiers
+        )
+
+    def to_dict(self):
+        return {'up': self.up, 'decided_by': self.decided_by, 'tiers': [list(t) for t in self.tiers]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['up'], data['decided_by'], [TierResult(*t) for t in data['tiers']])
+
+
+def _timed(tier, func, *args):
+    started = time.monotonic()
+    ok, detail = func(*args)
+    latency = time.monotonic() - started
+    TIER_LATENCY.observe(latency, tier=tier)
+    if ok is False:
+        TIER_FAILURES.inc(tier=tier)
+    return TierResult(tier, ok, latency, detail)
+
+
+def check_default_route(route_files=('/proc/net/route', '/proc/net/ipv6_route')):
+    """Look for a default route in the kernel routing tables (Linux only)."""
+    readable = False
+    for path in route_files:
+        try:
+            with open(path, encoding='ascii') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        readable = True
+        if path.endswith('ipv6_route'):
+            # destination and prefix length are the first two columns
+            for line in lines:
+                fields = line.split()
+                if len(fields) >= 10 and fields[0] == '0' * 32 and fields[1] == '00' and fields[9] != 'lo':
+                    return True, f"IPv6 default route via {fields[9]}"
+        else:
+            for line in lines[1:]:
+                fields = line.split()
+                if len(fields) >= 2 and fields[1] == '00000000':
+                    return True, f"default route via {fields[0]}"
+    if not readable:
+        return None, "routing table not available"
+    return False, "no default route"
+
+
+def check_tcp(hosts=RESOLVERS, port=53, timeout=TCP_TIMEOUT):
+    """Open TCP connections to all hosts at once and succeed on the first one that completes."""
+    selector = selectors.DefaultSelector()
+    sockets = []
+    try:
+        for host in hosts:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            sockets.append(sock)
+            result = sock.connect_ex((host, port))
+            if result == 0:
+                return True, f"connected to {host}:{port}"
+            if result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                selector.register(sock, selectors.EVENT_WRITE, host)
+
+        deadline = time.monotonic() + timeout
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                selector.unregister(key.fileobj)
+                if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    return True, f"connected to {key.data}:{port}"
+        return False, f"no TCP connection to {', '.join(hosts)} within {timeout}s"
+    finally:
+        selector.close()
+        for sock in sockets:
+            sock.close()
+
+
+def _build_dns_query(query_id, name):
+    header = struct.pack('>HHHHHH', query_id, 0x0100, 1, 0, 0, 0)  # recursion desired, 1 question
+    qname = b''.join(bytes([len(label)]) + label.encode('ascii') for label in name.split('.')) + b'\0'
+    return header + qname + struct.pack('>HH', 1, 1)  # type A, class IN
+
+
+def check_dns(servers=RESOLVERS, name=DNS_QUERY_NAME, timeout=DNS_TIMEOUT):
+    """Send one DNS query to every server over UDP and succeed on the first valid answer."""
+    query_id = struct.unpack('>H', os.urandom(2))[0]
+    query = _build_dns_query(query_id, name)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for server in servers:
+            try:
+                sock.sendto(query, (server, 53))
+            except OSError:
+                continue
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, f"no DNS answer for {name} within {timeout}s"
+            sock.settimeout(remaining)
+            try:
+                reply, (server, _) = sock.recvfrom(512)
+            except (socket.timeout, ConnectionRefusedError):
+                continue  # a refusal from one server says nothing about the others
+            except OSError as e:
+                return False, f"DNS query failed: {e}"
+            if len(reply) < 12:
+                continue
+            reply_id, flags = struct.unpack('>HH', reply[:4])
+            # Must be our response (QR set) with RCODE 0 or NXDOMAIN: either proves the resolver is reachable
+            if reply_id == query_id and flags & 0x8000 and (flags & 0x000F) in (0, 3):
+                return True, f"answer from {server}"
+
+
+def check_https(urls=HTTPS_SERVICES, timeout=HTTPS_TIMEOUT, session=None):
+    """Request every URL at once through the shared HTTP pool and succeed on the first 2xx answer."""
+    if session is None:
+        from ipreport.httpclient import get_session
+
+        session = get_session()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(urls))
+    futures = {executor.submit(session.get, url, timeout=timeout): url for url in urls}
+    errors = []
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=timeout + 0.1):
+            try:
+                future.result().raise_for_status()
+                return True, f"answer from {futures[future]}"
+            except Exception as e:
+                errors.append(f"{futures[future]}: {e}")
+    except concurrent.futures.TimeoutError:
+        errors.append(f"no answer within {timeout}s")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return False, '; '.join(errors)
+
+
+class ConnectivityChecker:
+    """Runs the tiers in order and stops as soon as the answer is clear."""
+
+    def __init__(self, resolvers=RESOLVERS, https_urls=HTTPS_SERVICES, tcp_timeout=TCP_TIMEOUT,
+                 dns_timeout=DNS_TIMEOUT, https_timeout=HTTPS_TIMEOUT, session=None):
+        self.resolvers = resolvers
+        self.session = session
+        self.https_urls = https_urls
+        self.tcp_timeout = tcp_timeout
+        self.dns_timeout = dns_timeout
+        self.https_timeout = https_timeout
+
+    def check(self):
+        """
+        Decide whether the internet is reachable.
+
+        Returns:
+            ConnectivityReport: up is True or False, decided_by names the tier that
+            settled it.
+        """
+        tiers = []
+
+        route = _timed('route', check_default_route)
+        tiers.append(route)
+        if route.ok is False:
+            return self._report(False, route, tiers)
+
+        tcp = _timed('tcp', check_tcp, self.resolvers, 53, self.tcp_timeout)
+        dns = _timed('dns', check_dns, self.resolvers, DNS_QUERY_NAME, self.dns_timeout)
+        tiers += [tcp, dns]
+        if tcp.ok and dns.ok:
+            return self._report(True, dns, tiers)
+
+        # Mixed or all-failed cheap tiers: could be a filtered port 53, ask the real services
+        https = _timed('https', check_https, self.https_urls, self.https_timeout, self.session)
+        tiers.append(https)
+        return self._report(bool(https.ok), https, tiers)
+
+    @staticmethod
+    def _report(up, decisive, tiers):
+        report = ConnectivityReport(up, decisive.tier, tiers)
+        if not up:
+            # The latencies differ on every check, so the log deduplication keys on the verdicts instead
+            logging.warning("Connectivity check failed at tier '%s': %s [%s]",
+                            decisive.tier, decisive.detail, report.describe(),
+                            extra={'dedup_key': report.verdicts()})
+        elif logging.getLogger().isEnabledFor(logging.DEBUG):
+            # Runs every cycle, don't build the description for nothing
+            logging.debug("Connectivity check passed at tier '%s' [%s]", decisive.tier, report.describe())
+        return report
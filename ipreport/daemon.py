@@ -0,0 +1,892 @@
+"""
+Single-process IP reporter and connectivity watchdog.
+
+Every check_interval the probe task asks the echo services for the public IP
+and the connectivity task runs the tiered check from ipreport.connectivity.
+In events mode the probe instead runs when the local network changes (see
+ipreport.netevents), plus a slow safety-net poll.
+With a probe cache (see ipreport.probecache), both first look for a fresh
+result from another ipreport process on the host before probing themselves.
+Both broadcast their results to every other task. The publish, watchdog and
+remediation tasks each react to that shared stream and are switched on and off
+through the configuration (see ipreport.config), so one process and one set of
+probes replace the separate reporter and watchdog scripts.
+
+Everything is scheduled on an asyncio event loop. Blocking ftplib, requests and
+subprocess calls run on per-task worker threads under a timeout.
+
+Modules only some configurations need (fleet mode, requests in lean mode,
+http.server without a metrics port) are imported when first used, which keeps
+start-up fast on small boards; see ipreport.footprint for what it costs.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import signal
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from ipreport import footprint, logs, metrics
+from ipreport.config import Config
+from ipreport.connectivity import ConnectivityChecker, ConnectivityReport
+from ipreport.ftps import FTPSSession
+from ipreport.leanhttp import LeanSession
+from ipreport.lookup import IP_SERVICES, IP_SERVICES_BY_FAMILY, resolve_public_ip
+from ipreport.netevents import NetlinkMonitor, watch_networkmanager
+from ipreport.outbox import Outbox
+from ipreport.probecache import ProbeCache
+from ipreport.providers import ProviderRegistry
+from ipreport.publish import (
+    FTPSPublisher,
+    LocalDirPublisher,
+    SFTPPublisher,
+    WebDAVPublisher,
+    WebhookPublisher,
+)
+from ipreport.remediation import RemediationLadder, default_interface, needs_interface, parse_ladder, run_action
+from ipreport.schedule import Schedule
+from ipreport.state import PublishState
+from ipreport.uptime import UptimeRecorder
+
+PUBLISH_RETRIES = metrics.counter(
+    'ipreport_publish_retries_total', 'Publish attempts that failed and were retried.', ['backend'])
+PUBLISH_FAILURES = metrics.counter(
+    'ipreport_publish_failures_total', 'Publishes abandoned after all retries.', ['backend'])
+IP_AGE = metrics.gauge(
+    'ipreport_ip_age_seconds', 'Time since the published IP last changed.')
+CONSECUTIVE_FAILURES = metrics.gauge(
+    'ipreport_consecutive_failures', 'Connectivity checks failed in a row.')
+SCHEDULE_MISSED = metrics.counter(
+    'ipreport_schedule_missed_total', 'Scheduled runs dropped because the previous run overran.', ['task'])
+SCHEDULE_LAG = metrics.gauge(
+    'ipreport_schedule_lag_seconds', 'How late the last run started, jitter included.', ['task'])
+NETWORK_CHANGES = metrics.counter(
+    'ipreport_network_changes_total', 'Local network changes reported by rtnetlink or NetworkManager.')
+
+
+def cache_ttl(config, interval):
+    """
+    Oldest shared result a task probing every interval seconds may reuse.
+
+    At most half the interval: with the whole interval, the result this
+    process probed one tick earlier could still count as fresh after a little
+    scheduling jitter, and with a TTL longer than the interval a process would
+    skip its own probes, missing an IP change for up to probe_cache_ttl.
+    """
+    return min(config.probe_cache_ttl, interval / 2)
+
+
+class ProbeResult(namedtuple('ProbeResult', ['timestamp', 'ip', 'latency', 'uplinks'], defaults=(None,))):
+    """
+    Outcome of one probe cycle. ip is None when no echo service answered.
+
+    When uplinks or address families are probed separately, uplinks maps each
+    uplink to {'ipv4': ip, 'ipv6': ip} (None where the lookup failed) and ip is
+    the address of the first configured uplink and family.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.ip is not None
+
+    def to_dict(self):
+        return self._asdict()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class Task:
+    """
+    Base class for daemon tasks.
+
+    Tasks with an interval have the coroutine run() started on that fixed-rate
+    schedule, cancelled if it takes longer than timeout. serve() is started once
+    and may run for the life of the daemon. Any task can react to events by
+    defining plain (non-blocking) on_<event> methods, e.g. on_probe(result).
+    Blocking work belongs in daemon.to_thread().
+    """
+    name = None
+    interval = None
+    timeout = None
+
+    def start(self, daemon):
+        self.daemon = daemon
+
+    async def run(self):
+        pass
+
+    async def serve(self):
+        pass
+
+    def close(self):
+        pass
+
+
+ProbeTarget = namedtuple('ProbeTarget', ['uplink', 'family', 'registry', 'session'])
+
+
+class ProbeTask(Task):
+    """
+    Looks up the public IP on a schedule and whenever the local network changes.
+
+    In events mode the schedule is only the slow safety-net poll; the probes
+    that matter are triggered by 'network_change' events from NetEventsTask.
+
+    With targets (see build_probe_targets), every uplink and address family is
+    looked up at the same time, each through its own bound session and echo
+    services, and the result carries all of them. The primary IP always comes
+    from the first target: when only its lookup fails, the previous primary is
+    kept rather than switching to another uplink's address for one cycle.
+
+    With a cache, a result another process probed within the TTL is reused,
+    but never one older than half the interval (see cache_ttl). Probes triggered by a network change only accept results from after it.
+    """
+    name = 'probe'
+
+    def __init__(self, config, registry, session=None, targets=(), cache=None):
+        self.config = config
+        self.registry = registry
+        self.session = session
+        self.targets = list(targets)
+        self.cache = cache
+        # Processes probing different uplinks or families must not share results
+        self.cache_name = 'ip'
+        if self.targets:
+            signature = ','.join(f"{t.uplink}/{t.family}" for t in self.targets)
+            self.cache_name = f"ip:{zlib.crc32(signature.encode('utf-8')):08x}"
+        self.interval = config.safety_poll_interval if config.probe_mode == 'events' else config.check_interval
+        self.cache_ttl = cache_ttl(config, self.interval)
+        # resolve_public_ip enforces the per-service budgets, this is only a backstop
+        self.timeout = config.connection_timeout + 5
+        self._triggered = None
+        self._changed_at = None
+        self._primary = None  # last primary IP found through the first target
+
+    def start(self, daemon):
+        super().start(daemon)
+        self._triggered = asyncio.Event()
+
+    def on_network_change(self, changes):
+        self._changed_at = time.monotonic()
+        self._triggered.set()
+
+    async def serve(self):
+        while True:
+            await self._triggered.wait()
+            self._triggered.clear()
+            try:
+                await asyncio.wait_for(self.run(not_before=self._changed_at), self.timeout)
+            except asyncio.TimeoutError:
+                logging.error(f"Triggered probe did not finish within {self.timeout}s.")
+
+    async def run(self, not_before=None):
+        if self.cache is None:
+            result = await self._probe()
+        else:
+            loop = asyncio.get_running_loop()
+
+            def probe():
+                # Runs on the cache thread, the lookups themselves still go through the event loop
+                return asyncio.run_coroutine_threadsafe(self._probe(), loop).result(self.timeout).to_dict()
+
+            entry = await self.daemon.to_thread(
+                f"{self.name}-cache", self.cache.get_or_probe, self.cache_name, probe, ttl=self.cache_ttl,
+                not_before=not_before
+            )
+            result = ProbeResult.from_dict(entry.value)
+        self.daemon.emit('probe', result)
+
+    async def _probe(self):
+        started = time.monotonic()
+        if self.targets:
+            return await self._probe_targets(started)
+        ip = await self.daemon.to_thread(
+            self.name,
+            resolve_public_ip,
+            timeout=self.config.connection_timeout,
+            quorum=self.config.ip_quorum,
+            registry=self.registry,
+            session=self.session
+        )
+        return ProbeResult(time.time(), ip, time.monotonic() - started)
+
+    async def _probe_targets(self, started):
+        ips = await asyncio.gather(*(
+            self.daemon.to_thread(
+                f"{self.name}-{target.uplink}-{target.family}",
+                resolve_public_ip,
+                services=IP_SERVICES_BY_FAMILY[target.family],
+                timeout=self.config.connection_timeout,
+                quorum=self.config.ip_quorum,
+                registry=target.registry,
+                session=target.session,
+                version=int(target.family[-1])
+            )
+            for target in self.targets
+        ))
+        uplinks = {}
+        for target, ip in zip(self.targets, ips):
+            uplinks.setdefault(target.uplink, {})[target.family] = ip
+        if ips[0] is not None:
+            self._primary = ips[0]
+        elif any(ip is not None for ip in ips):
+            logging.warning(f"Lookup through {self.targets[0].uplink}/{self.targets[0].family} failed, "
+                            f"keeping {self._primary} as the primary IP")
+        else:
+            # Nothing answered at all: a failed probe, whatever was seen before
+            return ProbeResult(time.time(), None, time.monotonic() - started, uplinks)
+        return ProbeResult(time.time(), self._primary, time.monotonic() - started, uplinks)
+
+    def close(self):
+        # Health is otherwise only saved on breaker changes or hourly
+        for registry in {id(r): r for r in [self.registry] + [t.registry for t in self.targets]}.values():
+            registry.save()
+
+
+class NetEventsTask(Task):
+    """
+    Turns local network change notifications into 'network_change' events.
+
+    Changes arrive in bursts (link up, address assigned, default route added),
+    so they are collected for event_debounce seconds and emitted together.
+    """
+    name = 'netevents'
+
+    def __init__(self, config):
+        self.debounce = config.event_debounce
+        self.monitor = None
+        self._changes = []
+        self._changed = None
+
+    def start(self, daemon):
+        super().start(daemon)
+        self._changed = asyncio.Event()
+        try:
+            self.monitor = NetlinkMonitor().open()
+        except (OSError, AttributeError) as e:
+            # AttributeError: no AF_NETLINK outside Linux
+            logging.warning(f"rtnetlink not available, relying on NetworkManager and the safety poll: {e}")
+
+    def _note(self, change):
+        self._changes.append(change)
+        self._changed.set()
+
+    def _on_readable(self):
+        try:
+            changes = self.monitor.read()
+        except OSError as e:
+            changes = [f"netlink read failed: {e}"]
+        for change in changes:
+            self._note(change)
+
+    async def serve(self):
+        if self.monitor is not None:
+            asyncio.get_running_loop().add_reader(self.monitor.fileno(), self._on_readable)
+        self.daemon.spawn(watch_networkmanager(self._note))
+        while True:
+            await self._changed.wait()
+            await asyncio.sleep(self.debounce)
+            self._changed.clear()
+            changes, self._changes = self._changes, []
+            NETWORK_CHANGES.inc(len(changes))
+            logging.info(f"Local network changed: {'; '.join(changes)}")
+            self.daemon.emit('network_change', changes)
+
+    def close(self):
+        if self.monitor is not None:
+            self.monitor.close()
+
+
+class ConnectivityTask(Task):
+    """Cheap tiered reachability check feeding the watchdog, shared through the cache if there is one."""
+    name = 'connectivity'
+
+    def __init__(self, config, checker, cache=None):
+        self.checker = checker
+        self.cache = cache
+        self.interval = config.check_interval
+        self.cache_ttl = cache_ttl(config, self.interval)
+        self.timeout = config.connection_timeout
+
+    def _check(self):
+        if self.cache is None:
+            return self.checker.check()
+        entry = self.cache.get_or_probe('connectivity', lambda: self.checker.check().to_dict(), ttl=self.cache_ttl)
+        return ConnectivityReport.from_dict(entry.value)
+
+    async def run(self):
+        report = await self.daemon.to_thread(self.name, self._check)
+        self.daemon.emit('connectivity', report)
+
+
+class PublishTask(Task):
+    """
+    Publishes the latest probed IP in the background.
+
+    Probes only hand over their result, so a slow or retrying upload never delays
+    the next probe. If several results arrive while an upload is in progress,
+    only the newest one is published afterwards. Every backend has its own
+    worker and thread, so one failing or slow backend doesn't hold up the others.
+
+    IP changes are written to each backend's outbox as soon as they are probed,
+    so the time of every change is kept even while a backend is unreachable;
+    its worker drains the outbox with the next upload that gets through.
+    """
+    name = 'publish'
+
+    def __init__(self, publishers, max_retries=3, attempt_timeout=60):
+        self.publishers = publishers
+        self.max_retries = max_retries
+        self.attempt_timeout = attempt_timeout
+        # Startup counts as a success so the watchdog gives the first publish a chance.
+        # Monotonic, so staleness is immune to wall-clock steps.
+        started = time.monotonic()
+        self.last_success_by_backend = {p.name: started for p in publishers}
+        self._latest_ip = None
+        self._latest_uplinks = None
+        self._wakeups = {}
+        self._published_once = False
+        IP_AGE.set_function(publishers[0].state.ip_age)
+
+    @property
+    def last_success(self):
+        """When any backend last published successfully, i.e. the network was usable."""
+        return max(self.last_success_by_backend.values())
+
+    def start(self, daemon):
+        super().start(daemon)
+        self._wakeups = {p.name: asyncio.Event() for p in self.publishers}
+
+    def on_probe(self, result):
+        if result.ok:
+            self._latest_ip = result.ip
+            self._latest_uplinks = result.uplinks
+            seen = datetime.fromtimestamp(result.timestamp)
+            for publisher in self.publishers:
+                if publisher.outbox is None:
+                    self._wakeups[publisher.name].set()
+                else:
+                    self.daemon.spawn(self._enqueue(publisher, result.ip, seen))
+
+    async def _enqueue(self, publisher, ip, seen):
+        # The journal is fsync'd, so off the loop, and on a thread of its own rather
+        # than behind an upload that may be hanging
+        try:
+            if await self.daemon.to_thread(f"{self.name}-{publisher.name}-outbox", publisher.outbox.enqueue, ip, seen):
+                logging.info(f"Queued IP change to {ip} for {publisher.name}")
+        finally:
+            # Woken only now, so the upload includes the change
+            self._wakeups[publisher.name].set()
+
+    async def serve(self):
+        await asyncio.gather(*(self._worker(p) for p in self.publishers))
+
+    async def _worker(self, publisher):
+        wakeup = self._wakeups[publisher.name]
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            if await self._publish(publisher, self._latest_ip, self._latest_uplinks):
+                self.last_success_by_backend[publisher.name] = time.monotonic()
+                if not self._published_once:
+                    self._published_once = True
+                    logging.info(f"First IP published {footprint.describe('first_publish')}")
+
+    async def _publish(self, publisher, ip, uplinks=None):
+        owner = f"{self.name}-{publisher.name}"
+        for retry_count in range(1, self.max_retries + 1):
+            try:
+                if await self.daemon.to_thread(owner, publisher.attempt, ip, uplinks,
+                                                timeout=self.attempt_timeout):
+                    return True
+            except asyncio.TimeoutError:
+                logging.error(f"{publisher.name} update took longer than {self.attempt_timeout}s.")
+            logging.warning(f"{publisher.name} update attempt {retry_count} of {self.max_retries} failed.")
+            if retry_count < self.max_retries:
+                PUBLISH_RETRIES.inc(backend=publisher.name)
+                await asyncio.sleep(5 * retry_count)  # Exponential backoff
+
+        logging.error(f"Failed to update {publisher.name} after {self.max_retries} attempts.")
+        PUBLISH_FAILURES.inc(backend=publisher.name)
+        return False
+
+    def close(self):
+        for publisher in self.publishers:
+            publisher.close()
+
+
+class FleetTask(Task):
+    """Probe and publish for every site in the fleet file, once per interval."""
+    name = 'fleet'
+
+    def __init__(self, config, fleet):
+        self.fleet = fleet
+        self.interval = config.check_interval
+        self._started = time.monotonic()
+
+    @property
+    def last_success(self):
+        """When any site was last found up to date, i.e. the network was usable (see PublishTask)."""
+        return max((site.last_success for site in self.fleet.sites), default=self._started)
+
+    async def run(self):
+        await self.daemon.to_thread(self.name, self.fleet.run_cycle)
+
+    def close(self):
+        self.fleet.close()
+
+
+class WatchdogTask(Task):
+    name = 'watchdog'
+
+    def __init__(self, config):
+        self.max_failures = config.reboot_after_failures
+        self.stale_after = config.publish_stale_after
+        if self.stale_after and config.probe_mode == 'events':
+            # Publishes follow probes, which may now be a whole safety poll apart
+            self.stale_after += config.safety_poll_interval
+        self.consecutive_failures = 0
+
+    def on_connectivity(self, report):
+        if report.up:
+            if self.consecutive_failures > 0:
+                logging.info(f"Internet connection restored after {self.consecutive_failures} failures")
+                self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            logging.warning("Internet connection failed. Consecutive failures: %d", self.consecutive_failures)
+        CONSECUTIVE_FAILURES.set(self.consecutive_failures)
+
+        reason = None
+        if self.consecutive_failures >= self.max_failures:
+            reason = f"{self.consecutive_failures} consecutive failed connectivity checks"
+        elif self.stale_after:
+            # Either task keeps last_success, in fleet mode across all of its sites
+            publish = self.daemon.tasks.get('publish') or self.daemon.tasks.get('fleet')
+            if publish is not None and time.monotonic() - publish.last_success > self.stale_after:
+                reason = f"no successful update for more than {self.stale_after}s"
+
+        if reason:
+            logging.error("Connectivity lost: %s.", reason)
+            self.consecutive_failures = 0
+            CONSECUTIVE_FAILURES.set(0)
+            self.daemon.emit('connectivity_lost', reason)
+
+
+class RemediationTask(Task):
+    """
+    Climbs the remediation ladder while the watchdog reports the connection lost.
+
+    One step runs at a time. remediation_verify_delay seconds after a step, a
+    connectivity check decides whether it worked (back to the bottom of the
+    ladder) or not (next step, once this one's cooldown has passed).
+
+    Steps that bounce an interface use remediation_interface, or else the
+    default route's. While the link is down the route usually is too, so the
+    interface that last carried it is remembered; if none ever was seen, those
+    steps are skipped.
+    """
+    name = 'remediation'
+
+    def __init__(self, config, checker, cache=None):
+        self.checker = checker
+        self.cache = cache
+        self.ladder = RemediationLadder(
+            parse_ladder(config.remediation_ladder),
+            state_path=config.remediation_state_file,
+            max_reboots=config.remediation_max_reboots,
+            reboot_window=config.remediation_reboot_window
+        )
+        self.verify_delay = config.remediation_verify_delay
+        self.interface = config.remediation_interface or None
+        self.busy = False
+
+    def on_connectivity(self, report):
+        # The ladder only ever runs on this task's worker thread, which keeps its fsynced saves off the
+        # event loop and never lets two of them race for the temporary file
+        if report.up and not self.busy and not self.ladder.at_rest:
+            self.daemon.spawn(self.daemon.to_thread(self.name, self.ladder.reset))
+        if report.up and not self.interface:
+            route = default_interface()
+            if route is not None and route != self.ladder.interface:
+                logging.info(f"Default route is on {route}.")
+                self.daemon.spawn(self.daemon.to_thread(self.name, self.ladder.remember_interface, route))
+
+    def on_connectivity_lost(self, reason):
+        if self.busy:
+            logging.warning("Remediation already in progress.")
+            return
+        interface = self.interface or default_interface() or self.ladder.interface
+        skip = ()
+        if interface is None:
+            skip = {step.action for step in self.ladder.steps if needs_interface(step.action)}
+            if skip:
+                logging.warning("No default route seen yet and REMEDIATION_INTERFACE is unset, "
+                                "so no interface can be bounced.")
+        self.busy = True
+        self.daemon.spawn(self._climb(skip, interface))
+
+    async def _climb(self, skip, interface):
+        try:
+            step = await self.daemon.to_thread(self.name, self.ladder.due, skip=skip)
+            if step is not None:
+                await self._remediate(step, interface)
+        finally:
+            self.busy = False
+
+    async def _remediate(self, step, interface=None):
+        await self.daemon.to_thread(self.name, run_action, step.action, interface=interface)
+        await asyncio.sleep(self.verify_delay)
+        # Always a fresh check, but shared so other processes see the outcome too
+        report = await self.daemon.to_thread(self.name, self.checker.check)
+        if self.cache is not None:
+            await self.daemon.to_thread(self.name, self.cache.write, 'connectivity', report.to_dict())
+        self.daemon.emit('remediation', step.action, report.up)
+        if report.up:
+            logging.info(f"Connection restored after remediation '{step.action}'.")
+            await self.daemon.to_thread(self.name, self.ladder.reset)
+        else:
+            logging.warning(f"Remediation '{step.action}' did not help ({report.describe()}).")
+            await self.daemon.to_thread(self.name, self.ladder.escalate)
+
+
+class UptimeTask(Task):
+    """
+    Keeps the on-device uptime record (see ipreport.uptime).
+
+    Outages follow the connectivity checks when the watchdog runs, otherwise
+    the IP probes.
+    """
+    name = 'uptime'
+
+    def __init__(self, config, recorder):
+        self.recorder = recorder
+        self.probes_track_outages = not config.enable_watchdog
+
+    def on_connectivity(self, report):
+        self.recorder.record_check(time.time(), report.up, sum(t.latency for t in report.tiers), report.decided_by)
+
+    def on_probe(self, result):
+        self.recorder.record_probe(result.timestamp, result.ok, result.latency, self.probes_track_outages)
+
+    def on_remediation(self, action, helped):
+        self.recorder.record_remediation(time.time(), action, helped)
+
+    def close(self):
+        self.recorder.close()
+
+
+class MetricsTask(Task):
+    """Serves metrics over HTTP and/or refreshes the node_exporter textfile."""
+    name = 'metrics'
+
+    def __init__(self, config):
+        self.port = config.metrics_port
+        self.address = config.metrics_address
+        self.textfile = config.metrics_textfile
+        self.interval = config.check_interval if self.textfile else None
+        self.server = None
+
+    def start(self, daemon):
+        super().start(daemon)
+        if self.port:
+            self.server = metrics.serve(self.address, self.port)
+
+    async def run(self):
+        await self.daemon.to_thread(self.name, metrics.write_textfile, self.textfile)
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.textfile:
+            metrics.write_textfile(self.textfile)
+
+
+class Daemon:
+    """
+    asyncio runtime: fixed-rate timers for periodic tasks, events fanned out to all tasks.
+
+    Periodic tasks run on the monotonic event loop clock (see ipreport.schedule),
+    with jitter and the configured catch-up policy.
+
+    Blocking calls (ftplib, requests, subprocess) run through to_thread() on one
+    worker thread per task. A stuck upload therefore only ever holds up later
+    uploads, never the probe schedule. Work on the same task stays serialised, so
+    objects like the FTPS session are never used from two threads at once.
+
+    resources are objects several tasks share, such as the probe cache and the
+    lean HTTP sessions; they are closed after the tasks.
+    """
+
+    def __init__(self, tasks, jitter=0.0, catch_up='skip', resources=()):
+        self.tasks = {task.name: task for task in tasks}
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.resources = list(resources)
+        self._executors = {}
+        self._background = set()
+
+    def emit(self, event, *args):
+        for task in self.tasks.values():
+            handler = getattr(task, f'on_{event}', None)
+            if handler is None:
+                continue
+            try:
+                handler(*args)
+            except Exception:
+                logging.exception(f"Task '{task.name}' failed handling '{event}'")
+
+    async def to_thread(self, owner, func, *args, timeout=None, **kwargs):
+        """Run a blocking call on the owner task's worker thread, optionally with a timeout."""
+        executor = self._executors.get(owner)
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=owner)
+            self._executors[owner] = executor
+        future = asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(func, *args, **kwargs)
+        )
+        return await asyncio.wait_for(future, timeout)
+
+    def spawn(self, coro):
+        """Run a coroutine in the background, logging rather than losing its errors."""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._reap)
+        return task
+
+    def _reap(self, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("Background job failed", exc_info=task.exception())
+
+    async def _periodic(self, task):
+        loop = asyncio.get_running_loop()
+        schedule = Schedule(task.interval, loop.time(), jitter=self.jitter, catch_up=self.catch_up)
+        run_at = schedule.first()
+        while True:
+            delay = run_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            SCHEDULE_LAG.set(max(0.0, loop.time() - schedule.slot), task=task.name)
+            try:
+                await asyncio.wait_for(task.run(), task.timeout)
+            except asyncio.TimeoutError:
+                logging.error(f"Task '{task.name}' did not finish within {task.timeout}s.")
+            except Exception:
+                logging.exception(f"Task '{task.name}' failed")
+
+            missed = schedule.missed
+            run_at = schedule.advance(loop.time())
+            if schedule.missed > missed:
+                SCHEDULE_MISSED.inc(schedule.missed - missed, task=task.name)
+                logging.warning(f"Task '{task.name}' overran its {task.interval}s interval, "
+                                f"dropped {schedule.missed - missed} run(s).")
+
+    async def _serve(self, task):
+        try:
+            await task.serve()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception(f"Task '{task.name}' stopped unexpectedly")
+
+    async def run(self):
+        for task in self.tasks.values():
+            task.start(self)
+
+        loop = asyncio.get_running_loop()
+        current = asyncio.current_task()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, current.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not supported on this platform
+
+        jobs = [self._serve(task) for task in self.tasks.values()]
+        jobs += [self._periodic(task) for task in self.tasks.values() if task.interval]
+        try:
+            await asyncio.gather(*jobs)
+        except asyncio.CancelledError:
+            logging.info("Received stop signal. Shutting down gracefully...")
+
+    def close(self):
+        for task in self.tasks.values():
+            try:
+                task.close()
+            except Exception as e:
+                logging.warning(f"Error closing task '{task.name}': {e}")
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+        for resource in self.resources:
+            try:
+                resource.close()
+            except Exception as e:
+                logging.warning(f"Error closing {type(resource).__name__}: {e}")
+
+
+def build_publishers(config, http_session=None, uptime=None):
+    """
+    Create the configured publish backends, each with its own dirty-tracking state.
+
+    uptime, an UptimeRecorder, has its report published with every heartbeat.
+    """
+    if http_session is not None:
+        http_stats = http_session.describe_stats
+    else:
+        from ipreport.httpclient import describe_stats as http_stats
+    publishers = []
+    for backend in [b.strip() for b in config.publish_backends.split(',') if b.strip()]:
+        # The FTPS backend keeps the original state file name for existing installs
+        state_file = config.state_file
+        outbox_file = config.outbox_file
+        if backend != 'ftps':
+            root, ext = os.path.splitext(config.state_file)
+            state_file = f"{root}.{backend}{ext}"
+            root, ext = os.path.splitext(config.outbox_file)
+            outbox_file = f"{root}.{backend}{ext}"
+        state = PublishState(state_file, heartbeat_interval=config.heartbeat_interval)
+
+        if backend == 'ftps':
+            session = FTPSSession(
+                config.ftp_host, config.ftp_user, config.ftp_pass, config.remote_path,
+                timeout=config.connection_timeout, encoding=config.ftp_encoding
+            )
+            publishers.append(FTPSPublisher(session, state, http_stats=http_stats))
+        elif backend == 'sftp':
+            publishers.append(SFTPPublisher(
+                state, config.sftp_host, config.sftp_user,
+                password=config.sftp_pass, key_file=config.sftp_key_file,
+                remote_path=config.sftp_path, port=config.sftp_port,
+                timeout=config.connection_timeout
+            ))
+        elif backend == 'webdav':
+            publishers.append(WebDAVPublisher(
+                state, config.webdav_url, config.webdav_user, config.webdav_pass,
+                timeout=config.connection_timeout
+            ))
+        elif backend == 'webhook':
+            publishers.append(WebhookPublisher(
+                state, config.webhook_url, config.webhook_token, timeout=config.connection_timeout
+            ))
+        elif backend == 'local':
+            publishers.append(LocalDirPublisher(state, config.local_publish_dir))
+        else:
+            raise ValueError(f"Unknown publish backend '{backend}'")
+        publishers[-1].outbox = Outbox(
+            outbox_file, backend, last_published_ip=state.ip, max_events=config.outbox_max_events
+        )
+        publishers[-1].uptime = uptime
+        publishers[-1].uptime_days = config.uptime_report_days
+
+    if not publishers:
+        raise ValueError("PUBLISH_BACKENDS is empty")
+    return publishers
+
+
+def build_probe_targets(config, lean=False):
+    """
+    The (uplink, address family) lookups configured with UPLINKS and IP_FAMILIES.
+
+    Returns:
+        list: ProbeTarget tuples, empty for the classic single lookup over any family.
+    """
+    interfaces = [i.strip() for i in config.uplinks.split(',') if i.strip()]
+    families = [f"ipv{f.strip()}" for f in config.ip_families.split(',') if f.strip()]
+    if not interfaces and not families:
+        return []
+    for family in families:
+        if family not in IP_SERVICES_BY_FAMILY:
+            raise ValueError(f"Unknown address family '{family[3:]}' in IP_FAMILIES, use 4 and/or 6")
+
+    targets = []
+    root, ext = os.path.splitext(config.provider_state_file)
+    for interface in interfaces or [None]:
+        uplink = interface or 'default'
+        if lean:
+            session = LeanSession(interface=interface)
+        else:
+            from ipreport.httpclient import get_session
+
+            session = get_session(interface=interface)
+        for family in families or ['ipv4']:
+            registry = ProviderRegistry(
+                IP_SERVICES_BY_FAMILY[family], state_path=f"{root}.{uplink}.{family}{ext}"
+            )
+            targets.append(ProbeTarget(uplink, family, registry, session))
+    return targets
+
+
+def build_tasks(config, resources=None):
+    """The configured tasks; shared objects they need closed afterwards are added to resources."""
+    tasks = []
+    # Lean mode probes through http.client and never imports requests
+    http_session = LeanSession() if config.lean else None
+    if http_session is not None and resources is not None:
+        resources.append(http_session)  # so its idle keep-alive connections are closed on shutdown
+    cache = ProbeCache(config.probe_cache_file, config.probe_cache_ttl).open() if config.probe_cache_file else None
+    if cache is not None and resources is not None:
+        resources.append(cache)
+    uptime = UptimeRecorder(config.uptime_file, config.uptime_capacity).open() if config.uptime_file else None
+    if config.enable_publish and config.fleet_file:
+        from ipreport.fleet import Fleet
+
+        tasks.append(FleetTask(config, Fleet.load(config.fleet_file, config)))
+    elif config.enable_publish:
+        if config.probe_mode not in ('poll', 'events'):
+            raise ValueError(f"Unknown probe mode '{config.probe_mode}'")
+        registry = ProviderRegistry(IP_SERVICES, state_path=config.provider_state_file)
+        targets = build_probe_targets(config, config.lean)
+        if config.lean and resources is not None:
+            resources.extend({id(target.session): target.session for target in targets}.values())
+        tasks.append(ProbeTask(config, registry, session=http_session, targets=targets, cache=cache))
+        if config.probe_mode == 'events':
+            tasks.append(NetEventsTask(config))
+
+        tasks.append(PublishTask(
+            build_publishers(config, http_session, uptime if config.uptime_publish else None),
+            max_retries=config.max_retries,
+            attempt_timeout=config.publish_timeout
+        ))
+
+    if config.enable_watchdog:
+        tasks.append(ConnectivityTask(config, ConnectivityChecker(session=http_session), cache=cache))
+        tasks.append(WatchdogTask(config))
+
+    if config.enable_remediation:
+        if not config.enable_watchdog:
+            logging.warning("Remediation is enabled without the watchdog and will never run.")
+        tasks.append(RemediationTask(config, ConnectivityChecker(session=http_session), cache=cache))
+
+    if uptime is not None:
+        tasks.append(UptimeTask(config, uptime))
+
+    if config.metrics_port or config.metrics_textfile:
+        tasks.append(MetricsTask(config))
+
+    return tasks
+
+
+def main(**overrides):
+    """Run the daemon until interrupted. Keyword arguments override the configuration."""
+    config = Config.from_env(**overrides)
+    logs.configure(config.log_level, config.log_format, config.log_dedup_window)
+    logging.info(f"Interpreter and imports ready {footprint.describe('imports')}")
+    resources = []
+    daemon = Daemon(build_tasks(config, resources), jitter=config.schedule_jitter, catch_up=config.schedule_catch_up,
+                    resources=resources)
+    logging.info(f"Starting with tasks: {', '.join(daemon.tasks)}")
+
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        logging.info("Received interrupt signal. Shutting down gracefully...")
+    finally:
+        daemon.close()
+        logs.stop()
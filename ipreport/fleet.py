@@ -0,0 +1,185 @@
+"""
+Fleet mode: one process publishing the public IP of many sites.
+
+Sites are described in a JSON file (FLEET_FILE):
+
+    {
+        "servers": {
+            "main": {"host": "ftp.example.com", "user": "ip", "password": "secret"}
+        },
+        "sites": [
+            {"name": "office", "server": "main", "remote_path": "/ip/office/",
+             "source_address": "192.168.10.2"},
+            {"name": "lab", "server": "main", "remote_path": "/ip/lab/", "interface": "wwan0"}
+        ]
+    }
+
+A server entry may also carry "port" and "encoding". A site can give "host",
+"user" and "password" inline instead of naming a server. Each site probes
+through its own source address or interface, so the answer is that uplink's
+public IP. Sites that share an FTPS server share one long-lived session, and
+all of their changes are written in one pass over it.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import time
+
+from ipreport.ftps import FTPSSession
+from ipreport.httpclient import describe_stats as describe_http_stats, get_session
+from ipreport.lookup import IP_SERVICES, resolve_public_ip
+from ipreport.providers import ProviderRegistry
+from ipreport.publish import FTPSPublisher
+from ipreport.state import PublishState
+
+SERVER_FIELDS = ('host', 'port', 'user', 'password', 'encoding')
+
+
+class Site:
+    """One reporting target: where to probe from and where to publish to."""
+
+    def __init__(self, name, server_key, publisher, registry, source_address=None, interface=None):
+        self.name = name
+        self.server_key = server_key
+        self.publisher = publisher
+        self.registry = registry
+        self.source_address = source_address
+        self.interface = interface
+        # When the site was last found up to date on its server; startup counts, as for PublishTask
+        self.last_success = time.monotonic()
+
+
+class Fleet:
+    """
+    Probes every site concurrently, then publishes changes batched per FTPS server.
+
+    Work runs on one bounded thread pool, so memory stays flat no matter how many
+    sites are configured. Per-site state (last published IP, echo service health)
+    is kept as small JSON files in state_dir.
+    """
+
+    def __init__(self, sites, sessions, config, max_workers=16):
+        self.sites = sites
+        self.sessions = sessions
+        self.config = config
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='fleet'
+        )
+
+    @classmethod
+    def load(cls, path, config):
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+
+        state_dir = config.fleet_state_dir
+        os.makedirs(state_dir, exist_ok=True)
+
+        servers = spec.get('servers', {})
+        sessions = {}
+        sites = []
+        for entry in spec['sites']:
+            name = entry['name']
+            server = dict(servers[entry['server']]) if 'server' in entry else {}
+            server.update({field: entry[field] for field in SERVER_FIELDS if field in entry})
+            key = (server['host'], server.get('port', 21), server['user'])
+
+            if key not in sessions:
+                sessions[key] = FTPSSession(
+                    server['host'], server['user'], server['password'],
+                    remote_path=None,
+                    port=server.get('port', 21),
+                    timeout=config.connection_timeout,
+                    encoding=server.get('encoding', config.ftp_encoding)
+                )
+
+            safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+            state = PublishState(
+                os.path.join(state_dir, f"{safe_name}.json"),
+                heartbeat_interval=config.heartbeat_interval
+            )
+            registry = ProviderRegistry(
+                IP_SERVICES, state_path=os.path.join(state_dir, f"{safe_name}.providers.json")
+            )
+            publisher = FTPSPublisher(
+                sessions[key], state, remote_path=entry['remote_path'], http_stats=describe_http_stats
+            )
+            sites.append(Site(
+                name, key, publisher, registry,
+                source_address=entry.get('source_address'),
+                interface=entry.get('interface')
+            ))
+
+        logging.info(f"Loaded fleet of {len(sites)} sites on {len(sessions)} FTPS servers from {path}")
+        return cls(sites, sessions, config, max_workers=config.fleet_concurrency)
+
+    def _probe(self, site):
+        # Sites sharing an uplink probe in parallel, so size the pool for that
+        session = get_session(
+            source_address=site.source_address,
+            interface=site.interface,
+            pool_size=self.config.fleet_concurrency
+        )
+        return resolve_public_ip(
+            timeout=self.config.connection_timeout,
+            quorum=self.config.ip_quorum,
+            registry=site.registry,
+            session=session
+        )
+
+    def probe_all(self):
+        """Return {site: ip} for every site that got an answer this cycle."""
+        futures = {self.executor.submit(self._probe, site): site for site in self.sites}
+        results = {}
+        for future in concurrent.futures.as_completed(futures):
+            site = futures[future]
+            try:
+                ip = future.result()
+            except Exception as e:
+                logging.error(f"[{site.name}] IP lookup failed: {e}")
+                continue
+            if ip:
+                results[site] = ip
+            else:
+                logging.warning(f"[{site.name}] No public IP this cycle.")
+        return results
+
+    def _publish_batch(self, server_key, batch):
+        """Write all changed sites of one server over its shared session, in one pass."""
+        published = 0
+        for site, ip in batch:
+            if site.publisher.attempt(ip):
+                site.last_success = time.monotonic()
+                published += 1
+            else:
+                logging.warning(f"[{site.name}] Update failed, will retry next cycle.")
+        return published
+
+    def publish_all(self, results):
+        batches = {}
+        for site, ip in results.items():
+            # Unchanged sites never touch the server
+            if site.publisher.state.pending(ip):
+                batches.setdefault(site.server_key, []).append((site, ip))
+            else:
+                site.last_success = time.monotonic()
+
+        futures = [self.executor.submit(self._publish_batch, key, batch) for key, batch in batches.items()]
+        published = 0
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                published += future.result()
+            except Exception as e:
+                logging.error(f"Fleet publish batch failed: {e}")
+        return published
+
+    def run_cycle(self):
+        results = self.probe_all()
+        published = self.publish_all(results)
+        logging.info(f"Fleet cycle: {len(results)}/{len(self.sites)} sites resolved, {published} published.")
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for session in self.sessions.values():
+            session.close()
@@ -0,0 +1,49 @@
+"""How long the process took to start and how much memory it has needed."""
+import os
+import resource
+import sys
+
+from ipreport import metrics
+
+STARTUP_SECONDS = metrics.gauge(
+    'ipreport_startup_seconds', 'Seconds from process start to each start-up milestone.', ['phase'])
+PEAK_RSS = metrics.gauge(
+    'ipreport_peak_rss_bytes', 'Peak resident memory of the process.')
+
+
+def process_age():
+    """
+    Seconds since this process was started, read from /proc (Linux).
+
+    Returns:
+        float: The age, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/stat', encoding='ascii') as f:
+            # The command name may contain spaces, so count fields from its closing parenthesis
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', encoding='ascii') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    started = int(fields[19]) / os.sysconf('SC_CLK_TCK')  # field 22, starttime
+    return max(0.0, uptime - started)
+
+
+def peak_rss():
+    """Peak resident set size in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def describe(phase):
+    """Record a start-up milestone and return a log-friendly summary of it."""
+    age = process_age()
+    if age is not None:
+        STARTUP_SECONDS.set(age, phase=phase)
+    when = f"{age * 1000:.0f}ms after process start" if age is not None else "(process age unknown)"
+    return f"{when}, peak RSS {peak_rss() / 2 ** 20:.1f} MiB"
+
+
+PEAK_RSS.set_function(peak_rss)
@@ -0,0 +1,292 @@
+"""Long-lived FTPS session shared across publish cycles."""
+import ftplib
+import io
+import logging
+import os
+
+from ipreport import metrics
+
+FTPS_SECONDS = metrics.histogram(
+    'ipreport_ftps_seconds', 'Duration of FTPS operations.', ['operation'])
+FTPS_BYTES = metrics.counter(
+    'ipreport_ftps_bytes_total', 'Payload bytes moved over FTPS data connections.', ['direction'])
+
+# Replies meaning "this server doesn't do that", as opposed to a real failure
+UNSUPPORTED_REPLIES = ('500', '502', '504')
+
+# Ways of adding a line to a remote file, cheapest first
+APPEND_MODES = ('appe', 'rest', 'rotate')
+
+
+def _is_unsupported(error):
+    return str(error)[:3] in UNSUPPORTED_REPLIES
+
+
+def rotated_name(filename, when):
+    """Monthly segment name used when a server can't append, e.g. log-2024-05.txt."""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}-{when:%Y-%m}{ext}"
+
+
+class ReusedSessionFTP_TLS(ftplib.FTP_TLS):
+    """
+    FTP_TLS that resumes the control connection's TLS session on every data connection.
+
+    Plain ftplib performs a full handshake for each STOR/RETR data channel. Resuming
+    the control session avoids that, and servers configured with
+    require_ssl_reuse (vsftpd, pure-ftpd) refuse transfers without it anyway.
+
+    ftplib also sends TYPE I (or TYPE A) before every transfer. The type stays
+    set for the rest of the connection, so only the first one goes to the
+    server, saving a round trip on every later upload.
+    """
+    _type = None  # transfer type the server was last set to
+
+    def _set_type(self, cmd, send):
+        kind = cmd[5:]
+        if kind == self._type:
+            return f"200 Type remains {kind}."
+        resp = send(cmd)
+        self._type = kind
+        return resp
+
+    def voidcmd(self, cmd):
+        if cmd in ('TYPE I', 'TYPE A'):
+            return self._set_type(cmd, super().voidcmd)
+        return super().voidcmd(cmd)
+
+    def sendcmd(self, cmd):
+        if cmd in ('TYPE I', 'TYPE A'):
+            return self._set_type(cmd, super().sendcmd)
+        return super().sendcmd(cmd)
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+        if self._prot_p:
+            conn = self.context.wrap_socket(
+                conn,
+                server_hostname=self.host,
+                session=self.sock.session
+            )
+        return conn, size
+
+
+class FTPSSession:
+    """
+    Keep one authenticated FTPS connection open between publish cycles.
+
+    acquire() returns a live connection already in the remote directory. An
+    existing connection is checked with a NOOP first and transparently replaced
+    when the server has dropped it. Callers that hit an error mid-transfer should
+    call invalidate() so the next acquire() starts from a clean connection.
+    """
+
+    def __init__(self, host, user, password, remote_path='/', port=21, timeout=15,
+                 encoding='utf-8', source_address=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.remote_path = remote_path
+        self.timeout = timeout
+        self.encoding = encoding
+        self.source_address = source_address
+
+        self._ftps = None
+        self._stale = False
+
+        # Server capabilities, learnt once and kept across reconnects and close().
+        # Narrowed down the first time the server rejects an append strategy
+        self.append_mode = APPEND_MODES[0]
+        # Cleared the first time the server refuses to rename over an existing file
+        self.atomic_replace = True
+
+        self.connects = 0
+        self.reconnects = 0
+        self.reuses = 0
+
+    def _connect(self):
+        ftps = ReusedSessionFTP_TLS(timeout=self.timeout, encoding=self.encoding)
+        try:
+            with FTPS_SECONDS.time(operation='connect'):
+                ftps.connect(self.host, self.port, timeout=self.timeout, source_address=self.source_address)
+            with FTPS_SECONDS.time(operation='login'):
+                ftps.login(self.user, self.password)
+                ftps.prot_p()  # Secure data connection (Explicit TLS)
+            ftps.set_pasv(True)  # Enable passive mode
+            ftps.sock.settimeout(self.timeout)
+            if self.remote_path:
+                ftps.cwd(self.remote_path)
+        except BaseException:
+            self._close_quietly(ftps)
+            raise
+        return ftps
+
+    def _is_alive(self):
+        try:
+            self._ftps.voidcmd('NOOP')
+            return True
+        except ftplib.all_errors as e:
+            logging.info(f"FTPS connection went stale: {e}")
+            return False
+
+    @staticmethod
+    def _close_quietly(ftps):
+        try:
+            ftps.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """
+        Return a live FTPS connection, reconnecting if needed.
+
+        Returns:
+            ftplib.FTP_TLS: The connection, or None if the server could not be reached.
+        """
+        if self._ftps is not None:
+            if self._is_alive():
+                self.reuses += 1
+                return self._ftps
+            self.invalidate()
+
+        try:
+            self._ftps = self._connect()
+        except ftplib.all_errors as e:
+            logging.error(f"FTPS connection error: {e}")
+            return None
+
+        self.connects += 1
+        if self._stale:
+            self.reconnects += 1
+            self._stale = False
+            logging.info(f"Reconnected to the FTPS server ({self.describe_stats()}).")
+        else:
+            logging.info("Successfully connected to the FTPS server.")
+        return self._ftps
+
+    def store(self, ftps, filename, data, rest=None, command='STOR'):
+        """Upload bytes to a remote file, recording time and size."""
+        with FTPS_SECONDS.time(operation='transfer'), io.BytesIO(data) as bio:
+            ftps.storbinary(f'{command} {filename}', bio, rest=rest)
+        FTPS_BYTES.inc(len(data), direction='sent')
+
+    def retrieve(self, ftps, filename):
+        """Download a remote file, recording time and size."""
+        with FTPS_SECONDS.time(operation='transfer'), io.BytesIO() as bio:
+            ftps.retrbinary(f'RETR {filename}', bio.write)
+            data = bio.getvalue()
+        FTPS_BYTES.inc(len(data), direction='received')
+        return data
+
+    def replace(self, ftps, filename, data):
+        """
+        Overwrite a remote file so readers never see it half written.
+
+        The data is uploaded under a temporary name and renamed over the target,
+        which costs RNFR and RNTO on top of the upload: five round trips and
+        one data connection in all, against three for a plain STOR. Servers
+        that refuse to rename onto an existing file get a plain STOR from then on.
+        """
+        if self.atomic_replace:
+            tmp_name = f".{filename}.tmp"
+            self.store(ftps, tmp_name, data)
+            try:
+                ftps.rename(tmp_name, filename)
+                return
+            except ftplib.error_perm as e:
+                logging.warning(f"Server refused to rename over {filename} ({e}). Writing in place from now on.")
+                self.atomic_replace = False
+                try:
+                    ftps.delete(tmp_name)
+                except ftplib.error_perm:
+                    pass
+        self.store(ftps, filename, data)
+
+    def append(self, ftps, filename, data, when):
+        """
+        Add data to the end of a remote file without re-uploading what is already there.
+
+        Tries APPE first, then SIZE + REST STOR. Servers that support neither get a
+        monthly segment (see rotated_name) rewritten in full, so no single upload
+        grows with the whole history. Whichever strategy works is remembered for
+        the rest of the session.
+
+        Args:
+            ftps: Connection returned by acquire().
+            filename: Remote file name, relative to the remote directory.
+            data (bytes): Bytes to append.
+            when (datetime): Timestamp used to pick the segment in rotate mode.
+
+        Returns:
+            str: Name of the remote file that was written.
+        """
+        if self.append_mode == 'appe':
+            try:
+                self.store(ftps, filename, data, command='APPE')
+                return filename
+            except ftplib.error_perm as e:
+                if not _is_unsupported(e):
+                    raise
+                logging.warning(f"Server does not support APPE ({e}). Falling back to REST STOR.")
+                self.append_mode = 'rest'
+
+        if self.append_mode == 'rest':
+            try:
+                offset = self._remote_size(ftps, filename)
+                self.store(ftps, filename, data, rest=offset or None)
+                return filename
+            except ftplib.error_perm as e:
+                if not _is_unsupported(e):
+                    raise
+                logging.warning(f"Server does not support SIZE/REST ({e}). Switching to monthly log files.")
+                self.append_mode = 'rotate'
+
+        segment = rotated_name(filename, when)
+        try:
+            existing = self.retrieve(ftps, segment)
+        except ftplib.error_perm:
+            logging.info(f"{segment} does not exist. Creating a new one.")
+            existing = b''
+        self.store(ftps, segment, existing + data)
+        return segment
+
+    @staticmethod
+    def _remote_size(ftps, filename):
+        ftps.voidcmd('TYPE I')  # SIZE is only meaningful in binary mode
+        try:
+            return ftps.size(filename) or 0
+        except ftplib.error_perm as e:
+            if _is_unsupported(e):
+                raise
+            return 0  # 550: file doesn't exist yet
+
+    def invalidate(self):
+        """Drop the current connection without a QUIT, e.g. after a failed transfer."""
+        if self._ftps is not None:
+            self._close_quietly(self._ftps)
+            self._ftps = None
+            self._stale = True
+
+    def close(self):
+        """Politely end the session."""
+        if self._ftps is None:
+            return
+        try:
+            self._ftps.quit()
+            logging.info("FTPS connection closed.")
+        except Exception as e:
+            logging.warning(f"Error closing FTPS connection: {e}")
+            self._close_quietly(self._ftps)
+        self._ftps = None
+        self._stale = False
+
+    def stats(self):
+        return {
+            'connects': self.connects,
+            'reconnects': self.reconnects,
+            'reuses': self.reuses,
+        }
+
+    def describe_stats(self):
+        return ', '.join(f"{name}: {value}" for name, value in self.stats().items())
@@ -0,0 +1,257 @@
+"""
+Compact IP history with binary-search lookups.
+
+The history is a flat file of fixed-width 32-byte records, oldest first:
+
+    int64   timestamp, microseconds since the epoch (little endian)
+    uint8   address family, 4 or 6
+    16s     address bytes, IPv4 left-aligned and zero padded
+    7x      reserved
+
+Because every record has the same size, record i starts at byte 32 * i. A
+lookup by time is a binary search over a handful of seeks, and range scans
+read only the records they return, whatever the size of the history. Files
+are append-only and can be concatenated, and a monthly segment written by
+the FTPS fallback is itself a valid history.
+
+Usage:
+    python -m ipreport.history at 2024-05-01T12:00 [--file history.bin]
+    python -m ipreport.history range 2024-05-01 2024-06-01
+    python -m ipreport.history count 2024-05-01 2024-06-01
+    python -m ipreport.history tail 10
+    python -m ipreport.history convert log.txt [log-2024-05.txt ...]
+"""
+import ipaddress
+import logging
+import os
+import struct
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+RECORD = struct.Struct('<qB16s7x')
+RECORD_SIZE = RECORD.size
+READ_CHUNK = 256  # records per read during range scans
+
+DEFAULT_FILE = 'history.bin'
+
+
+class Entry(namedtuple('Entry', ['timestamp', 'ip'])):
+    """One history record: a naive local datetime and the IP seen from then on."""
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.timestamp.isoformat()} - {self.ip}"
+
+
+def pack(timestamp, ip):
+    """Encode a datetime and an IP string as one record."""
+    address = ipaddress.ip_address(ip)
+    micros = round(timestamp.timestamp() * 1_000_000)
+    return RECORD.pack(micros, address.version, address.packed.ljust(16, b'\0'))
+
+
+def unpack(data):
+    micros, family, raw = RECORD.unpack(data)
+    if family == 4:
+        ip = ipaddress.IPv4Address(raw[:4])
+    elif family == 6:
+        ip = ipaddress.IPv6Address(raw)
+    else:
+        raise ValueError(f"corrupt history record (family {family})")
+    return Entry(datetime.fromtimestamp(micros / 1_000_000), str(ip))
+
+
+def _micros(timestamp):
+    return round(timestamp.timestamp() * 1_000_000)
+
+
+class History:
+    """Read and append access to one history file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.path) // RECORD_SIZE
+        except FileNotFoundError:
+            return 0
+
+    def append(self, timestamp, ip):
+        """
+        Append one record, durably.
+
+        Records must arrive in time order. An entry older than the last one is
+        rejected rather than silently breaking the binary search.
+        """
+        last = self.last()
+        if last is not None and timestamp < last.timestamp:
+            raise ValueError(f"history entry {timestamp.isoformat()} is older than {last.timestamp.isoformat()}")
+        with open(self.path, 'ab') as f:
+            f.write(pack(timestamp, ip))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read(self, f, index, count=1):
+        f.seek(index * RECORD_SIZE)
+        data = f.read(count * RECORD_SIZE)
+        return [unpack(data[i:i + RECORD_SIZE]) for i in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE)]
+
+    def _time_at(self, f, index):
+        f.seek(index * RECORD_SIZE)
+        return RECORD.unpack(f.read(RECORD_SIZE))[0]
+
+    def _bisect(self, f, timestamp, n):
+        """Index of the first record strictly after timestamp."""
+        target = _micros(timestamp)
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time_at(f, mid) <= target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def last(self):
+        n = len(self)
+        if not n:
+            return None
+        with open(self.path, 'rb') as f:
+            return self._read(f, n - 1)[0]
+
+    def at(self, timestamp):
+        """The IP in effect at timestamp, or None if the history starts later."""
+        n = len(self)
+        if not n:
+            return None
+        with open(self.path, 'rb') as f:
+            index = self._bisect(f, timestamp, n)
+            return self._read(f, index - 1)[0] if index else None
+
+    def range(self, start=None, end=None):
+        """Yield the changes with start <= timestamp < end, reading only those records."""
+        n = len(self)
+        if not n:
+            return
+        with open(self.path, 'rb') as f:
+            # First record at or after start: bisect just before it
+            first = 0 if start is None else self._bisect(f, start, n)
+            if start is not None:
+                while first > 0 and self._time_at(f, first - 1) >= _micros(start):
+                    first -= 1
+            last = n if end is None else self._bisect(f, end, n)
+            if end is not None:
+                while last > first and self._time_at(f, last - 1) >= _micros(end):
+                    last -= 1
+            for index in range(first, last, READ_CHUNK):
+                yield from self._read(f, index, min(READ_CHUNK, last - index))
+
+    def count(self, start=None, end=None):
+        return sum(1 for _ in self.range(start, end))
+
+    def tail(self, count):
+        n = len(self)
+        with open(self.path, 'rb') as f:
+            return self._read(f, max(0, n - count), min(count, n)) if n else []
+
+
+def parse_log_line(line):
+    """Parse a '<isoformat> - <ip>' line from log.txt, or return None if it isn't one."""
+    timestamp, sep, ip = line.strip().rpartition(' - ')
+    if not sep:
+        return None
+    try:
+        return Entry(datetime.fromisoformat(timestamp), str(ipaddress.ip_address(ip.strip())))
+    except ValueError:
+        return None
+
+
+def convert_logs(log_paths, history):
+    """
+    One-time import of existing log.txt files (and monthly segments) into a history.
+
+    Entries are merged in time order, and anything not newer than the history's
+    last record is skipped, so running it twice is harmless.
+
+    Returns:
+        int: Number of records written.
+    """
+    entries = []
+    for path in log_paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                entry = parse_log_line(line)
+                if entry is None:
+                    logging.warning(f"{path}:{number}: skipping unparseable line {line.strip()!r}")
+                    continue
+                entries.append(entry)
+    entries.sort(key=lambda e: e.timestamp)
+
+    last = history.last()
+    written = 0
+    with open(history.path, 'ab') as f:
+        for entry in entries:
+            if last is not None and entry.timestamp <= last.timestamp:
+                continue
+            f.write(pack(entry.timestamp, entry.ip))
+            last = entry
+            written += 1
+        f.flush()
+        os.fsync(f.fileno())
+    return written
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m ipreport.history', description="Query a binary IP history.")
+    parser.add_argument('--file', default=DEFAULT_FILE, help=f"history file (default {DEFAULT_FILE})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    at = commands.add_parser('at', help="IP in effect at a point in time")
+    at.add_argument('time', type=_parse_time)
+
+    for name, help_text in (('range', "changes between two times"), ('count', "number of changes between two times")):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument('start', type=_parse_time, nargs='?')
+        sub.add_argument('end', type=_parse_time, nargs='?')
+
+    tail = commands.add_parser('tail', help="most recent changes")
+    tail.add_argument('count', type=int, nargs='?', default=10)
+
+    convert = commands.add_parser('convert', help="import log.txt files")
+    convert.add_argument('logs', nargs='+')
+
+    args = parser.parse_args(argv)
+    history = History(args.file)
+
+    if args.command == 'at':
+        entry = history.at(args.time)
+        if entry is None:
+            print(f"No history before {args.time.isoformat()}", file=sys.stderr)
+            return 1
+        print(entry)
+    elif args.command == 'range':
+        for entry in history.range(args.start, args.end):
+            print(entry)
+    elif args.command == 'count':
+        print(history.count(args.start, args.end))
+    elif args.command == 'tail':
+        for entry in history.tail(args.count):
+            print(entry)
+    elif args.command == 'convert':
+        written = convert_logs(args.logs, history)
+        print(f"Wrote {written} records to {args.file} ({len(history)} total)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
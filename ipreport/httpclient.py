@@ -0,0 +1,130 @@
+"""Process-wide pooled HTTP client shared by all probes."""
+import logging
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+POOL_HOSTS = 16  # distinct hosts kept in the pool
+POOL_PER_HOST = 2  # idle keep-alive connections kept per host
+
+_lock = threading.Lock()
+_sessions = {}  # (source_address, interface) -> requests.Session
+_stats = {
+    'requests': 0,  # requests sent through the shared session
+    'connections': 0,  # new TCP connections established
+    'tls_handshakes': 0,  # of which were TLS
+}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        super().connect()
+        _count('connections')
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        super().connect()
+        _count('connections')
+        _count('tls_handshakes')
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections report when they are (re)established.
+
+    Connections can be bound to a local source address and/or a network interface
+    (SO_BINDTODEVICE, which needs CAP_NET_RAW) to probe through a specific uplink.
+    """
+
+    def __init__(self, source_address=None, interface=None, **kwargs):
+        self.source_address = source_address
+        self.interface = interface
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.source_address:
+            kwargs['source_address'] = (self.source_address, 0)
+        if self.interface:
+            kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.interface.encode())
+            ]
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+def get_session(source_address=None, interface=None, pool_size=POOL_PER_HOST):
+    """
+    Return the shared keep-alive session, creating it on first use.
+
+    Every probe in the process should go through this session rather than the
+    module-level requests.get, which opens (and TLS-handshakes) a new connection
+    for each call. Idle connections are kept per host and reused by the next probe
+    that goes to the same service. Probes bound to a source address or interface
+    get their own session, shared by everything bound the same way. pool_size
+    only applies when the session is first created.
+    """
+    key = (source_address, interface)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = PooledAdapter(
+                source_address=source_address,
+                interface=interface,
+                pool_connections=POOL_HOSTS,
+                pool_maxsize=pool_size
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.hooks['response'].append(lambda response, *args, **kwargs: _count('requests'))
+            _sessions[key] = session
+        return session
+
+
+def stats():
+    """
+    Connection reuse counters since the process started.
+
+    Without pooling every request costs a connection (and a TLS handshake for
+    https), so requests minus connections is the number of handshakes saved.
+    """
+    with _lock:
+        result = dict(_stats)
+    result['reused'] = max(0, result['requests'] - result['connections'])
+    return result
+
+
+def describe_stats():
+    return ', '.join(f"{name}: {value}" for name, value in stats().items())
+
+
+def close():
+    """Close pooled connections, e.g. before the process exits."""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+    if sessions:
+        logging.info(f"Closed HTTP pool ({describe_stats()}).")
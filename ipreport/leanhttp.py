@@ -0,0 +1,150 @@
+"""
+Minimal HTTP client for the echo services, built on http.client.
+
+requests pulls in urllib3, idna, charset detection and certifi, which on a Pi
+Zero costs seconds of start-up and a good share of the process's memory. The
+probes only ever GET a few bytes of plain text, so in lean mode
+(LEAN=yes) they go through LeanSession instead, which implements just
+the part of requests.Session the probes use.
+"""
+import functools
+import http.client
+import logging
+import socket
+import threading
+import urllib.parse
+from collections import namedtuple
+
+MAX_BODY = 4096  # an echo service answer is an address, anything longer is junk
+USER_AGENT = 'ipreport'
+
+# Errors that mean a kept-alive connection was closed by the server while idle
+_STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+def _bound_connection(interface, address, timeout, source_address=None):
+    """socket.create_connection, with the socket bound to interface (SO_BINDTODEVICE) before connecting."""
+    host, port = address
+    error = None
+    for family, socktype, proto, _, sockaddr in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode())
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            error = e
+            sock.close()
+    raise error or OSError(f"getaddrinfo returned nothing for {host}")
+
+
+class LeanResponse(namedtuple('LeanResponse', ['url', 'status_code', 'content'])):
+    __slots__ = ()
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ConnectionError(f"HTTP {self.status_code} from {self.url}")
+
+
+class LeanSession:
+    """
+    Keep-alive GET requests over http.client, one idle connection kept per host.
+
+    Connections can be bound to a source address and/or a network interface.
+    Thread-safe: a connection is taken out of the idle pool while in use, so
+    concurrent requests to the same host each get their own. Errors are raised
+    as OSError subclasses, like requests.RequestException, so callers can catch
+    both the same way.
+    """
+
+    def __init__(self, source_address=None, interface=None):
+        self.source_address = (source_address, 0) if source_address else None
+        self.interface = interface
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._context = None
+        self._stats = {'requests': 0, 'connections': 0}
+
+    def _connect(self, scheme, host, port, timeout):
+        with self._lock:
+            self._stats['connections'] += 1
+        if scheme == 'https':
+            if self._context is None:
+                import ssl
+                self._context = ssl.create_default_context()
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=timeout, context=self._context, source_address=self.source_address
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout, source_address=self.source_address)
+        if self.interface:
+            # Needs CAP_NET_RAW, like the interface binding in httpclient
+            conn._create_connection = functools.partial(_bound_connection, self.interface)
+        return conn
+
+    def get(self, url, timeout=None):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = parts.path or '/'
+        if parts.query:
+            target += f"?{parts.query}"
+        with self._lock:
+            self._stats['requests'] += 1
+            conn = self._idle.pop(key, None)
+
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(parts.scheme, parts.hostname, parts.port, timeout)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request('GET', target, headers={'User-Agent': USER_AGENT, 'Accept': 'text/plain'})
+                response = conn.getresponse()
+                content = response.read(MAX_BODY + 1)
+                break
+            except _STALE_ERRORS as e:
+                conn.close()
+                conn = None
+                if not reused:
+                    raise ConnectionError(f"{url}: {e}") from e
+                reused = False  # retry once on a fresh connection
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise ConnectionError(f"{url}: {e}") from e
+
+        if response.will_close or len(content) > MAX_BODY:
+            conn.close()
+        else:
+            with self._lock:
+                previous = self._idle.pop(key, None)
+                self._idle[key] = conn
+            if previous is not None:
+                previous.close()
+        return LeanResponse(url, response.status, content[:MAX_BODY])
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+        result['reused'] = max(0, result['requests'] - result['connections'])
+        return result
+
+    def describe_stats(self):
+        return ', '.join(f"{name}: {value}" for name, value in self.stats().items())
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle.values()), {}
+        for conn in idle:
+            try:
+                conn.close()
+            except OSError as e:
+                logging.debug(f"Error closing HTTP connection: {e}")
@@ -0,0 +1,207 @@
+"""
+Logging set-up for the long-running services.
+
+Records go from the calling thread straight into an in-memory queue; a single
+listener thread formats them and writes them out, so a slow journald or SD
+card never stalls the probe loop. The hot per-cycle log calls pass their
+arguments %-style, which leaves the formatting to the listener too, and to
+nobody at all when the level is disabled.
+
+The listener also keeps outages from flooding the journal. The first
+occurrence of a message is written; repeats within log_dedup_window seconds
+are counted instead, and when the window closes a single summary takes their
+place, so a message repeated every 30s costs two lines an hour:
+
+    Failed to fetch IP from https://api.ipify.org: no answer within budget (x119 in 1h)
+
+Only identical messages count as repeats; ones that differ in an IP, a count
+or a port are all written. A message that carries a measurement which changes
+every time (a latency, say) passes extra={'dedup_key': ...} with the parts
+that do matter, and is then a repeat whenever its format string and key match;
+the summary shows the last of them. With log_format='json' every line is one JSON
+object (time, level, logger, message, and repeated / window for summaries)
+for machine parsing.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from datetime import datetime
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+MAX_TRACKED = 1000  # distinct messages remembered for deduplication
+SWEEP_INTERVAL = 60  # seconds between checks for windows that closed without a new repeat
+
+_listener = None
+
+
+def _span(seconds):
+    minutes = round(seconds / 60)
+    if minutes >= 60:
+        return f"{minutes // 60}h{minutes % 60}m" if minutes % 60 else f"{minutes // 60}h"
+    if minutes:
+        return f"{minutes}m"
+    return f"{seconds:.0f}s"
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        repeated = getattr(record, 'repeated', None)
+        if repeated:
+            data['repeated'] = repeated
+            data['window'] = record.window
+        if record.exc_text or record.exc_info:
+            data['exception'] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+class _Repeats:
+    __slots__ = ('started', 'count', 'last')
+
+    def __init__(self, started):
+        self.started = started
+        self.count = 0
+        self.last = None
+
+
+class DedupHandler(logging.Handler):
+    """
+    Passes records on to target, collapsing repeats into periodic summaries.
+
+    Runs on the listener thread, so the bookkeeping costs the services nothing.
+    Windows are measured on the records' own creation times, not on when the
+    listener gets round to them.
+    """
+
+    def __init__(self, target, window=3600):
+        super().__init__()
+        self.target = target
+        self.window = window
+        self._repeats = {}
+        self._swept = time.time()
+
+    @staticmethod
+    def _key(record):
+        stable = getattr(record, 'dedup_key', None)
+        if stable is not None:
+            return record.name, record.levelno, record.msg, stable
+        return record.name, record.levelno, record.getMessage()
+
+    def _summarise(self, repeats):
+        """Write one record standing for the repeats, stamped with the last of them."""
+        last = repeats.last
+        span = last.created - repeats.started
+        summary = logging.makeLogRecord(last.__dict__)
+        summary.msg = '%s (x%d in %s)'
+        summary.args = (last.getMessage(), repeats.count, _span(span))
+        summary.exc_info = summary.exc_text = None
+        summary.repeated = repeats.count
+        summary.window = round(span)
+        self.target.handle(summary)
+
+    def emit(self, record):
+        now = record.created
+        if not self.window:
+            self.target.handle(record)
+            return
+        if now - self._swept >= SWEEP_INTERVAL:
+            self.sweep(now)
+
+        key = self._key(record)
+        repeats = self._repeats.get(key)
+        if repeats is not None and now - repeats.started >= self.window:
+            if repeats.count:
+                self._summarise(repeats)
+            repeats = None
+        if repeats is None:
+            if len(self._repeats) >= MAX_TRACKED:
+                self.sweep(now, force=True)
+            # First in a window: written as is
+            self._repeats[key] = _Repeats(now)
+            self.target.handle(record)
+        else:
+            repeats.count += 1
+            repeats.last = record
+
+    def sweep(self, now=None, force=False):
+        """Write summaries for windows that have closed (all of them if force) and forget those messages."""
+        if now is None:
+            now = time.time()
+        self._swept = now
+        for key, repeats in list(self._repeats.items()):
+            if force or now - repeats.started >= self.window:
+                if repeats.count:
+                    self._summarise(repeats)
+                del self._repeats[key]
+
+    def flush(self):
+        self.target.flush()
+
+    def close(self):
+        self.sweep(force=True)
+        self.target.close()
+        super().close()
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are; the listener does the formatting."""
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # Tracebacks have to be rendered while the frames still exist
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+
+def configure(level='INFO', fmt='text', dedup_window=3600, stream=None):
+    """
+    Route the root logger through the queue and listener. Safe to call again.
+
+    Args:
+        level: Level name or number for the root logger.
+        fmt: 'text' for the usual '<time> - <level> - <message>' lines, 'json' for JSON lines.
+        dedup_window: Seconds over which repeated messages are summarised, 0 = write every one.
+        stream: Where to write, default stderr (which systemd sends to the journal).
+    """
+    global _listener
+    stop()
+    if fmt not in ('text', 'json'):
+        raise ValueError(f"Unknown log format '{fmt}', use text or json")
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, DedupHandler(output, dedup_window))
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(_LazyQueueHandler(records))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def stop():
+    """Write out everything still queued, including pending summaries."""
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, _LazyQueueHandler):
+            root.removeHandler(handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
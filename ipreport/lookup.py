@@ -0,0 +1,218 @@
+"""Concurrent public IP lookup across several echo services."""
+import concurrent.futures
+import ipaddress
+import logging
+import threading
+import time
+from collections import Counter
+
+from ipreport import metrics
+
+IP_SERVICES = [
+    'https://api.ipify.org',
+    'https://ifconfig.me/ip',
+    'https://icanhazip.com',
+    'https://checkip.amazonaws.com'
+]
+
+# Endpoints that only answer over one address family, for dual-stack probing
+IP_SERVICES_BY_FAMILY = {
+    'ipv4': [
+        'https://api4.ipify.org',
+        'https://ipv4.icanhazip.com',
+        'https://checkip.amazonaws.com',
+        'https://v4.ident.me',
+    ],
+    'ipv6': [
+        'https://api6.ipify.org',
+        'https://ipv6.icanhazip.com',
+        'https://v6.ident.me',
+    ],
+}
+
+HEDGE_DELAY = 1.0  # seconds before the next ranked service is asked as well
+
+PROBE_LATENCY = metrics.histogram(
+    'ipreport_probe_latency_seconds', 'Time for an echo service to return the public IP.', ['provider'])
+PROBE_FAILURES = metrics.counter(
+    'ipreport_probe_failures_total', 'Echo service requests that failed or ran out of budget.', ['provider'])
+
+
+def _fetch_ip(session, service, timeout, version=None):
+    started = time.monotonic()
+    response = session.get(service, timeout=timeout)
+    if response.status_code != 200:
+        raise ValueError(f"HTTP {response.status_code}")
+    # Reject captive portal pages and other junk that isn't an address
+    address = ipaddress.ip_address(response.text.strip())
+    if version is not None and address.version != version:
+        raise ValueError(f"expected an IPv{version} address, got {address}")
+    ip = str(address)
+    latency = time.monotonic() - started
+    PROBE_LATENCY.observe(latency, provider=service)
+    return ip, latency
+
+
+class _Outcomes:
+    """
+    Settles every request exactly once, whenever it finishes.
+
+    A request counts as failed if it raises, or if it has not answered by the
+    end of its budget; an answer arriving after that is still a failure. The
+    outcome is fed to the registry from the request's done callback, or from a
+    timer at the end of its budget, so a provider that is still silent when the
+    lookup returns is charged for it all the same.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.deadlines = {}  # future -> (service, monotonic deadline)
+        self.results = {}  # future -> IP, or None for a failure
+        self._lock = threading.Lock()
+
+    def watch(self, future, service, deadline):
+        self.deadlines[future] = (service, deadline)
+        future.add_done_callback(self.settle)
+
+    def expire_later(self, futures):
+        """Charge requests the caller stops waiting for with a failure if they outlive their budget."""
+        for future in futures:
+            timer = threading.Timer(max(0.0, self.deadlines[future][1] - time.monotonic()),
+                                    self.settle, (future, True))
+            timer.daemon = True
+            timer.start()
+
+    def settle(self, future, expired=False):
+        """The future's IP, or None if it failed; records the outcome the first time."""
+        with self._lock:
+            if future in self.results:
+                return self.results[future]
+            if not expired and not future.done():
+                return None
+            self.results[future] = ip = self._record(future, expired)
+        if self.registry is not None:
+            self.registry.flush()
+        return ip
+
+    def _record(self, future, expired):
+        service, deadline = self.deadlines[future]
+        if expired:
+            error = 'no answer within budget'
+        elif future.cancelled():
+            error = 'cancelled'
+        elif future.exception() is not None:
+            error = future.exception()
+        elif time.monotonic() > deadline:
+            error = 'answered after its budget'
+        else:
+            ip, latency = future.result()
+            if self.registry is not None:
+                self.registry.record_success(service, latency)
+            return ip
+        logging.warning("Failed to fetch IP from %s: %s", service, error)
+        PROBE_FAILURES.inc(provider=service)
+        if self.registry is not None:
+            self.registry.record_failure(service)
+        return None
+
+
+def resolve_public_ip(services=IP_SERVICES, timeout=15, quorum=1, budgets=None, registry=None,
+                      session=None, version=None, hedge_delay=HEDGE_DELAY):
+    """
+    Ask the services concurrently and return the first answer that enough of them agree on.
+
+    Without a registry all services are asked at once and, with the default
+    quorum of 1, the fastest valid answer wins. With a registry they are
+    started in its ranked order: the healthiest quorum first, then the next one
+    whenever a request fails or runs out of budget, and every hedge_delay
+    seconds while the quorum is still open. A healthy first choice then answers
+    alone, and one blackholed provider still delays the cycle by at most
+    hedge_delay. Each service is abandoned once its own latency budget runs
+    out; requests still in flight at that point are left to hit their socket
+    timeout in the background, and every request's outcome is recorded in the
+    registry whenever it finishes.
+
+    Args:
+        services (list): Echo service URLs returning the caller's IP as plain text.
+        timeout (float): Default latency budget per service, in seconds.
+        quorum (int): Number of services that must return the same IP.
+        budgets (dict): Optional per-service budgets overriding timeout.
+        registry (ProviderRegistry): If given, replaces services with the registry's
+            healthy endpoints and is updated with every outcome.
+        session (requests.Session): HTTP session to probe through, defaults to the
+            shared unbound pool (see httpclient.get_session). A
+            leanhttp.LeanSession avoids importing requests at all.
+        version (int): Only accept IPv4 (4) or IPv6 (6) answers.
+        hedge_delay (float): Seconds to wait before starting the next ranked
+            service, when a registry orders them.
+
+    Returns:
+        str: The public IP, or None if no answer reached the quorum in time.
+    """
+    if registry is not None:
+        services = registry.ranked()
+    else:
+        hedge_delay = 0
+    budgets = budgets or {}
+    if session is None:
+        from ipreport.httpclient import get_session
+
+        session = get_session()
+    quorum = max(1, min(quorum, len(services)))
+    waiting = list(services)  # not started yet, best first
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(services))
+    outcomes = _Outcomes(registry)
+
+    def start(count):
+        for service in waiting[:count]:
+            budget = budgets.get(service, timeout)
+            outcomes.watch(executor.submit(_fetch_ip, session, service, budget, version),
+                           service, time.monotonic() + budget)
+        del waiting[:count]
+        return time.monotonic() + hedge_delay
+
+    votes = Counter()
+    pending = set()
+    next_hedge = start(quorum if hedge_delay else len(waiting))
+    pending.update(outcomes.deadlines)
+    try:
+        while pending or waiting:
+            wake = min([outcomes.deadlines[f][1] for f in pending] + ([next_hedge] if waiting else []))
+            done, pending = concurrent.futures.wait(
+                pending,
+                timeout=max(0.0, wake - time.monotonic()),
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            failed = 0
+            for future in done:
+                ip = outcomes.settle(future)
+                if ip is None:
+                    failed += 1
+                    continue
+                votes[ip] += 1
+                if votes[ip] >= quorum:
+                    return ip
+
+            now = time.monotonic()
+            for future in [f for f in pending if outcomes.deadlines[f][1] <= now]:
+                outcomes.settle(future, expired=True)
+                future.cancel()
+                pending.discard(future)
+                failed += 1
+
+            # Replace every request that failed, and hedge if the quorum is slow in coming
+            if waiting and (failed or now >= next_hedge):
+                before = set(outcomes.deadlines)
+                next_hedge = start(max(failed, 1))
+                pending.update(set(outcomes.deadlines) - before)
+    finally:
+        outcomes.expire_later(f for f in pending if not f.done())
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if votes:
+        logging.error(f"Public IP lookup did not reach quorum of {quorum}: {dict(votes)}")
+    else:
+        logging.error("Failed to fetch public IP from all services.")
+    return None
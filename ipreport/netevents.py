@@ -0,0 +1,292 @@
+"""
+Local network change notifications, so the public IP is looked up only when something changed.
+
+NetlinkMonitor follows the kernel's rtnetlink multicast groups for interface
+addresses, default routes and link state (Linux only). watch_networkmanager()
+also follows NetworkManager's StateChanged signal over D-Bus when dbus-next is
+installed. Both only report *that* something changed locally; the daemon then
+runs an ordinary probe to find out whether the public IP moved with it.
+"""
+import errno
+import logging
+import socket
+import struct
+
+# Multicast groups (linux/rtnetlink.h)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+GROUPS = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE
+
+# Message types
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+# Attributes
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFLA_IFNAME = 3
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_TABLE = 15
+
+RT_SCOPE_UNIVERSE = 0
+RT_TABLE_MAIN = 254
+IFF_LOOPBACK = 0x8
+IFF_RUNNING = 0x40
+
+NLMSGHDR = struct.Struct('=IHHII')  # length, type, flags, seq, pid
+RTATTR = struct.Struct('=HH')  # length, type
+IFADDRMSG = struct.Struct('=BBBBI')  # family, prefixlen, flags, scope, index
+IFINFOMSG = struct.Struct('=BxHiII')  # family, type, index, flags, change
+RTMSG = struct.Struct('=BBBBBBBBI')  # family, dst_len, src_len, tos, table, protocol, scope, type, flags
+
+NM_INTERFACE = 'org.freedesktop.NetworkManager'
+NM_STATES = {
+    10: 'asleep',
+    20: 'disconnected',
+    30: 'disconnecting',
+    40: 'connecting',
+    50: 'connected (local only)',
+    60: 'connected (site only)',
+    70: 'connected',
+}
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _messages(data):
+    """Split one netlink datagram into (type, seq, payload) tuples."""
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type, _, seq, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        yield msg_type, seq, data[offset + NLMSGHDR.size:offset + length]
+        offset += _align(length)
+
+
+def _attributes(data):
+    attrs = {}
+    offset = 0
+    while offset + RTATTR.size <= len(data):
+        length, kind = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[kind] = data[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _ifname(index):
+    try:
+        return socket.if_indextoname(index)
+    except OSError:
+        return f"if{index}"
+
+
+class NetlinkMonitor:
+    """
+    Reports address, default route and link state changes from rtnetlink.
+
+    The kernel repeats notifications that change nothing we care about (IPv6
+    router advertisements refresh address lifetimes every few minutes, link
+    messages carry statistics), so the monitor keeps the current addresses,
+    default routes and link states and only reports real differences. The
+    starting point comes from a dump taken in open().
+    """
+
+    def __init__(self):
+        self.sock = None
+        self._seq = 0
+        self._addresses = set()
+        self._routes = set()
+        self._links = {}
+
+    def open(self):
+        """Subscribe and load the current state. Raises OSError where rtnetlink is unavailable."""
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        try:
+            sock.bind((0, GROUPS))
+            sock.settimeout(5)
+            self.sock = sock
+            for request in (RTM_GETLINK, RTM_GETADDR, RTM_GETROUTE):
+                self._dump(request)
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            self.sock = None
+            raise
+        logging.info(f"Watching rtnetlink: {len(self._addresses)} addresses, "
+                     f"{len(self._routes)} default routes, {len(self._links)} links")
+        return self
+
+    def _dump(self, request):
+        self._seq += 1
+        body = struct.pack('=Bxxx', socket.AF_UNSPEC)
+        self.sock.send(NLMSGHDR.pack(
+            NLMSGHDR.size + len(body), request, NLM_F_REQUEST | NLM_F_DUMP, self._seq, 0
+        ) + body)
+        while True:
+            for msg_type, seq, payload in _messages(self.sock.recv(65536)):
+                if seq == self._seq and msg_type in (NLMSG_DONE, NLMSG_ERROR):
+                    return
+                self._update(msg_type, payload)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self):
+        """
+        Drain the notifications waiting on the socket.
+
+        Returns:
+            list: Descriptions of the changes, empty if nothing relevant changed.
+        """
+        changes = []
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                return changes
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # The kernel dropped notifications; assume the worst
+                changes.append("netlink notifications lost")
+                continue
+            for msg_type, _, payload in _messages(data):
+                change = self._update(msg_type, payload)
+                if change:
+                    changes.append(change)
+
+    def _update(self, msg_type, payload):
+        if msg_type in (RTM_NEWADDR, RTM_DELADDR):
+            return self._update_address(msg_type, payload)
+        if msg_type in (RTM_NEWROUTE, RTM_DELROUTE):
+            return self._update_route(msg_type, payload)
+        if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+            return self._update_link(msg_type, payload)
+        return None
+
+    def _update_address(self, msg_type, payload):
+        family, prefixlen, _, scope, index = IFADDRMSG.unpack_from(payload)
+        if scope != RT_SCOPE_UNIVERSE:
+            return None  # link-local and host addresses never face the internet
+        attrs = _attributes(payload[IFADDRMSG.size:])
+        raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+        if raw is None:
+            return None
+        address = f"{socket.inet_ntop(family, raw)}/{prefixlen}"
+        key = (index, address)
+        if msg_type == RTM_NEWADDR:
+            if key in self._addresses:
+                return None
+            self._addresses.add(key)
+            return f"address {address} added on {_ifname(index)}"
+        if key not in self._addresses:
+            return None
+        self._addresses.discard(key)
+        return f"address {address} removed from {_ifname(index)}"
+
+    def _update_route(self, msg_type, payload):
+        family, dst_len, _, _, table, _, _, _, _ = RTMSG.unpack_from(payload)
+        if dst_len != 0:
+            return None  # only the default routes decide the way out
+        attrs = _attributes(payload[RTMSG.size:])
+        if RTA_TABLE in attrs:
+            table = struct.unpack('=I', attrs[RTA_TABLE])[0]
+        if table != RT_TABLE_MAIN:
+            return None
+        gateway = socket.inet_ntop(family, attrs[RTA_GATEWAY]) if RTA_GATEWAY in attrs else None
+        oif = struct.unpack('=I', attrs[RTA_OIF])[0] if RTA_OIF in attrs else 0
+        key = (family, gateway, oif)
+        description = f"default route via {gateway or 'direct'} dev {_ifname(oif)}"
+        if msg_type == RTM_NEWROUTE:
+            if key in self._routes:
+                return None
+            self._routes.add(key)
+            return f"{description} added"
+        if key not in self._routes:
+            return None
+        self._routes.discard(key)
+        return f"{description} removed"
+
+    def _update_link(self, msg_type, payload):
+        _, _, index, flags, _ = IFINFOMSG.unpack_from(payload)
+        if flags & IFF_LOOPBACK:
+            return None
+        attrs = _attributes(payload[IFINFOMSG.size:])
+        name = attrs[IFLA_IFNAME].rstrip(b'\0').decode() if IFLA_IFNAME in attrs else _ifname(index)
+        previous = self._links.get(index)
+        if msg_type == RTM_DELLINK:
+            self._links.pop(index, None)
+            return f"link {name} removed" if previous else None
+        running = bool(flags & IFF_RUNNING)
+        self._links[index] = running
+        if previous is None or previous == running:
+            return None
+        return f"link {name} {'up' if running else 'down'}"
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+async def watch_networkmanager(callback):
+    """
+    Call callback(description) whenever NetworkManager's overall state changes.
+
+    Returns straight away if dbus-next (pip install dbus-next) is not installed
+    or there is no system bus, leaving rtnetlink as the only event source.
+    """
+    try:
+        from dbus_next import BusType, Message, MessageType
+        from dbus_next.aio import MessageBus
+    except ImportError:
+        logging.info("dbus-next not installed, not following NetworkManager signals.")
+        return
+
+    try:
+        bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
+    except Exception as e:
+        logging.info(f"System D-Bus not available, not following NetworkManager signals: {e}")
+        return
+
+    def handler(message):
+        if (message.message_type == MessageType.SIGNAL and message.interface == NM_INTERFACE
+                and message.member == 'StateChanged'):
+            state = message.body[0]
+            callback(f"NetworkManager {NM_STATES.get(state, state)}")
+
+    bus.add_message_handler(handler)
+    try:
+        await bus.call(Message(
+            destination='org.freedesktop.DBus',
+            path='/org/freedesktop/DBus',
+            interface='org.freedesktop.DBus',
+            member='AddMatch',
+            signature='s',
+            body=[f"type='signal',interface='{NM_INTERFACE}',member='StateChanged'"],
+        ))
+        logging.info("Following NetworkManager state changes over D-Bus")
+        await bus.wait_for_disconnect()
+    finally:
+        bus.disconnect()
@@ -0,0 +1,123 @@
+"""Durable queue of IP changes that have not been published yet."""
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from ipreport import metrics
+from ipreport.history import Entry
+
+DEFAULT_MAX_EVENTS = 1000
+
+OUTBOX_DEPTH = metrics.gauge(
+    'ipreport_outbox_depth', 'IP changes waiting to be published.', ['backend'])
+OUTBOX_DROPPED = metrics.counter(
+    'ipreport_outbox_dropped_total', 'Queued IP changes dropped to keep the outbox bounded.', ['backend'])
+
+
+class Outbox:
+    """
+    Write-ahead journal of IP changes for one publish backend.
+
+    enqueue() is called the moment a probe sees a new IP and appends the change,
+    with its real timestamp, to a JSONL journal that is fsync'd before
+    returning. The publisher drains the whole queue in its next successful write
+    and then calls commit(). Changes therefore survive failed uploads,
+    long outages and restarts, and land in log.txt with the time they happened.
+
+    The queue stays small: a probe that sees the same IP as the newest queued
+    change adds nothing, and beyond max_events the oldest changes are dropped
+    (the newest, which decides ip.txt, is always kept).
+    """
+
+    def __init__(self, path, name, last_published_ip=None, max_events=DEFAULT_MAX_EVENTS):
+        self.path = path
+        self.name = name
+        self.max_events = max_events
+        self.last_published_ip = last_published_ip
+        self._lock = threading.Lock()
+        self._events, damaged = self._load()
+        if damaged:
+            # Appending after a torn line would glue the next change onto it
+            self._rewrite()
+        OUTBOX_DEPTH.set(len(self._events), backend=name)
+        if self._events:
+            logging.info(f"Outbox for {name} has {len(self._events)} unpublished change(s) from before restart.")
+
+    def _load(self):
+        """The journaled changes, and whether the file needs rewriting before the next append."""
+        events = []
+        damaged = False
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        data = json.loads(line)
+                        events.append(Entry(datetime.fromisoformat(data['timestamp']), data['ip']))
+                        if not line.endswith('\n'):
+                            # Complete, but cut off before its newline: the entry is good, the file isn't
+                            damaged = True
+                    except (ValueError, KeyError):
+                        # A torn last line from a crash mid-write
+                        logging.warning(f"Skipping damaged outbox entry in {self.path}: {line.strip()!r}")
+                        damaged = True
+        except FileNotFoundError:
+            pass
+        return events, damaged
+
+    def _rewrite(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for event in self._events:
+                f.write(self._encode(event))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _encode(event):
+        return json.dumps({'timestamp': event.timestamp.isoformat(), 'ip': event.ip}) + '\n'
+
+    def enqueue(self, ip, timestamp):
+        """
+        Record that ip was seen at timestamp, if it is a change.
+
+        Returns:
+            bool: True if a new change was queued.
+        """
+        with self._lock:
+            previous = self._events[-1].ip if self._events else self.last_published_ip
+            if ip == previous:
+                return False
+
+            event = Entry(timestamp, ip)
+            self._events.append(event)
+            if len(self._events) > self.max_events:
+                dropped = len(self._events) - self.max_events
+                del self._events[:dropped]
+                OUTBOX_DROPPED.inc(dropped, backend=self.name)
+                logging.warning(f"Outbox for {self.name} is full, dropped {dropped} oldest change(s).")
+                self._rewrite()
+            else:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(self._encode(event))
+                    f.flush()
+                    os.fsync(f.fileno())
+            OUTBOX_DEPTH.set(len(self._events), backend=self.name)
+            return True
+
+    def pending(self):
+        """Snapshot of the queued changes, oldest first."""
+        with self._lock:
+            return list(self._events)
+
+    def commit(self, count):
+        """Forget the first count changes after they were published."""
+        with self._lock:
+            if count <= 0:
+                return
+            self.last_published_ip = self._events[count - 1].ip
+            del self._events[:count]
+            self._rewrite()
+            OUTBOX_DEPTH.set(len(self._events), backend=self.name)
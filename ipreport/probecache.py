@@ -0,0 +1,242 @@
+"""
+Probe results shared between the ipreport processes on one host.
+
+When the reporter and the watchdog run side by side (server_with_reboot_feature.py
+next to reboot_if_there_is_no_internet_connection.py, or several daemons with
+different tasks), each would ask the same echo services the same question
+within seconds of the other. With PROBE_CACHE_FILE set they share one
+memory-mapped file instead: a process that needs a result takes the newest one
+if it is younger than PROBE_CACHE_TTL, and otherwise probes and publishes its
+own. While one process is probing, the others wait for its answer rather than
+probing too, so N consumers cost one outbound probe per TTL.
+
+The file is a small header and a fixed number of slots, one per kind of
+result ('ip', 'connectivity', ...):
+
+    header  8s magic, uint32 version, uint32 slot count, padded to 64 bytes
+    slot    32s name, uint64 generation, double monotonic time, double wall
+            time, uint32 producer pid, uint32 payload length, JSON payload,
+            4096 bytes in all
+
+Access is coordinated with fcntl record locks: one byte per slot is held while
+a process probes for it, the rest of the slot while its data is read or written.
+Ages are measured on CLOCK_MONOTONIC, which all processes on the host share, so
+changing the wall clock never makes a result look fresh. Put the file on a
+tmpfs such as /dev/shm or /run so it never outlives a reboot.
+"""
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from ipreport import metrics
+
+MAGIC = b'IPRCACHE'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<32sQddII')
+SLOT_SIZE = 4096
+SLOTS = 16
+MAX_PAYLOAD = SLOT_SIZE - SLOT_HEADER.size
+FILE_SIZE = HEADER_SIZE + SLOTS * SLOT_SIZE
+
+CLOCK_SKEW = 5  # seconds monotonic and wall ages may disagree by before an entry is thought to be from an earlier boot
+
+CACHE_LOOKUPS = metrics.counter(
+    'ipreport_probe_cache_lookups_total',
+    'Shared probe cache lookups: hit, shared (waited for another prober) or miss.', ['name', 'outcome'])
+CACHE_AGE = metrics.gauge(
+    'ipreport_probe_cache_age_seconds', 'Age of the last probe result taken from the cache.', ['name'])
+
+
+class CacheEntry(namedtuple('CacheEntry', ['name', 'value', 'probed_at', 'age', 'pid', 'generation'])):
+    """
+    One cached result with its freshness metadata.
+
+    probed_at is the producer's wall-clock time, age the seconds since on the
+    monotonic clock and pid the process that probed.
+    """
+    __slots__ = ()
+
+    def describe(self):
+        origin = 'this process' if self.pid == os.getpid() else f"pid {self.pid}"
+        return f"{self.age:.1f}s old, probed by {origin}"
+
+
+class ProbeCache:
+    """A probe cache file mapped into this process."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._fd = None
+        self._map = None
+        self._slots = {}  # name -> offset, once found or allocated
+        self._lock = threading.Lock()  # fcntl locks are per process, this orders our own threads
+        self._probing = {}  # name -> threading.Lock, held while this process probes
+
+    def open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o660)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+        try:
+            if os.fstat(self._fd).st_size != FILE_SIZE or self._read_header() != (MAGIC, VERSION, SLOTS):
+                if os.fstat(self._fd).st_size:
+                    logging.warning(f"Reinitialising probe cache {self.path}, it has an unknown layout.")
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, FILE_SIZE)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, VERSION, SLOTS), 0)
+            self._map = mmap.mmap(self._fd, FILE_SIZE)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+        return self
+
+    def _read_header(self):
+        data = os.pread(self._fd, HEADER.size, 0)
+        return HEADER.unpack(data) if len(data) == HEADER.size else None
+
+    def _slot(self, name, create):
+        """Offset of the named slot, allocating a free one if create is set."""
+        offset = self._slots.get(name)
+        if offset is not None:
+            return offset
+        key = name.encode('utf-8')
+        if len(key) > 32:
+            raise ValueError(f"probe cache name too long: {name!r}")
+        key = key.ljust(32, b'\0')
+        # The fcntl lock keeps other processes out, but not our own threads
+        with self._lock:
+            offset = self._slots.get(name)
+            if offset is not None:
+                return offset
+            fcntl.lockf(self._fd, fcntl.LOCK_EX if create else fcntl.LOCK_SH, HEADER_SIZE, 0)
+            try:
+                free = None
+                for index in range(SLOTS):
+                    offset = HEADER_SIZE + index * SLOT_SIZE
+                    current = self._map[offset:offset + 32]
+                    if current == key:
+                        self._slots[name] = offset
+                        return offset
+                    if free is None and current == b'\0' * 32:
+                        free = offset
+                if not create:
+                    return None
+                if free is None:
+                    raise RuntimeError(f"probe cache {self.path} has no free slot for {name!r}")
+                self._map[free:free + 32] = key
+                self._slots[name] = free
+                return free
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+
+    def read(self, name):
+        """
+        The newest result stored under name, whatever its age.
+
+        Returns:
+            CacheEntry: The result, or None if there is none yet.
+        """
+        offset = self._slot(name, create=False)
+        if offset is None:
+            return None
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_SH, SLOT_SIZE - 1, offset + 1)
+            try:
+                _, generation, produced, wall, pid, length = SLOT_HEADER.unpack_from(self._map, offset)
+                payload = self._map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE - 1, offset + 1)
+        if not generation:
+            return None
+        age = time.monotonic() - produced
+        if age < 0 or abs((time.time() - wall) - age) > CLOCK_SKEW:
+            # Written before a reboot (the file isn't on a tmpfs) or the wall clock jumped since
+            age = float('inf')
+        try:
+            value = json.loads(payload)
+        except ValueError:
+            logging.warning(f"Ignoring damaged probe cache entry {name!r} in {self.path}.")
+            return None
+        return CacheEntry(name, value, wall, age, pid, generation)
+
+    def write(self, name, value):
+        """Store a JSON-serialisable result under name, stamped with the current time."""
+        payload = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        if len(payload) > MAX_PAYLOAD:
+            raise ValueError(f"probe result for {name!r} is {len(payload)} bytes, the limit is {MAX_PAYLOAD}")
+        offset = self._slot(name, create=True)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT_SIZE - 1, offset + 1)
+            try:
+                key, generation = SLOT_HEADER.unpack_from(self._map, offset)[:2]
+                SLOT_HEADER.pack_into(self._map, offset, key, generation + 1, time.monotonic(), time.time(),
+                                      os.getpid(), len(payload))
+                self._map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(payload)] = payload
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE - 1, offset + 1)
+
+    def _fresh(self, entry, ttl, not_before):
+        if entry is None or entry.age > ttl:
+            return False
+        # not_before: a monotonic time, e.g. of a network change, that older results predate
+        return not_before is None or time.monotonic() - entry.age >= not_before
+
+    def get_or_probe(self, name, probe, ttl=None, not_before=None):
+        """
+        A fresh result for name, probing only if no process has one.
+
+        If another process is probing for name right now, this waits for its
+        result instead of probing as well. Blocks, so call it from a worker
+        thread.
+
+        Args:
+            name: Slot name, e.g. 'ip' or 'connectivity'.
+            probe: Callable returning a JSON-serialisable result.
+            ttl: Oldest acceptable result in seconds, default the cache's TTL.
+            not_before: Monotonic time results must be newer than.
+
+        Returns:
+            CacheEntry: The result; pid tells whether this process probed it.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        entry = self.read(name)
+        if self._fresh(entry, ttl, not_before):
+            return self._taken(entry, 'hit')
+
+        offset = self._slot(name, create=True)
+        with self._probing.setdefault(name, threading.Lock()):
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+            try:
+                # Someone else may have probed while we waited for the lock
+                entry = self.read(name)
+                if self._fresh(entry, ttl, not_before):
+                    return self._taken(entry, 'shared')
+                self.write(name, probe())
+                return self._taken(self.read(name), 'miss')
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    @staticmethod
+    def _taken(entry, outcome):
+        CACHE_LOOKUPS.inc(name=entry.name, outcome=outcome)
+        CACHE_AGE.set(entry.age, name=entry.name)
+        if outcome != 'miss' and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Probe cache %s for '%s': %s", outcome, entry.name, entry.describe())
+        return entry
+
+    def close(self):
+        # Not in the middle of another thread's read or write
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
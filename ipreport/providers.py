@@ -0,0 +1,163 @@
+"""Health tracking and circuit breakers for IP echo services."""
+import json
+import logging
+import os
+import threading
+import time
+
+EWMA_ALPHA = 0.3  # weight of the newest sample
+BREAKER_THRESHOLD = 3  # consecutive failures before an endpoint is skipped
+BREAKER_BASE_COOLDOWN = 60  # seconds, doubled for every further failed trial
+BREAKER_MAX_COOLDOWN = 3600  # seconds
+SAVE_INTERVAL = 3600  # seconds between saves of the statistics alone; breaker changes are saved at once
+
+
+class ProviderHealth:
+    """Rolling statistics for one endpoint."""
+
+    def __init__(self, url, latency=None, success_rate=1.0, consecutive_failures=0,
+                 open_until=0.0, trips=0):
+        self.url = url
+        self.latency = latency  # EWMA of successful response time, seconds
+        self.success_rate = success_rate  # EWMA of 1 (success) / 0 (failure)
+        self.consecutive_failures = consecutive_failures
+        self.open_until = open_until  # wall-clock time the breaker stays open until
+        self.trips = trips  # how many times in a row the breaker has opened
+
+    def is_open(self, now):
+        return now < self.open_until
+
+    def score(self, fallback_latency):
+        """Lower is better: expected latency inflated by the failure rate."""
+        latency = self.latency if self.latency is not None else fallback_latency
+        return latency / max(self.success_rate, 0.05)
+
+    def to_dict(self):
+        return {
+            'latency': self.latency,
+            'success_rate': self.success_rate,
+            'consecutive_failures': self.consecutive_failures,
+            'open_until': self.open_until,
+            'trips': self.trips,
+        }
+
+
+class ProviderRegistry:
+    """
+    Orders endpoints by observed health and keeps failing ones out of rotation.
+
+    Every probe result is fed back with record_success() or record_failure(). After
+    BREAKER_THRESHOLD consecutive failures the endpoint's breaker opens for
+    BREAKER_BASE_COOLDOWN seconds. When that expires the endpoint gets one trial
+    probe. If the trial fails the breaker reopens with twice the cooldown, up to
+    BREAKER_MAX_COOLDOWN. Statistics are saved to state_path, when given, so a
+    restart does not start from scratch: flush() writes them whenever a breaker
+    opens or closes and otherwise at most every SAVE_INTERVAL seconds, which
+    spares the SD card a write per probe. A registry can be shared between threads.
+    """
+
+    def __init__(self, urls, state_path=None, alpha=EWMA_ALPHA, threshold=BREAKER_THRESHOLD,
+                 base_cooldown=BREAKER_BASE_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.urls = list(urls)
+        self.state_path = state_path
+        self.alpha = alpha
+        self.threshold = threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.health = {url: ProviderHealth(url) for url in self.urls}
+        self._lock = threading.RLock()
+        self._breakers_changed = False  # a breaker opened or closed since the last save
+        self._saved_at = time.monotonic()
+        self.load()
+
+    def load(self):
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable provider state {self.state_path}: {e}")
+            return
+        for url, stats in data.items():
+            # Endpoints removed from the configuration are forgotten
+            if url in self.health:
+                self.health[url] = ProviderHealth(url, **stats)
+
+    def save(self):
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        with self._lock:
+            data = {url: h.to_dict() for url, h in self.health.items()}
+            self._breakers_changed = False
+            self._saved_at = time.monotonic()
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logging.warning(f"Could not save provider state to {self.state_path}: {e}")
+
+    def flush(self):
+        """Save if a breaker has changed state, or the statistics are SAVE_INTERVAL old."""
+        with self._lock:
+            due = self._breakers_changed or time.monotonic() - self._saved_at >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def ranked(self, now=None):
+        """
+        Return the endpoints worth probing, healthiest first.
+
+        Endpoints with an open breaker are left out. If every breaker is open, all
+        endpoints are returned anyway (in order of least recent trip) so a
+        recovered link is noticed instead of being locked out.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            known = [h.latency for h in self.health.values() if h.latency is not None]
+            fallback = sum(known) / len(known) if known else 1.0
+
+            closed = [h for h in self.health.values() if not h.is_open(now)]
+            if not closed:
+                return [h.url for h in sorted(self.health.values(), key=lambda h: h.open_until)]
+            return [h.url for h in sorted(closed, key=lambda h: h.score(fallback))]
+
+    def record_success(self, url, latency):
+        with self._lock:
+            self._record_success(url, latency)
+
+    def record_failure(self, url, now=None):
+        with self._lock:
+            self._record_failure(url, time.time() if now is None else now)
+
+    def _record_success(self, url, latency):
+        health = self.health[url]
+        if health.latency is None:
+            health.latency = latency
+        else:
+            health.latency += self.alpha * (latency - health.latency)
+        health.success_rate += self.alpha * (1.0 - health.success_rate)
+        if health.trips:
+            logging.info(f"Provider {url} recovered, closing circuit breaker.")
+            self._breakers_changed = True
+        health.consecutive_failures = 0
+        health.open_until = 0.0
+        health.trips = 0
+
+    def _record_failure(self, url, now):
+        health = self.health[url]
+        health.success_rate += self.alpha * (0.0 - health.success_rate)
+        health.consecutive_failures += 1
+        # A failed trial after a cooldown reopens immediately, with a longer cooldown
+        if health.consecutive_failures >= self.threshold and not health.is_open(now):
+            cooldown = min(self.base_cooldown * 2 ** health.trips, self.max_cooldown)
+            health.open_until = now + cooldown
+            health.trips += 1
+            self._breakers_changed = True
+            logging.warning(f"Provider {url} failed {health.consecutive_failures} times in a row, "
+                            f"skipping it for {cooldown:.0f}s.")
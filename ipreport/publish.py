@@ -0,0 +1,415 @@
+"""
+Publishing the current IP through pluggable backends.
+
+Every backend receives the same PublishRecord, i.e. everything that changed in
+one cycle, and writes all of it in one pass over one connection. Only the
+webhook sends it as a single request; the file backends still write each file
+with its own commands, so the batching saves connections and logins, not
+per-file round trips. Whole files are
+replaced atomically where the backend allows it. The history line is appended,
+not re-uploaded. Backends that can append also keep history.bin, the compact
+binary form of log.txt (see ipreport.history). Dirty tracking (PublishState),
+the offline outbox (see ipreport.outbox) and timing are shared by all backends
+through the Publisher base class.
+"""
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from ipreport import metrics
+from ipreport.ftps import rotated_name
+from ipreport.history import DEFAULT_FILE as HISTORY_FILE, Entry, pack as pack_history
+from ipreport.state import HEARTBEAT_FILE, IP_FILE, LOG_FILE, UPLINKS_FILE
+from ipreport.uptime import REPORT_FILE as UPTIME_FILE
+
+PUBLISH_SECONDS = metrics.histogram(
+    'ipreport_publish_seconds', 'Time for a backend to write one publish record.', ['backend'])
+PUBLISH_ERRORS = metrics.counter(
+    'ipreport_publish_errors_total', 'Publish attempts that failed, per backend.', ['backend'])
+
+
+def _utc(when):
+    """ISO time in UTC for a local one, so receivers in other time zones read it right."""
+    return when.astimezone(timezone.utc).isoformat()
+
+
+class PublishRecord(namedtuple('PublishRecord', ['ip', 'timestamp', 'pending', 'changes', 'uplinks', 'attachments'],
+                               defaults=(None, None))):
+    """
+    The state change of one cycle: the IP, when it was published and which files are out of date.
+
+    changes holds the IP changes (history Entry tuples, oldest first) to add to
+    the history. Normally that is just the current IP, but after an outage it
+    is everything the outbox collected, each with the time it was seen.
+    uplinks holds the public IPv4/IPv6 of every uplink when those are probed;
+    they are written as uplinks.json next to ip.txt, which keeps the primary IP.
+    attachments maps further file names to contents to write whole, such as
+    the uptime report that goes out with every heartbeat.
+    """
+    __slots__ = ()
+
+    def files(self):
+        """Whole-file contents to write, by remote file name."""
+        contents = {}
+        if IP_FILE in self.pending:
+            contents[IP_FILE] = self.ip.encode('utf-8')
+        if HEARTBEAT_FILE in self.pending:
+            contents[HEARTBEAT_FILE] = self.timestamp.isoformat().encode('utf-8')
+        if UPLINKS_FILE in self.pending:
+            contents[UPLINKS_FILE] = json.dumps({
+                'timestamp': self.timestamp.isoformat(),
+                'primary': self.ip,
+                'uplinks': self.uplinks,
+            }, sort_keys=True).encode('utf-8')
+        contents.update(self.attachments or {})
+        return contents
+
+    def log_line(self, changes=None):
+        """The history lines to append (all changes, or the given ones), or None if the IP did not change."""
+        if LOG_FILE not in self.pending or not self.changes:
+            return None
+        return ''.join(f"{c.timestamp.isoformat()} - {c.ip}\n" for c in changes or self.changes).encode('utf-8')
+
+    def history_record(self, changes=None):
+        """The same changes as fixed-width binary records (see ipreport.history), or None."""
+        if LOG_FILE not in self.pending or not self.changes:
+            return None
+        return b''.join(pack_history(c.timestamp, c.ip) for c in changes or self.changes)
+
+    def to_dict(self):
+        result = {
+            'ip': self.ip,
+            'timestamp': _utc(self.timestamp),
+            'changed': LOG_FILE in self.pending,
+            'changes': [{'ip': c.ip, 'timestamp': _utc(c.timestamp)} for c in self.changes],
+        }
+        if self.uplinks is not None:
+            result['uplinks'] = self.uplinks
+        return result
+
+
+class Publisher:
+    """
+    Base class for publishing backends.
+
+    Subclasses implement write(record), which raises on failure, and may
+    override on_error() and close().
+
+    With an outbox attached, the history is fed from the queued changes rather
+    than from the IP passed to attempt(), so changes seen while the backend was
+    unreachable are all written, in one batch, by the next successful attempt.
+    With an uptime recorder attached, its report is written as uptime.json
+    whenever lastupdate.txt is.
+    """
+    name = None
+
+    def __init__(self, state):
+        self.state = state
+        self.outbox = None
+        self.uptime = None
+        self.uptime_days = 7
+
+    def attempt(self, ip, uplinks=None):
+        """
+        Make one attempt at bringing the backend up to date.
+
+        Args:
+            ip (str): The primary public IP.
+            uplinks (dict): This cycle's addresses per uplink and family, if probed.
+
+        Returns:
+            bool: True if the backend is up to date, False if the attempt failed
+            and may be retried.
+        """
+        now = datetime.now()
+        if uplinks is not None:
+            uplinks = self.state.merge_uplinks(uplinks)
+        pending = self.state.pending(ip, uplinks=uplinks)
+        if self.outbox is None:
+            changes = [Entry(now, ip)] if LOG_FILE in pending else []
+        else:
+            changes = self.outbox.pending()
+            if changes:
+                pending |= {IP_FILE, HEARTBEAT_FILE, LOG_FILE}
+            else:
+                # Already logged; only ip.txt may be behind after a crash
+                pending.discard(LOG_FILE)
+        if not pending:
+            logging.info("IP has not changed and heartbeat is not due. Skipping %s update.", self.name)
+            return True
+
+        if UPLINKS_FILE in pending:
+            published = self.state.uplinks or {}
+            for name in self.state.changed_uplinks(uplinks):
+                logging.info(f"Uplink {name} changed: {published.get(name)} -> {uplinks[name]}")
+
+        attachments = None
+        if self.uptime is not None and HEARTBEAT_FILE in pending:
+            attachments = {UPTIME_FILE: self.uptime.export(self.uptime_days)}
+        record = PublishRecord(ip, now, pending, changes, uplinks, attachments)
+        started = time.monotonic()
+        try:
+            self.write(record)
+        except Exception as e:
+            logging.error(f"Error updating files on {self.name}: {e}")
+            PUBLISH_ERRORS.inc(backend=self.name)
+            self.on_error()
+            return False
+
+        latency = time.monotonic() - started
+        PUBLISH_SECONDS.observe(latency, backend=self.name)
+        logging.info("Published %s to %s in %.0fms", ', '.join(sorted(pending)), self.name, latency * 1000)
+        if self.outbox is not None and changes:
+            if len(changes) > 1:
+                logging.info(f"Flushed {len(changes)} queued IP changes to {self.name}")
+            self.outbox.commit(len(changes))
+        self.state.mark_published(ip, record.timestamp.timestamp(), uplinks)
+        return True
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def append_history(self, record, append, files=(LOG_FILE, HISTORY_FILE)):
+        """
+        Append the record's changes to each history file through append(filename, data).
+
+        A file's progress is saved as soon as its append succeeds, so if a later
+        step of the cycle fails, the retry only sends each file the changes it
+        doesn't have yet.
+        """
+        if LOG_FILE not in record.pending or not record.changes:
+            return
+        for filename in files:
+            done = self.state.appended_count(filename, record.changes)
+            if done == len(record.changes):
+                continue
+            encode = record.log_line if filename == LOG_FILE else record.history_record
+            append(filename, encode(record.changes[done:]))
+            self.state.mark_appended(filename, record.changes)
+
+    def on_error(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FTPSPublisher(Publisher):
+    """
+    Keeps ip.txt, lastupdate.txt and log.txt on an FTPS server in line with the current IP.
+
+    Files are written over the long-lived connection held by the FTPSSession,
+    but FTP has no way to send several files at once: each out-of-date file
+    costs its own commands. A replace is five round trips (PASV, STOR, the
+    transfer's final reply, RNFR, RNTO) and an append three, each with a data
+    connection. An IP change (ip.txt and lastupdate.txt replaced, log.txt and
+    history.bin appended) thus takes 16 round trips, a heartbeat 5. The
+    connect-per-cycle code this replaced needed about as many for its files
+    (a TYPE before every transfer and a download of log.txt), plus a TCP and
+    TLS handshake and a login every cycle. Publishers that share a session (fleet mode) each pass their own remote_path
+    and change into it before writing. http_stats, if given, is called for the
+    HTTP side of the connection reuse summary logged with every heartbeat.
+    """
+    name = 'ftps'
+
+    def __init__(self, session, state, remote_path=None, http_stats=None):
+        super().__init__(state)
+        self.session = session
+        self.remote_path = remote_path
+        self.http_stats = http_stats
+
+    def write(self, record):
+        ftps = self.session.acquire()
+        if not ftps:
+            raise ConnectionError("FTPS server not reachable")
+
+        if self.remote_path:
+            ftps.cwd(self.remote_path)
+
+        for filename, data in record.files().items():
+            self.session.replace(ftps, filename, data)
+            if filename == UPTIME_FILE:
+                logging.info(f"Updated {filename} ({len(data)} bytes)")
+            else:
+                logging.info(f"Updated {filename} with {data.decode('utf-8')}")
+
+        if HEARTBEAT_FILE in record.pending:
+            http = f"HTTP: {self.http_stats()}; " if self.http_stats else ''
+            logging.info(f"Connection reuse - {http}FTPS: {self.session.describe_stats()}")
+
+        def append(filename, data):
+            # Send only the new lines instead of re-uploading the whole history
+            written = self.session.append(ftps, filename, data, record.timestamp)
+            if filename == LOG_FILE:
+                lines = data.count(b'\n')
+                logging.info(f"Appended {lines} IP change(s) to {written}: {record.ip}")
+
+        self.append_history(record, append)
+
+    def on_error(self):
+        # Don't trust a connection that failed mid-transfer
+        self.session.invalidate()
+
+    def close(self):
+        self.session.close()
+
+
+class SFTPPublisher(Publisher):
+    """Writes the same files over SFTP. Needs paramiko (pip install paramiko)."""
+    name = 'sftp'
+
+    def __init__(self, state, host, user, password=None, key_file=None, remote_path='.', port=22,
+                 timeout=15):
+        try:
+            import paramiko
+        except ImportError:
+            raise RuntimeError("The sftp backend needs paramiko: pip install paramiko")
+        super().__init__(state)
+        self._paramiko = paramiko
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.key_file = key_file
+        self.remote_path = remote_path
+        self.timeout = timeout
+        self._client = None
+        self._sftp = None
+
+    def _connect(self):
+        if self._sftp is not None:
+            transport = self._client.get_transport()
+            if transport is not None and transport.is_active():
+                return self._sftp
+            self.on_error()
+        client = self._paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.connect(
+            self.host, port=self.port, username=self.user, password=self.password,
+            key_filename=self.key_file, timeout=self.timeout
+        )
+        self._client = client
+        self._sftp = client.open_sftp()
+        self._sftp.chdir(self.remote_path)
+        return self._sftp
+
+    def write(self, record):
+        sftp = self._connect()
+        for filename, data in record.files().items():
+            tmp_name = f".{filename}.tmp"
+            with sftp.open(tmp_name, 'wb') as f:
+                f.write(data)
+            sftp.posix_rename(tmp_name, filename)
+
+        def append(filename, data):
+            with sftp.open(filename, 'ab') as f:
+                f.write(data)
+
+        self.append_history(record, append)
+
+    def on_error(self):
+        if self._client is not None:
+            self._client.close()
+        self._client = None
+        self._sftp = None
+
+    def close(self):
+        self.on_error()
+
+
+class WebDAVPublisher(Publisher):
+    """
+    Writes the files to a WebDAV collection with PUT.
+
+    Each file is uploaded under a temporary name and moved into place. WebDAV
+    has no append, so history goes to monthly segments (log-YYYY-MM.txt), like
+    the FTPS fallback, which keeps each upload bounded.
+    """
+    name = 'webdav'
+
+    def __init__(self, state, base_url, user=None, password=None, timeout=15):
+        super().__init__(state)
+        self.base_url = base_url.rstrip('/') + '/'
+        self.auth = (user, password) if user else None
+        self.timeout = timeout
+
+    def _request(self, method, name, **kwargs):
+        from ipreport.httpclient import get_session
+
+        response = get_session().request(
+            method, self.base_url + name, auth=self.auth, timeout=self.timeout, **kwargs
+        )
+        if method != 'GET' or response.status_code != 404:
+            response.raise_for_status()
+        return response
+
+    def write(self, record):
+        for filename, data in record.files().items():
+            tmp_name = f".{filename}.tmp"
+            self._request('PUT', tmp_name, data=data)
+            self._request('MOVE', tmp_name, headers={
+                'Destination': self.base_url + filename,
+                'Overwrite': 'T',
+            })
+
+        def append(filename, data):
+            segment = rotated_name(filename, record.timestamp)
+            response = self._request('GET', segment)
+            existing = response.content if response.status_code != 404 else b''
+            self._request('PUT', segment, data=existing + data)
+
+        self.append_history(record, append, files=(LOG_FILE,))
+
+
+class WebhookPublisher(Publisher):
+    """POSTs the record as one JSON document, e.g. to a collector or chat integration."""
+    name = 'webhook'
+
+    def __init__(self, state, url, token=None, timeout=15):
+        super().__init__(state)
+        self.url = url
+        self.headers = {'Authorization': f"Bearer {token}"} if token else {}
+        self.timeout = timeout
+
+    def write(self, record):
+        from ipreport.httpclient import get_session
+
+        body = dict(record.to_dict(), host=os.uname().nodename)
+        response = get_session().post(self.url, json=body, headers=self.headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class LocalDirPublisher(Publisher):
+    """
+    Writes the files into a local directory.
+
+    Useful on a host that is itself served over HTTP or synced elsewhere, and for
+    exercising the whole publish path offline.
+    """
+    name = 'local'
+
+    def __init__(self, state, directory):
+        super().__init__(state)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record):
+        for filename, data in record.files().items():
+            path = os.path.join(self.directory, filename)
+            tmp_path = os.path.join(self.directory, f".{filename}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+        def append(filename, data):
+            with open(os.path.join(self.directory, filename), 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.append_history(record, append)
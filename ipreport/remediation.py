@@ -0,0 +1,280 @@
+"""
+Actions taken when the watchdog decides the connection is gone.
+
+Rather than rebooting straight away, the daemon climbs a ladder of
+increasingly disruptive actions (see RemediationLadder): re-probe, flush the
+DNS cache, bounce the interface, restart NetworkManager, and only then reboot.
+"""
+import json
+import logging
+import os
+import subprocess
+import time
+from collections import namedtuple
+
+from ipreport import metrics
+
+ACTIONS = {
+    'reprobe': [],  # nothing to run, the verification check is the action
+    'flush-dns': [['sudo', 'resolvectl', 'flush-caches']],
+    'bounce-interface': [
+        ['sudo', 'ip', 'link', 'set', 'dev', '{interface}', 'down'],
+        ['sudo', 'ip', 'link', 'set', 'dev', '{interface}', 'up'],
+    ],
+    'restart-network-manager': [['sudo', 'systemctl', 'restart', 'NetworkManager']],
+    'reboot': [['sudo', 'reboot']],
+}
+
+# action:cooldown, where cooldown is how long (seconds) the action gets to take
+# effect before the ladder escalates past it
+DEFAULT_LADDER = 'reprobe:0,flush-dns:60,bounce-interface:120,restart-network-manager:300,reboot:900'
+
+REMEDIATIONS = metrics.counter(
+    'ipreport_remediations_total', 'Remediation commands run, by outcome.', ['action', 'result'])
+REMEDIATION_STEP = metrics.gauge(
+    'ipreport_remediation_step', 'Position on the remediation ladder, 0 = first step.')
+REBOOTS_DAMPED = metrics.counter(
+    'ipreport_reboots_damped_total', 'Reboots skipped because of too many recent reboots.')
+
+Step = namedtuple('Step', ['action', 'cooldown'])
+
+
+def parse_ladder(spec):
+    """
+    Parse a ladder description like 'reprobe:0,flush-dns:60,reboot:900'.
+
+    Returns:
+        list: Step tuples in the order they are tried.
+    """
+    steps = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        action, _, cooldown = item.partition(':')
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown remediation action '{action}'")
+        steps.append(Step(action, float(cooldown or 0)))
+    if not steps:
+        raise ValueError("REMEDIATION_LADDER is empty")
+    return steps
+
+
+def default_interface(route_file='/proc/net/route'):
+    """
+    The interface of the IPv4 default route, or None if there is none.
+
+    The default route is often gone when the link is the problem, so callers
+    remember the last answer (see RemediationLadder.remember_interface) rather
+    than guess; the first interface in the list may well be docker0 or wlan0.
+    """
+    try:
+        with open(route_file, encoding='ascii') as f:
+            for line in f.read().splitlines()[1:]:
+                fields = line.split()
+                if len(fields) >= 2 and fields[1] == '00000000':
+                    return fields[0]
+    except OSError:
+        pass
+    return None
+
+
+def needs_interface(action):
+    return any('{interface}' in arg for command in ACTIONS[action] for arg in command)
+
+
+def run_action(name, timeout=30, interface=None):
+    """
+    Run the commands of one remediation action.
+
+    Returns:
+        bool: True if every command ran and exited successfully.
+    """
+    commands = ACTIONS[name]
+    if needs_interface(name):
+        interface = interface or default_interface()
+        if interface is None:
+            logging.error(f"Remediation '{name}' needs an interface and none was found.")
+            REMEDIATIONS.inc(action=name, result='failed')
+            return False
+    try:
+        for command in commands:
+            command = [arg.format(interface=interface) for arg in command]
+            logging.error(f"Running remediation '{name}': {' '.join(command)}")
+            subprocess.run(command, check=True, timeout=timeout)
+        logging.info(f"Remediation '{name}' executed successfully.")
+        REMEDIATIONS.inc(action=name, result='ok')
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Remediation '{name}' failed (process error): {e}")
+    except subprocess.TimeoutExpired:
+        logging.error(f"Remediation '{name}' timed out.")
+    except Exception as e:
+        logging.error(f"Unexpected error during remediation '{name}': {e}")
+    REMEDIATIONS.inc(action=name, result='failed')
+    return False
+
+
+class RemediationLadder:
+    """
+    Which remediation step comes next, persisted across restarts and reboots.
+
+    due() hands out the current step once the cooldown of the step that ran
+    last has passed. After a step has run, the caller verifies the connection and calls
+    reset() if it is back or escalate() if not. The last step repeats.
+
+    Reboots are recorded with their wall-clock time. Each recent reboot (within
+    reboot_window) doubles the cooldown before the next one, and after
+    max_reboots in the window the reboot step is skipped and the ladder starts
+    again from the bottom, so a box whose uplink is simply down doesn't spend
+    the outage rebooting.
+
+    The interface last seen carrying the default route is kept with the rest of
+    the state, for the steps that bounce it once the route has gone.
+
+    The state file is only rewritten (and fsynced) when something in it changed.
+    The ladder does no locking of its own: use it from one thread, which in the
+    daemon is the remediation task's worker.
+    """
+
+    def __init__(self, steps, state_path=None, max_reboots=3, reboot_window=6 * 3600):
+        self.steps = steps
+        self.state_path = state_path
+        self.max_reboots = max_reboots
+        self.reboot_window = reboot_window
+        self.position = 0
+        self.last_run = None  # wall-clock time the last step was started
+        self.last_step = 0
+        self._started = None  # monotonic time of last_run, if it was in this process
+        self.reboots = []  # wall-clock times of recent reboots
+        self.interface = None  # last interface seen carrying the default route
+        self.load()
+        self._saved = self._state()  # what the state file holds
+        REMEDIATION_STEP.set(self.position)
+
+    def load(self):
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.position = min(int(data.get('position', 0)), len(self.steps) - 1)
+            self.last_run = data.get('last_run')
+            self.last_step = min(int(data.get('last_step', 0)), len(self.steps) - 1)
+            self.reboots = [float(t) for t in data.get('reboots', [])]
+            self.interface = data.get('interface')
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable remediation state {self.state_path}: {e}")
+
+    def _state(self):
+        return {
+            'position': self.position,
+            'last_step': self.last_step,
+            'last_run': self.last_run,
+            'reboots': list(self.reboots),
+            'interface': self.interface,
+        }
+
+    def save(self):
+        """Write the state file if it differs from what was last written."""
+        state = self._state()
+        if not self.state_path or state == self._saved:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.state_path)
+            self._saved = state
+        except OSError as e:
+            logging.warning(f"Could not save remediation state to {self.state_path}: {e}")
+
+    def remember_interface(self, interface):
+        """Note the interface of the default route while there is one."""
+        if interface and interface != self.interface:
+            self.interface = interface
+            self.save()
+
+    def _recent_reboots(self, now):
+        return [t for t in self.reboots if 0 <= now - t < self.reboot_window]
+
+    def due(self, now=None, skip=()):
+        """
+        Return the step to run now and mark it started, or None while the last one takes effect.
+
+        Steps whose action is in skip, because they can't run right now, are
+        passed over without using up a cooldown. The state is saved before
+        returning, so a reboot step is on disk before the machine goes down.
+        """
+        live = now is None
+        if live:
+            now = time.time()
+        while self.steps[self.position].action in skip:
+            if self.position == len(self.steps) - 1:
+                logging.warning(f"Skipping remediation '{self.steps[self.position].action}', "
+                                f"there is nothing to escalate to.")
+                self.save()
+                return None
+            logging.warning(f"Skipping remediation '{self.steps[self.position].action}'.")
+            REMEDIATIONS.inc(action=self.steps[self.position].action, result='skipped')
+            self.position += 1
+        step = self.steps[self.position]
+        cooldown = self.steps[self.last_step].cooldown if self.last_run is not None else 0
+        if step.action == 'reboot':
+            recent = self._recent_reboots(now)
+            if len(recent) >= self.max_reboots:
+                logging.warning(f"Not rebooting: {len(recent)} reboots in the last "
+                                f"{self.reboot_window / 3600:g}h. Starting the ladder again.")
+                REBOOTS_DAMPED.inc()
+                self.position = 0
+                step = self.steps[0]
+            elif recent:
+                # Back off further with every recent reboot
+                cooldown = max(cooldown, step.cooldown * 2 ** len(recent))
+
+        if self.last_run is not None:
+            if live and self._started is not None:
+                # Within one run of the daemon the monotonic clock is immune to NTP steps
+                elapsed = time.monotonic() - self._started
+            else:
+                elapsed = now - self.last_run
+            # A negative elapsed time means the wall clock was stepped back; don't wait forever
+            if 0 <= elapsed < cooldown:
+                logging.warning(f"Remediation '{step.action}' waits another {cooldown - elapsed:.0f}s "
+                                f"for '{self.steps[self.last_step].action}' to take effect.")
+                self.save()  # steps skipped or a damped reboot may have moved the position
+                return None
+
+        self.last_run = now
+        self._started = time.monotonic()
+        self.last_step = self.position
+        if step.action == 'reboot':
+            self.reboots = self._recent_reboots(now) + [now]
+        REMEDIATION_STEP.set(self.position)
+        self.save()
+        return step
+
+    def escalate(self):
+        """The last step didn't bring the connection back: move one rung up."""
+        self.position = min(self.position + 1, len(self.steps) - 1)
+        REMEDIATION_STEP.set(self.position)
+        self.save()
+
+    @property
+    def at_rest(self):
+        """True when reset() has nothing to do."""
+        return self.position == 0 and self.last_run is None
+
+    def reset(self):
+        """The connection is back: start from the bottom next time."""
+        if self.at_rest:
+            return
+        self.position = 0
+        self.last_run = None
+        self._started = None
+        REMEDIATION_STEP.set(0)
+        self.save()
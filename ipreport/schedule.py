@@ -0,0 +1,70 @@
+"""Fixed-rate deadlines on the monotonic clock, with jitter and a catch-up policy."""
+import random
+
+CATCH_UP_POLICIES = ('skip', 'burst', 'delay')
+
+
+class Schedule:
+    """
+    Deadlines for a task that should run every interval seconds.
+
+    The deadlines sit on a fixed grid, start + n * interval, on a monotonic
+    clock. The task's own run time does not make the schedule drift, and
+    neither does a wall-clock step (NTP on a board without an RTC). Each run
+    also waits a random 0..jitter * interval seconds, drawn afresh every time,
+    so hosts that boot together don't all hit the echo services and the FTPS
+    server at the same moment. The jitter is never added to the grid itself,
+    so it doesn't accumulate.
+
+    When a run overruns one or more slots, catch_up decides what happens:
+        skip   drop the missed slots and stay on the grid
+        burst  run the missed slots back to back, at most max_burst of them
+        delay  start a new grid one interval after the late run finished
+    """
+
+    def __init__(self, interval, start, jitter=0.0, catch_up='skip', max_burst=3, rng=None):
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy '{catch_up}'")
+        self.interval = interval
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.max_burst = max_burst
+        self.rng = rng or random.Random()
+        self.slot = start
+        self.missed = 0  # slots that were never run
+
+    def _offset(self):
+        return self.rng.uniform(0, self.jitter * self.interval) if self.jitter else 0.0
+
+    def first(self):
+        """The time of the first run."""
+        return self.slot + self._offset()
+
+    def advance(self, now):
+        """
+        Move on from the slot that just ran.
+
+        Args:
+            now (float): The monotonic time the run finished.
+
+        Returns:
+            float: The monotonic time of the next run.
+        """
+        self.slot += self.interval
+        if self.slot > now:
+            return self.slot + self._offset()
+
+        behind = int((now - self.slot) // self.interval) + 1
+        if self.catch_up == 'skip':
+            self.slot += behind * self.interval
+            self.missed += behind
+            return self.slot + self._offset()
+        if self.catch_up == 'delay':
+            self.slot = now + self.interval
+            self.missed += behind
+            return self.slot + self._offset()
+        if behind > self.max_burst:
+            dropped = behind - self.max_burst
+            self.slot += dropped * self.interval
+            self.missed += dropped
+        return now  # catching up, no jitter
@@ -0,0 +1,156 @@
+"""Locally persisted record of what was last published, used to skip redundant uploads."""
+import json
+import logging
+import os
+import time
+
+IP_FILE = 'ip.txt'
+HEARTBEAT_FILE = 'lastupdate.txt'
+LOG_FILE = 'log.txt'
+UPLINKS_FILE = 'uplinks.json'
+
+
+class PublishState:
+    """
+    Dirty tracking for the files written to the server.
+
+    ip.txt and log.txt are only written when the IP differs from the last one that
+    was successfully published. lastupdate.txt is written on the first cycle after
+    a change and then at most once every heartbeat_interval seconds. The state is
+    saved to a small JSON file so a restart doesn't re-upload (or re-log) an IP
+    that is already on the server.
+
+    With several uplinks or address families (see ProbeTask) the addresses of
+    every uplink are tracked too, and uplinks.json is written whenever any one
+    of them changes.
+
+    Appends to the history files are tracked per file until the cycle is
+    published, so a retry after a partly failed cycle doesn't append the same
+    changes to a file twice.
+    """
+
+    def __init__(self, path, heartbeat_interval=600):
+        self.path = path
+        self.heartbeat_interval = heartbeat_interval
+        self.ip = None
+        self.last_heartbeat = 0.0
+        self.changed_at = None  # when the published IP last changed
+        self.uplinks = None  # {uplink: {'ipv4': ip, 'ipv6': ip}} as last published
+        self.appended = {}  # history file -> IPs of the unpublished changes already appended to it
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.ip = data.get('ip')
+            self.last_heartbeat = float(data.get('last_heartbeat', 0.0))
+            self.changed_at = data.get('changed_at')
+            self.uplinks = data.get('uplinks')
+            self.appended = data.get('appended') or {}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable publish state {self.path}: {e}")
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'ip': self.ip,
+                    'last_heartbeat': self.last_heartbeat,
+                    'changed_at': self.changed_at,
+                    'uplinks': self.uplinks,
+                    'appended': self.appended,
+                }, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not save publish state to {self.path}: {e}")
+
+    def merge_uplinks(self, uplinks):
+        """
+        The last published uplink addresses, updated with this cycle's lookups.
+
+        A lookup that failed (None) keeps the address last published for it, so
+        one lost probe doesn't count as a change.
+        """
+        merged = {name: dict(addresses) for name, addresses in (self.uplinks or {}).items()}
+        for name, addresses in uplinks.items():
+            entry = merged.setdefault(name, {})
+            for family, ip in addresses.items():
+                if ip is not None or family not in entry:
+                    entry[family] = ip
+        return merged
+
+    def changed_uplinks(self, uplinks):
+        """Names of the uplinks whose merged addresses differ from the published ones."""
+        published = self.uplinks or {}
+        return sorted(name for name, addresses in uplinks.items() if published.get(name) != addresses)
+
+    def pending(self, ip, now=None, uplinks=None):
+        """
+        Work out which remote files are out of date.
+
+        Args:
+            ip (str): The IP detected this cycle.
+            now (float): Current wall-clock time, defaults to time.time().
+            uplinks (dict): Merged per-uplink addresses (see merge_uplinks), if probed.
+
+        Returns:
+            set: File names that need uploading. Empty when there is nothing to do.
+        """
+        if now is None:
+            now = time.time()
+
+        pending = set()
+        if uplinks is not None and self.changed_uplinks(uplinks):
+            pending = {UPLINKS_FILE, HEARTBEAT_FILE}
+
+        if ip != self.ip:
+            return pending | {IP_FILE, HEARTBEAT_FILE, LOG_FILE}
+        if pending:
+            return pending
+
+        elapsed = now - self.last_heartbeat
+        # A negative elapsed time means the wall clock was stepped back, e.g. by NTP
+        if elapsed >= self.heartbeat_interval or elapsed < 0:
+            return {HEARTBEAT_FILE}
+        return set()
+
+    def appended_count(self, filename, changes):
+        """
+        How many of changes, from the first, an earlier attempt already appended to filename.
+
+        Changes are matched by IP rather than timestamp: without an outbox every
+        attempt stamps the change afresh, and consecutive changes never repeat an IP.
+        """
+        done = self.appended.get(filename, [])
+        if [c.ip for c in changes[:len(done)]] == done:
+            return len(done)
+        return 0
+
+    def mark_appended(self, filename, changes):
+        """Record that changes are all in filename now, before the rest of the cycle is written."""
+        self.appended[filename] = [c.ip for c in changes]
+        self.save()
+
+    def mark_published(self, ip, now=None, uplinks=None):
+        if now is None:
+            now = time.time()
+        if ip != self.ip:
+            self.changed_at = now
+        self.ip = ip
+        if uplinks is not None:
+            self.uplinks = uplinks
+        self.last_heartbeat = now
+        self.appended = {}
+        self.save()
+
+    def ip_age(self, now=None):
+        """Seconds since the published IP last changed, or None if unknown."""
+        if self.changed_at is None:
+            return None
+        return (time.time() if now is None else now) - self.changed_at
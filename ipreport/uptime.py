@@ -0,0 +1,419 @@
+"""
+On-device record of connectivity: checks, probes, remediations and outages.
+
+uptime.bin is a fixed-size ring of 32-byte records in a memory-mapped file,
+so it never grows and recording costs a memory write, not a syscall:
+
+    header  8s magic, uint32 version, uint32 capacity, uint64 records written,
+            double current outage start (0 = up), uint64 outages, double
+            downtime seconds, double created, padded to 64 bytes
+    record  double timestamp, uint8 kind, uint8 ok, uint16 code, float
+            latency seconds, double value, 8x reserved
+
+Kinds are connectivity checks (code = deciding tier), IP probes, remediation
+steps (code = action, ok = it helped) and outages. Outages are tracked as the
+checks come in: the first failed check opens one, the next successful check
+closes it and writes an outage record (timestamp = start, value = duration).
+Reports therefore read the outage records rather than re-deriving them from
+every check, and lifetime totals survive the ring wrapping. The oldest records
+are overwritten once the ring is full; the default 131072 records hold about
+three weeks at one check and one probe every 30 seconds.
+
+Recording is off by default; set UPTIME_FILE (e.g. uptime.bin) to turn it on.
+
+Usage:
+    python -m ipreport.uptime report [--days 7] [--file uptime.bin] [--json]
+    python -m ipreport.uptime outages [--days 30]
+
+With UPTIME_PUBLISH=yes as well, the same report is uploaded as uptime.json next to
+log.txt with every heartbeat.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from ipreport.remediation import ACTIONS
+
+MAGIC = b'IPRUPTM1'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQdQdd')
+HEADER_SIZE = 64
+RECORD = struct.Struct('<dBBHfd8x')
+RECORD_SIZE = RECORD.size
+
+DEFAULT_FILE = 'uptime.bin'
+DEFAULT_CAPACITY = 131072  # records, 4 MiB
+REPORT_FILE = 'uptime.json'
+RECENT_OUTAGES = 20  # listed individually in the report
+
+CHECK, PROBE, REMEDIATION, OUTAGE = 1, 2, 3, 4
+TIERS = ['route', 'tcp', 'dns', 'https']
+ACTION_NAMES = list(ACTIONS)
+
+
+class Event(namedtuple('Event', ['timestamp', 'kind', 'ok', 'code', 'latency', 'value'])):
+    """One ring record, timestamp in epoch seconds."""
+    __slots__ = ()
+
+
+class Outage(namedtuple('Outage', ['start', 'duration', 'ongoing'])):
+    __slots__ = ()
+
+    def to_dict(self):
+        return {
+            'start': datetime.fromtimestamp(self.start).isoformat(timespec='seconds'),
+            'end': None if self.ongoing else datetime.fromtimestamp(self.start + self.duration).isoformat(
+                timespec='seconds'),
+            'seconds': round(self.duration),
+        }
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _latency_ms(values):
+    return {
+        'p50': round(_percentile(values, 0.5) * 1000, 1) if values else None,
+        'p95': round(_percentile(values, 0.95) * 1000, 1) if values else None,
+    }
+
+
+class UptimeRecorder:
+    """
+    The ring file mapped into this process.
+
+    Writes come from the event loop and reads (reports) from publisher
+    threads, so both go through one lock; reads only hold it to copy the
+    records they need. With capacity None, an existing
+    file is opened with whatever capacity it has (as the report command does).
+    """
+
+    def __init__(self, path=DEFAULT_FILE, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self._map = None
+        self._readonly = False
+        self._lock = threading.Lock()
+        self._written = 0
+        self._outage_start = 0.0
+        self._outages = 0
+        self._downtime = 0.0
+        self._created = 0.0
+
+    def open(self, readonly=False):
+        """
+        Map the file, starting a new record if it has another layout or capacity.
+
+        With readonly, as for reports, the file is only ever read: one this
+        version doesn't recognise raises ValueError instead of being
+        reinitialised, since only the recorder may throw a history away.
+        """
+        fd = os.open(self.path, os.O_RDONLY if readonly else os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            existing = HEADER.unpack(header)[:3] if len(header) == HEADER.size else None
+            if self.capacity is None:
+                self.capacity = existing[2] if existing and existing[:2] == (MAGIC, VERSION) else DEFAULT_CAPACITY
+            size = HEADER_SIZE + self.capacity * RECORD_SIZE
+            fresh = existing != (MAGIC, VERSION, self.capacity) or os.fstat(fd).st_size != size
+            if fresh and readonly:
+                raise ValueError(f"{self.path} is not an uptime record this version can read")
+            if fresh:
+                if len(header):
+                    logging.warning(f"Starting a new uptime record in {self.path}, "
+                                    f"the existing one has another layout or capacity.")
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+            self._readonly = readonly
+        finally:
+            os.close(fd)
+        if fresh:
+            self._created = time.time()
+            self._save_header()
+        else:
+            _, _, _, self._written, self._outage_start, self._outages, self._downtime, self._created = \
+                HEADER.unpack_from(self._map, 0)
+        return self
+
+    def _save_header(self):
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.capacity, self._written, self._outage_start,
+                         self._outages, self._downtime, self._created)
+
+    def _append(self, kind, timestamp, ok=True, code=0, latency=0.0, value=0.0):
+        RECORD.pack_into(self._map, HEADER_SIZE + (self._written % self.capacity) * RECORD_SIZE,
+                         timestamp, kind, int(bool(ok)), code, latency, value)
+        self._written += 1
+        self._save_header()
+
+    def record_check(self, timestamp, up, latency, tier):
+        """A connectivity check; also opens or closes the current outage."""
+        with self._lock:
+            code = TIERS.index(tier) if tier in TIERS else 0xFFFF
+            self._append(CHECK, timestamp, up, code, latency)
+            self._observe(timestamp, up)
+
+    def record_probe(self, timestamp, ok, latency, track_outages=False):
+        """
+        An IP lookup. With track_outages, as on a host without the watchdog,
+        a failed lookup opens an outage like a failed check would.
+        """
+        with self._lock:
+            self._append(PROBE, timestamp, ok, 0, latency)
+            if track_outages:
+                self._observe(timestamp, ok)
+
+    def record_remediation(self, timestamp, action, helped):
+        with self._lock:
+            code = ACTION_NAMES.index(action) if action in ACTION_NAMES else 0xFFFF
+            self._append(REMEDIATION, timestamp, helped, code)
+
+    def _observe(self, timestamp, up):
+        if not up and not self._outage_start:
+            self._outage_start = timestamp
+            self._save_header()
+        elif up and self._outage_start:
+            # The wall clock may have been stepped meanwhile (no RTC, NTP sync)
+            duration = max(0.0, timestamp - self._outage_start)
+            self._append(OUTAGE, self._outage_start, False, 0, 0.0, duration)
+            self._outages += 1
+            self._downtime += duration
+            self._outage_start = 0.0
+            self._save_header()
+            logging.info(f"Outage over after {duration:.0f}s")
+
+    def _record_at(self, n):
+        return RECORD.unpack_from(self._map, HEADER_SIZE + (n % self.capacity) * RECORD_SIZE)
+
+    def _ended(self, n):
+        # Outages are stamped with their start but appended when they end
+        timestamp, kind, _, _, _, value = self._record_at(n)
+        return timestamp + value if kind == OUTAGE else timestamp
+
+    def _snapshot(self, since=None):
+        """
+        The raw records from since on, oldest first, and the header state.
+
+        Only the copy happens under the lock; callers parse it afterwards, so
+        a report never holds up the writers. Records are appended in time
+        order, so the first one that reaches since is found by bisection; a
+        stepped wall clock can only shift that cut-off by the size of the step.
+        """
+        with self._lock:
+            first = self._written - min(self._written, self.capacity)
+            if since is not None:
+                low, high = first, self._written
+                while low < high:
+                    middle = (low + high) // 2
+                    if self._ended(middle) < since:
+                        low = middle + 1
+                    else:
+                        high = middle
+                first = low
+            chunks = []
+            n = first
+            while n < self._written:
+                index = n % self.capacity
+                run = min(self._written - n, self.capacity - index)
+                offset = HEADER_SIZE + index * RECORD_SIZE
+                chunks.append(self._map[offset:offset + run * RECORD_SIZE])
+                n += run
+            # When the record starts: its creation, or the oldest surviving record once the ring has wrapped
+            oldest = self._created if self._written <= self.capacity else \
+                self._record_at(self._written - self.capacity)[0]
+            state = {
+                'outage_start': self._outage_start,
+                'created': self._created,
+                'outages': self._outages,
+                'downtime': self._downtime,
+                'oldest': oldest,
+            }
+        return b''.join(chunks), state
+
+    @staticmethod
+    def _parse(data, since):
+        for fields in RECORD.iter_unpack(data):
+            event = Event(*fields)
+            # Outages are stamped with their start, keep those that reach into the period
+            if since is None or event.timestamp >= since or \
+                    (event.kind == OUTAGE and event.timestamp + event.value >= since):
+                yield event
+
+    def events(self, since=None):
+        """Records, oldest first, optionally only from since (epoch seconds) on."""
+        data, _ = self._snapshot(since)
+        return list(self._parse(data, since))
+
+    def outages(self, since=None, now=None):
+        """Outages overlapping the period from since, including the one in progress."""
+        if now is None:
+            now = time.time()
+        data, state = self._snapshot(since)
+        found = [Outage(e.timestamp, e.value, False) for e in self._parse(data, since) if e.kind == OUTAGE]
+        return self._with_ongoing(found, state, now)
+
+    @staticmethod
+    def _with_ongoing(found, state, now):
+        start = state['outage_start']
+        if start:
+            found.append(Outage(start, max(0.0, now - start), True))
+        return found
+
+    def report(self, days=7, now=None):
+        """Uptime and outage statistics for the last days, as a JSON-serialisable dict."""
+        if now is None:
+            now = time.time()
+        since = now - days * 86400
+        data, state = self._snapshot(since)
+        lifetime = {
+            'since': datetime.fromtimestamp(state['created']).isoformat(timespec='seconds'),
+            'outages': state['outages'],
+            'downtime_seconds': round(state['downtime']),
+        }
+        # Only the part of the period the ring actually covers can be judged
+        covered_from = min(now, max(since, state['oldest']))
+
+        outages = []
+        check_latency, probe_latency = [], []
+        checks_failed = probes = probes_failed = 0
+        decided_by = Counter()
+        remediations = {}
+        for e in self._parse(data, since):
+            if e.kind == CHECK:
+                check_latency.append(e.latency)
+                checks_failed += not e.ok
+                decided_by[TIERS[e.code] if e.code < len(TIERS) else 'unknown'] += 1
+            elif e.kind == PROBE:
+                probes += 1
+                if e.ok:
+                    probe_latency.append(e.latency)
+                else:
+                    probes_failed += 1
+            elif e.kind == OUTAGE:
+                outages.append(Outage(e.timestamp, e.value, False))
+            elif e.kind == REMEDIATION:
+                name = ACTION_NAMES[e.code] if e.code < len(ACTION_NAMES) else 'unknown'
+                entry = remediations.setdefault(name, {'runs': 0, 'helped': 0})
+                entry['runs'] += 1
+                entry['helped'] += e.ok
+        outages = self._with_ongoing(outages, state, now)
+
+        downtime = sum(
+            max(0.0, min(o.start + o.duration, now) - max(o.start, covered_from)) for o in outages
+        )
+        covered = now - covered_from
+        durations = [o.duration for o in outages]
+        return {
+            'host': os.uname().nodename,
+            'generated': datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+            'period': {
+                'days': days,
+                'start': datetime.fromtimestamp(since).isoformat(timespec='seconds'),
+                'covered_from': datetime.fromtimestamp(covered_from).isoformat(timespec='seconds'),
+            },
+            'uptime_percent': round(100 * (1 - downtime / covered), 3) if covered > 0 else None,
+            'outages': {
+                'count': len(outages),
+                'downtime_seconds': round(downtime),
+                'longest_seconds': round(max(durations)) if durations else 0,
+                'mean_seconds': round(sum(durations) / len(durations)) if durations else 0,
+                'ongoing': bool(outages and outages[-1].ongoing),
+                'recent': [o.to_dict() for o in outages[-RECENT_OUTAGES:]],
+            },
+            'checks': {
+                'total': len(check_latency),
+                'failed': checks_failed,
+                'decided_by': dict(decided_by),
+                'latency_ms': _latency_ms(check_latency),
+            },
+            'probes': {
+                'total': probes,
+                'failed': probes_failed,
+                'latency_ms': _latency_ms(probe_latency),
+            },
+            'remediations': remediations,
+            'lifetime': lifetime,
+        }
+
+    def export(self, days=7):
+        """The report as the bytes of uptime.json."""
+        return json.dumps(self.report(days), indent=1, sort_keys=True).encode('utf-8')
+
+    def close(self):
+        if self._map is not None:
+            if not self._readonly:
+                self._map.flush()
+            self._map.close()
+            self._map = None
+
+
+def _format_report(report):
+    outages = report['outages']
+    lines = [
+        f"{report['host']}: last {report['period']['days']:g} days (recorded from {report['period']['covered_from']})",
+        f"uptime {report['uptime_percent']}%, {outages['count']} outage(s), "
+        f"{outages['downtime_seconds']}s down, longest {outages['longest_seconds']}s, "
+        f"mean {outages['mean_seconds']}s{', one in progress' if outages['ongoing'] else ''}",
+        f"checks {report['checks']['total']} ({report['checks']['failed']} failed), "
+        f"latency p50 {report['checks']['latency_ms']['p50']}ms p95 {report['checks']['latency_ms']['p95']}ms",
+        f"probes {report['probes']['total']} ({report['probes']['failed']} failed), "
+        f"latency p50 {report['probes']['latency_ms']['p50']}ms p95 {report['probes']['latency_ms']['p95']}ms",
+    ]
+    for action, counts in sorted(report['remediations'].items()):
+        lines.append(f"remediation {action}: {counts['runs']} run(s), helped {counts['helped']}")
+    lifetime = report['lifetime']
+    lines.append(f"since {lifetime['since']}: {lifetime['outages']} outage(s), {lifetime['downtime_seconds']}s down")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m ipreport.uptime', description="Summarise the uptime record.")
+    parser.add_argument('--file', default=DEFAULT_FILE, help=f"uptime record (default {DEFAULT_FILE})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    report = commands.add_parser('report', help="uptime and outage statistics")
+    report.add_argument('--days', type=float, default=7)
+    report.add_argument('--json', action='store_true', help="print uptime.json instead")
+
+    outages = commands.add_parser('outages', help="list outages")
+    outages.add_argument('--days', type=float, default=7)
+
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.file):
+        print(f"No uptime record at {args.file}", file=sys.stderr)
+        return 1
+    try:
+        recorder = UptimeRecorder(args.file, capacity=None).open(readonly=True)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        if args.command == 'report':
+            if args.json:
+                print(recorder.export(args.days).decode('utf-8'))
+            else:
+                print(_format_report(recorder.report(args.days)))
+        elif args.command == 'outages':
+            for outage in recorder.outages(time.time() - args.days * 86400):
+                end = 'ongoing' if outage.ongoing else outage.to_dict()['end']
+                print(f"{outage.to_dict()['start']} - {end}  {outage.duration:.0f}s")
+    finally:
+        recorder.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
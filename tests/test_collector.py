@@ -0,0 +1,109 @@
+import json
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import pytest
+
+from ipreport.collector import Collector, Index, serve
+from ipreport.history import Entry
+from ipreport.publish import PublishRecord
+
+
+def test_update_reports_only_changes():
+    index = Index()
+    assert index.update('office', '198.51.100.1', 1000.0)
+    assert not index.update('office', '198.51.100.1', 1030.0)
+    assert index.get('office').changed_at == 1000.0
+    assert index.get('office').seen == 1030.0
+    assert index.update('office', '198.51.100.2', 1060.0)
+    assert index.get('office').ip == '198.51.100.2'
+    assert len(index) == 1
+
+
+def test_older_reports_never_move_a_host_back():
+    index = Index()
+    index.update('office', '198.51.100.2', 2000.0)
+    assert not index.update('office', '198.51.100.1', 1000.0, seen=2500.0)
+    state = index.get('office')
+    assert (state.ip, state.changed_at, state.seen) == ('198.51.100.2', 2000.0, 2500.0)
+
+
+def test_changed_since():
+    index = Index()
+    index.update('a', '198.51.100.1', 1000.0)
+    index.update('b', '198.51.100.2', 3000.0)
+    index.update('c', '198.51.100.3', 2000.0)  # late report, inserted in place
+    index.update('a', '198.51.100.4', 4000.0)
+
+    assert [host for host, _ in index.changed_since(2000.0)] == ['c', 'b', 'a']
+    assert [host for host, _ in index.changed_since(3500.0)] == ['a']
+    assert index.changed_since(5000.0) == []
+
+
+def test_prune_keeps_current_ips():
+    index = Index()
+    index.update('a', '198.51.100.1', 1000.0)
+    index.update('b', '198.51.100.2', 3000.0)
+    index.prune(2000.0)
+    assert [host for host, _ in index.changed_since(0.0)] == ['b']
+    assert index.get('a').ip == '198.51.100.1'
+
+
+def test_reported_times_keep_their_offset(tmp_path):
+    collector = Collector(str(tmp_path / 'changes.log'))
+    collector.ingest({'host': 'office', 'ip': '198.51.100.1', 'timestamp': '2026-01-01T12:00:00+02:00'}, now=0)
+    assert collector.index.get('office').changed_at == datetime.fromisoformat('2026-01-01T10:00:00+00:00').timestamp()
+    collector.ingest({'host': 'lab', 'ip': '198.51.100.2', 'timestamp': '2026-01-01T10:00:00Z'}, now=0)
+    assert collector.index.get('lab').changed_at == collector.index.get('office').changed_at
+    collector.store.close()
+
+
+def test_webhook_records_arrive_with_the_reporters_time(tmp_path):
+    seen = datetime(2026, 1, 1, 12, 30)
+    record = PublishRecord('198.51.100.7', datetime(2026, 1, 1, 13), [], [Entry(seen, '198.51.100.6')])
+    body = record.to_dict()
+    assert body['timestamp'].endswith('+00:00')
+
+    collector = Collector(str(tmp_path / 'changes.log'))
+    collector.ingest(dict(body, host='office'), now=0)
+    assert [state.changed_at for _, state in collector.index.changed_since(0)] == [
+        datetime(2026, 1, 1, 13).timestamp()]
+    collector.store.close()
+
+    # The store keeps UTC as well, and reads back to the same times
+    lines = (tmp_path / 'changes.log').read_text().splitlines()
+    assert all(line.split('\t')[0].endswith('+00:00') for line in lines)
+    replayed = Collector(str(tmp_path / 'changes.log'))
+    assert replayed.index.changed_since(0) == [('office', replayed.index.get('office'))]
+    assert replayed.index.get('office')[:2] == collector.index.get('office')[:2]
+    replayed.store.close()
+
+
+@pytest.fixture
+def server(tmp_path):
+    collector = Collector(str(tmp_path / 'changes.log'))
+    server = serve(collector, port=0, token='secret')
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+    collector.store.close()
+
+
+def post(url, body, token):
+    request = urllib.request.Request(f"{url}/report", data=json.dumps(body).encode(), method='POST',
+                                     headers={'Authorization': f"Bearer {token}"})
+    try:
+        with urllib.request.urlopen(request) as reply:
+            return reply.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_reports_need_the_token(server):
+    report = {'host': 'office', 'ip': '198.51.100.1', 'timestamp': '2026-01-01T10:00:00Z'}
+    assert post(server, report, 'wrong') == 401
+    assert post(server, report, 'secret') == 204
+    with urllib.request.urlopen(urllib.request.Request(
+            f"{server}/hosts/office", headers={'Authorization': 'Bearer secret'})) as reply:
+        assert json.load(reply)['changed_at'] == '2026-01-01T10:00:00+00:00'
@@ -0,0 +1,123 @@
+import socket
+import struct
+
+import pytest
+
+from ipreport import connectivity
+from ipreport.connectivity import (
+    ConnectivityChecker,
+    ConnectivityReport,
+    _build_dns_query,
+    check_default_route,
+    check_https,
+    check_tcp,
+)
+
+ROUTE_HEADER = 'Iface\tDestination\tGateway\tFlags\tRefCnt\tUse\tMetric\tMask\tMTU\tWindow\tIRTT\n'
+
+
+def test_default_route_is_found_in_the_routing_table(tmp_path):
+    route = tmp_path / 'route'
+    route.write_text(ROUTE_HEADER + 'eth0\t0002A8C0\t00000000\t0001\t0\t0\t0\t00FFFFFF\t0\t0\t0\n')
+    assert check_default_route((str(route),)) == (False, 'no default route')
+
+    route.write_text(route.read_text() + 'eth0\t00000000\t0102A8C0\t0003\t0\t0\t0\t00000000\t0\t0\t0\n')
+    assert check_default_route((str(route),)) == (True, 'default route via eth0')
+
+    ipv6 = tmp_path / 'ipv6_route'
+    ipv6.write_text(' '.join(['0' * 32, '00', '0' * 32, '00', '0' * 32, '00000400', '00000001', '00000000',
+                              '00000003', 'wlan0']) + '\n')
+    assert check_default_route((str(tmp_path / 'missing'), str(ipv6))) == (True, 'IPv6 default route via wlan0')
+    assert check_default_route((str(tmp_path / 'missing'),))[0] is None
+
+
+def test_tcp_tier_connects_to_any_listening_host():
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        assert check_tcp(['127.0.0.1'], port=port, timeout=1) == (True, f"connected to 127.0.0.1:{port}")
+    # Refused straight away rather than after the timeout
+    ok, detail = check_tcp(['127.0.0.1'], port=port, timeout=1)
+    assert ok is False and detail.startswith('no TCP connection')
+
+
+def test_dns_query_asks_for_an_a_record():
+    query = _build_dns_query(0x1234, 'example.com')
+    assert struct.unpack('>HHHHHH', query[:12]) == (0x1234, 0x0100, 1, 0, 0, 0)
+    assert query[12:] == b'\x07example\x03com\x00\x00\x01\x00\x01'
+
+
+class FakeReply:
+    def __init__(self, error=None):
+        self.error = error
+
+    def raise_for_status(self):
+        if self.error:
+            raise self.error
+
+
+class FakeSession:
+    def __init__(self, replies):
+        self.replies = replies
+
+    def get(self, url, timeout=None):
+        reply = self.replies[url]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def test_https_tier_succeeds_on_any_answer():
+    session = FakeSession({'https://a': OSError('refused'), 'https://b': FakeReply()})
+    assert check_https(['https://a', 'https://b'], timeout=1, session=session) == (True, 'answer from https://b')
+
+    session = FakeSession({'https://a': OSError('refused'), 'https://b': FakeReply(ValueError('503'))})
+    ok, detail = check_https(['https://a', 'https://b'], timeout=1, session=session)
+    assert ok is False
+    assert 'https://a: refused' in detail and 'https://b: 503' in detail
+
+
+@pytest.fixture
+def tiers(monkeypatch):
+    """Replace every tier with a canned answer and record which ones ran."""
+    answers = {'route': (True, 'route'), 'tcp': (True, 'tcp'), 'dns': (True, 'dns'), 'https': (True, 'https')}
+    ran = []
+
+    def tier(name):
+        def check(*args):
+            ran.append(name)
+            return answers[name]
+        return check
+
+    for name in answers:
+        monkeypatch.setattr(connectivity, f"check_{'default_route' if name == 'route' else name}", tier(name))
+    return answers, ran
+
+
+def test_no_route_settles_it_without_touching_the_network(tiers):
+    answers, ran = tiers
+    answers['route'] = (False, 'no default route')
+    report = ConnectivityChecker().check()
+    assert (report.up, report.decided_by, ran) == (False, 'route', ['route'])
+
+
+def test_cheap_tiers_agreeing_skip_https(tiers):
+    _, ran = tiers
+    report = ConnectivityChecker().check()
+    assert (report.up, report.decided_by, ran) == (True, 'dns', ['route', 'tcp', 'dns'])
+
+
+def test_https_decides_when_the_cheap_tiers_disagree(tiers):
+    answers, ran = tiers
+    answers['dns'] = (False, 'port 53 filtered')
+    report = ConnectivityChecker().check()
+    assert (report.up, report.decided_by, ran) == (True, 'https', ['route', 'tcp', 'dns', 'https'])
+
+    answers['https'] = (False, 'no answer')
+    assert ConnectivityChecker().check().up is False
+
+
+def test_reports_survive_the_probe_cache(tiers):
+    report = ConnectivityChecker().check()
+    assert ConnectivityReport.from_dict(report.to_dict()) == report
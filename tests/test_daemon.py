@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ipreport.config import DEFAULTS, Config
+from ipreport.connectivity import ConnectivityReport
+from ipreport.daemon import Daemon, RemediationTask, Task, WatchdogTask, build_tasks
+from ipreport.leanhttp import LeanSession
+
+
+def make_config(tmp_path, **values):
+    paths = {
+        'state_file': str(tmp_path / 'publish_state.json'),
+        'outbox_file': str(tmp_path / 'outbox.jsonl'),
+        'provider_state_file': str(tmp_path / 'ip_providers.json'),
+        'remediation_state_file': str(tmp_path / 'remediation_state.json'),
+        'local_publish_dir': str(tmp_path / 'published'),
+    }
+    return Config(**dict(DEFAULTS, **paths, **values))
+
+
+def report(up):
+    return ConnectivityReport(up, 'dns', [])
+
+
+class Recorder(Task):
+    """Remembers the events it was sent."""
+
+    def __init__(self, name, fails=False):
+        self.name = name
+        self.fails = fails
+        self.events = []
+
+    def on_connectivity_lost(self, reason):
+        self.events.append(reason)
+        if self.fails:
+            raise RuntimeError('handler bug')
+
+
+def test_one_process_runs_the_reporter_and_the_watchdog(tmp_path):
+    config = make_config(tmp_path, publish_backends='local', enable_watchdog=True, enable_remediation=True)
+    tasks = build_tasks(config)
+    assert [task.name for task in tasks] == ['probe', 'publish', 'connectivity', 'watchdog', 'remediation']
+
+    config = make_config(tmp_path, enable_publish=False, enable_watchdog=True)
+    assert [task.name for task in build_tasks(config)] == ['connectivity', 'watchdog']
+
+
+def test_events_reach_every_task_even_if_one_fails():
+    first, second = Recorder('first', fails=True), Recorder('second')
+    daemon = Daemon([first, second])
+    daemon.emit('connectivity_lost', 'cable unplugged')
+    daemon.emit('probe', None)  # nobody handles it
+    assert first.events == second.events == ['cable unplugged']
+
+
+def test_watchdog_reports_repeated_failures_once(tmp_path):
+    watchdog, lost = WatchdogTask(make_config(tmp_path, reboot_after_failures=3)), Recorder('remediation')
+    daemon = Daemon([watchdog, lost])
+    watchdog.start(daemon)
+    for up in (False, False, True, False, False, False, False):
+        watchdog.on_connectivity(report(up))
+    assert lost.events == ['3 consecutive failed connectivity checks']
+    assert watchdog.consecutive_failures == 1
+
+
+class FakePublish(Task):
+    name = 'fleet'
+    last_success = 0.0
+
+
+def test_watchdog_reports_a_stale_publish(tmp_path):
+    watchdog, lost = WatchdogTask(make_config(tmp_path, publish_stale_after=60)), Recorder('remediation')
+    publish = FakePublish()
+    daemon = Daemon([watchdog, lost, publish])
+    watchdog.start(daemon)
+    publish.last_success = time.monotonic()
+    watchdog.on_connectivity(report(True))
+    assert lost.events == []
+    publish.last_success = time.monotonic() - 61
+    watchdog.on_connectivity(report(True))
+    assert lost.events == ['no successful update for more than 60s']
+
+
+class Ticker(Task):
+    """Runs every 50ms, one run overrunning its timeout, and records where it ran."""
+    name = 'ticker'
+    interval = 0.05
+    timeout = 0.2
+
+    def __init__(self):
+        self.runs = 0
+        self.threads = set()
+        self.served = False
+        self.closed = False
+
+    async def run(self):
+        self.runs += 1
+        self.threads.add(await self.daemon.to_thread(self.name, lambda: threading.current_thread().name))
+        if self.runs == 2:
+            await asyncio.sleep(1)  # cancelled by the timeout, the schedule carries on
+
+    async def serve(self):
+        self.served = True
+
+    def close(self):
+        self.closed = True
+
+
+class Resource:
+    closed = False
+
+    def close(self):
+        self.closed = True
+        raise OSError('already gone')
+
+
+def test_periodic_tasks_run_on_their_own_worker_thread():
+    ticker, resource = Ticker(), Resource()
+    daemon = Daemon([ticker], jitter=0, resources=[resource])
+
+    async def run_briefly():
+        job = asyncio.get_running_loop().create_task(daemon.run())
+        await asyncio.sleep(0.6)
+        job.cancel()
+        await job  # a stop signal is a clean exit, not an error
+
+    asyncio.run(run_briefly())
+    assert ticker.served
+    assert ticker.runs >= 4
+    assert len(ticker.threads) == 1 and ticker.threads.pop().startswith('ticker')
+
+    daemon.close()
+    assert ticker.closed and resource.closed
+
+
+def test_to_thread_gives_up_after_its_timeout():
+    daemon = Daemon([])
+
+    async def slow():
+        await daemon.to_thread('slow', time.sleep, 0.5, timeout=0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(slow())
+    daemon.close()
+
+
+class FakeChecker:
+    def __init__(self, *ups):
+        self.ups = list(ups)
+
+    def check(self):
+        return report(self.ups.pop(0))
+
+
+def test_remediation_climbs_the_ladder_on_its_worker_thread(tmp_path, monkeypatch):
+    config = make_config(tmp_path, remediation_ladder='flush-dns:0,reboot:0', remediation_verify_delay=0,
+                         remediation_interface='eth0')
+    remediation = RemediationTask(config, FakeChecker(False, True))
+    ran = []
+    monkeypatch.setattr('ipreport.daemon.run_action', lambda action, interface=None: ran.append(
+        (action, interface, threading.current_thread().name)))
+    outcomes = []
+    listener = Task()
+    listener.name = 'uptime'
+    listener.on_remediation = lambda action, helped: outcomes.append((action, helped))
+    daemon = Daemon([remediation, listener])
+
+    async def outage():
+        remediation.start(daemon)
+        for _ in range(2):
+            daemon.emit('connectivity_lost', 'checks failed')
+            assert remediation.busy
+            daemon.emit('connectivity_lost', 'checks failed')  # one step at a time
+            while remediation.busy:
+                await asyncio.sleep(0.01)
+
+    asyncio.run(outage())
+    assert [(action, interface) for action, interface, _ in ran] == [('flush-dns', 'eth0'), ('reboot', 'eth0')]
+    assert all(thread.startswith('remediation') for _, _, thread in ran)
+    assert outcomes == [('flush-dns', False), ('reboot', True)]
+    assert remediation.ladder.at_rest
+    daemon.close()
+
+
+def test_shutdown_closes_the_lean_http_pools(tmp_path):
+    config = make_config(tmp_path, publish_backends='local', lean=True, uplinks='eth0,wwan0')
+    resources = []
+    daemon = Daemon(build_tasks(config, resources), resources=resources)
+    sessions = [r for r in resources if isinstance(r, LeanSession)]
+    assert len(sessions) == 3  # the default one and one per uplink
+    closed = []
+    for session in sessions:
+        session.close = lambda session=session: closed.append(session)
+    daemon.close()
+    assert closed == sessions
@@ -0,0 +1,82 @@
+import json
+
+from ipreport.config import DEFAULTS, Config
+from ipreport.fleet import Fleet, Site
+from ipreport.state import PublishState
+
+
+def write_fleet(tmp_path):
+    spec = {
+        'servers': {'main': {'host': 'ftp.example.com', 'user': 'ip', 'password': 'secret'}},
+        'sites': [
+            {'name': 'office', 'server': 'main', 'remote_path': '/ip/office/', 'source_address': '192.0.2.2'},
+            {'name': 'lab/1', 'server': 'main', 'remote_path': '/ip/lab/', 'interface': 'wwan0'},
+            {'name': 'depot', 'host': 'ftp.example.net', 'user': 'depot', 'password': 'x', 'port': 2121,
+             'remote_path': '/ip/'},
+        ],
+    }
+    path = tmp_path / 'fleet.json'
+    path.write_text(json.dumps(spec))
+    return str(path)
+
+
+def test_sites_on_one_server_share_its_session(tmp_path):
+    config = Config(**dict(DEFAULTS, fleet_state_dir=str(tmp_path / 'state')))
+    fleet = Fleet.load(write_fleet(tmp_path), config)
+    office, lab, depot = fleet.sites
+    assert len(fleet.sessions) == 2
+    assert office.publisher.session is lab.publisher.session
+    assert depot.publisher.session.port == 2121
+    assert office.source_address == '192.0.2.2' and lab.interface == 'wwan0'
+    # Unsafe characters in names never reach the state file paths
+    assert lab.publisher.state.path == str(tmp_path / 'state' / 'lab_1.json')
+    fleet.close()
+
+
+class FakePublisher:
+    def __init__(self, state, succeeds=True):
+        self.state = state
+        self.succeeds = succeeds
+        self.attempts = []
+
+    def attempt(self, ip):
+        self.attempts.append(ip)
+        return self.succeeds
+
+
+def make_site(tmp_path, name, server='main', succeeds=True, published=None):
+    state = PublishState(str(tmp_path / f"{name}.json"))
+    if published:
+        state.mark_published(published)
+    return Site(name, server, FakePublisher(state, succeeds), registry=None)
+
+
+def test_only_changed_sites_are_published(tmp_path):
+    unchanged = make_site(tmp_path, 'unchanged', published='198.51.100.1')
+    changed = make_site(tmp_path, 'changed', published='198.51.100.2')
+    failing = make_site(tmp_path, 'failing', server='other', succeeds=False)
+    unchanged.last_success = changed.last_success = failing.last_success = 0
+    fleet = Fleet([unchanged, changed, failing], {}, Config(**DEFAULTS), max_workers=2)
+
+    published = fleet.publish_all({unchanged: '198.51.100.1', changed: '198.51.100.3', failing: '198.51.100.4'})
+    assert published == 1
+    assert unchanged.publisher.attempts == []
+    assert changed.publisher.attempts == ['198.51.100.3'] and failing.publisher.attempts == ['198.51.100.4']
+    # Up to date counts as a success, a failed write does not
+    assert unchanged.last_success > 0 and changed.last_success > 0
+    assert failing.last_success == 0
+    fleet.close()
+
+
+def test_failed_lookups_leave_the_site_out(tmp_path, monkeypatch):
+    sites = [make_site(tmp_path, name) for name in ('ok', 'none', 'error')]
+    fleet = Fleet(sites, {}, Config(**DEFAULTS), max_workers=3)
+
+    def probe(site):
+        if site.name == 'error':
+            raise OSError('network unreachable')
+        return '198.51.100.9' if site.name == 'ok' else None
+
+    monkeypatch.setattr(fleet, '_probe', probe)
+    assert fleet.probe_all() == {sites[0]: '198.51.100.9'}
+    fleet.close()
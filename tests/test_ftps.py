@@ -0,0 +1,174 @@
+import ftplib
+from datetime import datetime
+
+import pytest
+
+from ipreport.ftps import FTPSSession, ReusedSessionFTP_TLS
+
+
+class FakeFTP:
+    """Remote files in a dict; commands in refuse answer with the given error."""
+
+    def __init__(self, files=None, refuse=None):
+        self.files = dict(files or {})
+        self.refuse = refuse or {}
+        self.commands = []
+
+    def _check(self, command):
+        self.commands.append(command)
+        if command in self.refuse:
+            raise ftplib.error_perm(self.refuse[command])
+
+    def storbinary(self, cmd, fp, rest=None):
+        command, filename = cmd.split(' ', 1)
+        self._check(command if rest is None else 'REST')
+        data = fp.read()
+        if command == 'APPE':
+            self.files[filename] = self.files.get(filename, b'') + data
+        elif rest is not None:
+            self.files[filename] = self.files.get(filename, b'')[:rest] + data
+        else:
+            self.files[filename] = data
+
+    def retrbinary(self, cmd, callback):
+        filename = cmd.split(' ', 1)[1]
+        self._check('RETR')
+        if filename not in self.files:
+            raise ftplib.error_perm('550 No such file')
+        callback(self.files[filename])
+
+    def voidcmd(self, cmd):
+        self._check(cmd.split(' ', 1)[0])
+
+    def size(self, filename):
+        self._check('SIZE')
+        if filename not in self.files:
+            raise ftplib.error_perm('550 No such file')
+        return len(self.files[filename])
+
+    def rename(self, source, target):
+        self._check('RNFR')
+        self.files[target] = self.files.pop(source)
+
+    def delete(self, filename):
+        self._check('DELE')
+        self.files.pop(filename, None)
+
+    def quit(self):
+        self._check('QUIT')
+
+    def close(self):
+        pass
+
+
+def session():
+    return FTPSSession('ftp.example.com', 'ip', 'secret')
+
+
+WHEN = datetime(2026, 5, 1, 12)
+
+
+def test_append_uses_appe_when_the_server_has_it():
+    ftps, ftp = session(), FakeFTP({'log.txt': b'a\n'})
+    assert ftps.append(ftp, 'log.txt', b'b\n', WHEN) == 'log.txt'
+    assert ftp.files['log.txt'] == b'a\nb\n'
+    assert ftp.commands == ['APPE']
+
+
+def test_append_falls_back_to_rest_and_remembers():
+    ftps, ftp = session(), FakeFTP({'log.txt': b'a\n'}, refuse={'APPE': '502 Command not implemented'})
+    ftps.append(ftp, 'log.txt', b'b\n', WHEN)
+    ftps.append(ftp, 'log.txt', b'c\n', WHEN)
+    assert ftp.files['log.txt'] == b'a\nb\nc\n'
+    assert ftps.append_mode == 'rest'
+    assert ftp.commands.count('APPE') == 1
+
+
+def test_append_rotates_monthly_when_nothing_else_works():
+    ftp = FakeFTP({'log-2026-05.txt': b'a\n'}, refuse={'APPE': '502 no', 'SIZE': '500 no'})
+    ftps = session()
+    assert ftps.append(ftp, 'log.txt', b'b\n', WHEN) == 'log-2026-05.txt'
+    assert ftps.append(ftp, 'log.txt', b'c\n', datetime(2026, 6, 1)) == 'log-2026-06.txt'
+    assert ftp.files['log-2026-05.txt'] == b'a\nb\n' and ftp.files['log-2026-06.txt'] == b'c\n'
+    assert ftps.append_mode == 'rotate'
+
+
+def test_real_append_failures_are_not_mistaken_for_missing_support():
+    ftps, ftp = session(), FakeFTP(refuse={'APPE': '553 Permission denied'})
+    with pytest.raises(ftplib.error_perm):
+        ftps.append(ftp, 'log.txt', b'b\n', WHEN)
+    assert ftps.append_mode == 'appe'
+
+
+def test_replace_renames_over_the_target_until_refused():
+    ftps, ftp = session(), FakeFTP({'ip.txt': b'198.51.100.1'})
+    ftps.replace(ftp, 'ip.txt', b'198.51.100.2')
+    assert ftp.files == {'ip.txt': b'198.51.100.2'}
+
+    ftp.refuse['RNFR'] = '550 Rename failed'
+    ftps.replace(ftp, 'ip.txt', b'198.51.100.3')
+    assert ftp.files == {'ip.txt': b'198.51.100.3'}
+    assert not ftps.atomic_replace
+
+
+def test_connection_is_reused_until_it_goes_stale(monkeypatch):
+    ftps = session()
+    connections = []
+
+    def connect():
+        connections.append(FakeFTP())
+        return connections[-1]
+
+    monkeypatch.setattr(ftps, '_connect', connect)
+    first = ftps.acquire()
+    assert ftps.acquire() is first
+    first.refuse['NOOP'] = '421 Timeout'
+    second = ftps.acquire()
+    assert second is not first
+    assert ftps.stats() == {'connects': 2, 'reconnects': 1, 'reuses': 1}
+
+
+def test_modes_learnt_survive_close(monkeypatch):
+    ftps = session()
+    ftp = FakeFTP(refuse={'APPE': '502 no'})
+    monkeypatch.setattr(ftps, '_connect', lambda: ftp)
+    ftps.append(ftps.acquire(), 'log.txt', b'a\n', WHEN)
+    ftps.close()
+    assert ftps.append_mode == 'rest'
+
+
+class FakeContext:
+    def __init__(self):
+        self.sessions = []
+
+    def wrap_socket(self, sock, server_hostname=None, session=None):
+        self.sessions.append(session)
+        return sock
+
+
+def test_data_connections_resume_the_control_session(monkeypatch):
+    monkeypatch.setattr(ftplib.FTP, 'ntransfercmd', lambda self, cmd, rest=None: ('data socket', None))
+    ftp = ReusedSessionFTP_TLS()
+    ftp.context = FakeContext()
+    ftp.host = 'ftp.example.com'
+    ftp.sock = type('Control', (), {'session': 'control session'})()
+    ftp._prot_p = True
+    assert ftp.ntransfercmd('STOR ip.txt') == ('data socket', None)
+    assert ftp.context.sessions == ['control session']
+
+    ftp._prot_p = False
+    ftp.ntransfercmd('STOR ip.txt')
+    assert ftp.context.sessions == ['control session']
+
+
+def test_transfer_type_is_sent_once_per_connection(monkeypatch):
+    ftp = ReusedSessionFTP_TLS()
+    sent = []
+    monkeypatch.setattr(ftp, 'putcmd', sent.append)
+    monkeypatch.setattr(ftp, 'getresp', lambda: '200 OK')
+    for _ in range(3):
+        ftp.voidcmd('TYPE I')
+    ftp.sendcmd('TYPE A')
+    ftp.voidcmd('NOOP')
+    ftp.voidcmd('TYPE I')
+    assert sent == ['TYPE I', 'TYPE A', 'NOOP', 'TYPE I']
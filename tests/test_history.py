@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+from ipreport.history import RECORD_SIZE, History, convert_logs, pack, parse_log_line, unpack
+
+
+def test_records_round_trip():
+    for ip in ('198.51.100.7', '2001:db8::42'):
+        data = pack(datetime(2026, 5, 1, 12, 30, 15, 250000), ip)
+        assert len(data) == RECORD_SIZE
+        entry = unpack(data)
+        assert entry.timestamp == datetime(2026, 5, 1, 12, 30, 15, 250000)
+        assert entry.ip == ip
+
+
+def test_corrupt_record():
+    with pytest.raises(ValueError):
+        unpack(b'\0' * RECORD_SIZE)
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = History(str(tmp_path / 'history.bin'))
+    for day, ip in ((1, '198.51.100.1'), (3, '198.51.100.2'), (5, '2001:db8::1'), (7, '198.51.100.3')):
+        history.append(datetime(2026, 5, day), ip)
+    return history
+
+
+def test_lookups(history):
+    assert len(history) == 4
+    assert history.at(datetime(2026, 4, 30)) is None
+    assert history.at(datetime(2026, 5, 1)).ip == '198.51.100.1'
+    assert history.at(datetime(2026, 5, 4)).ip == '198.51.100.2'
+    assert history.at(datetime(2026, 6, 1)).ip == '198.51.100.3'
+    assert history.last().ip == '198.51.100.3'
+    assert [e.ip for e in history.tail(2)] == ['2001:db8::1', '198.51.100.3']
+
+
+def test_range_is_half_open(history):
+    found = list(history.range(datetime(2026, 5, 3), datetime(2026, 5, 7)))
+    assert [e.ip for e in found] == ['198.51.100.2', '2001:db8::1']
+    assert history.count(None, datetime(2026, 5, 2)) == 1
+    assert history.count(datetime(2026, 5, 2)) == 3
+
+
+def test_append_rejects_older_entries(history):
+    with pytest.raises(ValueError):
+        history.append(datetime(2026, 5, 6), '198.51.100.9')
+
+
+def test_parse_log_line():
+    entry = parse_log_line('2026-05-01T12:00:00.123456 - 198.51.100.1\n')
+    assert entry.timestamp == datetime(2026, 5, 1, 12, 0, 0, 123456)
+    assert entry.ip == '198.51.100.1'
+    assert parse_log_line('2026-05-01T12:00:00 - <html>') is None
+    assert parse_log_line('garbage') is None
+
+
+def test_convert_logs_merges_and_is_idempotent(tmp_path):
+    log = tmp_path / 'log.txt'
+    segment = tmp_path / 'log-2026-05.txt'
+    log.write_text('2026-04-01T00:00:00 - 198.51.100.1\nnot a line\n2026-05-10T00:00:00 - 198.51.100.3\n')
+    segment.write_text('2026-05-02T00:00:00 - 198.51.100.2\n')
+    history = History(str(tmp_path / 'history.bin'))
+
+    assert convert_logs([str(log), str(segment)], history) == 3
+    assert [e.ip for e in history.range()] == ['198.51.100.1', '198.51.100.2', '198.51.100.3']
+    assert convert_logs([str(log), str(segment)], history) == 0
+    assert len(history) == 3
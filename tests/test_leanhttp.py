@@ -0,0 +1,70 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ipreport.leanhttp import MAX_BODY, LeanSession
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        body = {'/ip': b'198.51.100.7\n', '/big': b'x' * (MAX_BODY + 10)}.get(self.path)
+        if body is None:
+            self.send_response(503)
+            body = b'busy'
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_port}{path}"
+
+
+def test_connections_are_kept_alive(server):
+    session = LeanSession()
+    for _ in range(3):
+        assert session.get(url(server, '/ip'), timeout=2).text == '198.51.100.7\n'
+    assert session.stats() == {'requests': 3, 'connections': 1, 'reused': 2}
+    session.close()
+    assert session._idle == {}
+
+
+def test_a_connection_the_server_dropped_is_replaced(server):
+    session = LeanSession()
+    session.get(url(server, '/ip'), timeout=2)
+    for conn in session._idle.values():
+        conn.sock.shutdown(socket.SHUT_WR)  # the next request finds the connection gone, as after an idle timeout
+    assert session.get(url(server, '/ip'), timeout=2).status_code == 200
+    assert session.stats()['connections'] == 2
+    session.close()
+
+
+def test_junk_answers_are_cut_short_and_errors_raised(server):
+    session = LeanSession()
+    reply = session.get(url(server, '/big'), timeout=2)
+    assert len(reply.content) == MAX_BODY
+    assert session._idle == {}  # not worth keeping after an unread tail
+    with pytest.raises(ConnectionError):
+        session.get(url(server, '/other'), timeout=2).raise_for_status()
+    with pytest.raises(ConnectionError):
+        session.get('http://127.0.0.1:1/ip', timeout=2)
+    session.close()
@@ -0,0 +1,104 @@
+import logging
+
+import pytest
+
+from ipreport.logs import MAX_TRACKED, DedupHandler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    @property
+    def messages(self):
+        return [r.getMessage() for r in self.records]
+
+
+@pytest.fixture
+def output():
+    return ListHandler()
+
+
+def record(msg, *args, created=1000.0, level=logging.INFO):
+    result = logging.makeLogRecord({
+        'name': 'root', 'msg': msg, 'args': args, 'levelno': level, 'levelname': logging.getLevelName(level),
+    })
+    result.created = created
+    return result
+
+
+def test_repeats_are_summarised_when_the_window_closes(output):
+    dedup = DedupHandler(output, window=3600)
+    for n in range(5):
+        dedup.emit(record('Internet connection failed.', created=1000.0 + n * 30))
+    assert output.messages == ['Internet connection failed.']
+
+    dedup.emit(record('Internet connection failed.', created=4700.0))
+    assert output.messages == [
+        'Internet connection failed.',
+        'Internet connection failed. (x4 in 2m)',
+        'Internet connection failed.',
+    ]
+    assert output.records[1].repeated == 4
+    assert output.records[1].window == 120
+
+
+def test_messages_that_differ_are_all_written(output):
+    dedup = DedupHandler(output, window=3600)
+    dedup.emit(record('Queued IP change to %s', '198.51.100.6'))
+    dedup.emit(record('Queued IP change to %s', '198.51.100.7', created=1001.0))
+    dedup.emit(record('Queued IP change to %s', '198.51.100.7', created=1002.0, level=logging.WARNING))
+    assert output.messages == ['Queued IP change to 198.51.100.6', 'Queued IP change to 198.51.100.7',
+                               'Queued IP change to 198.51.100.7']
+
+
+def test_close_writes_pending_summaries(output):
+    dedup = DedupHandler(output, window=3600)
+    for n in range(3):
+        dedup.emit(record('FTPS server not reachable', created=1000.0 + n))
+    dedup.emit(record('Published', created=1003.0))
+    dedup.close()
+    assert output.messages == ['FTPS server not reachable', 'Published', 'FTPS server not reachable (x2 in 2s)']
+
+
+def test_window_zero_writes_everything(output):
+    dedup = DedupHandler(output, window=0)
+    for _ in range(3):
+        dedup.emit(record('same'))
+    assert output.messages == ['same'] * 3
+
+
+def test_tracked_messages_are_bounded(output):
+    dedup = DedupHandler(output, window=3600)
+    for n in range(MAX_TRACKED + 1):
+        dedup.emit(record(f"message {n}"))
+    assert len(dedup._repeats) <= MAX_TRACKED
+
+
+def test_connectivity_warnings_collapse_across_an_outage(output):
+    from ipreport.connectivity import ConnectivityChecker, TierResult
+
+    dedup = DedupHandler(output, window=3600)
+    logger = logging.getLogger()
+    logger.addHandler(dedup)
+    try:
+        for n, latency in enumerate([0.501, 0.498, 0.732]):
+            tiers = [TierResult('route', True, 0.0001, 'default route via eth0'),
+                     TierResult('tcp', False, latency, 'no TCP connection'),
+                     TierResult('dns', False, latency, 'no DNS answer'),
+                     TierResult('https', False, latency * 2, 'no answer within 0.9s')]
+            ConnectivityChecker._report(False, tiers[-1], tiers)
+        tiers = [TierResult('route', False, 0.0001, 'no default route')]
+        ConnectivityChecker._report(False, tiers[0], tiers)
+    finally:
+        logger.removeHandler(dedup)
+    assert len(output.records) == 2
+    assert '(501ms)' in output.messages[0]
+    assert "at tier 'route': no default route" in output.messages[1]
+
+    dedup.close()
+    assert output.messages[2].endswith('(732ms), https=fail (1464ms)] (x2 in 0s)')
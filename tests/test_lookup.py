@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+import pytest
+
+from ipreport.lookup import resolve_public_ip
+from ipreport.providers import BREAKER_THRESHOLD, ProviderRegistry
+
+
+class Response:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+
+
+class FakeSession:
+    """Answers per URL: (delay, text), an exception to raise, or None to hang until released."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+        self.released = threading.Event()
+
+    def get(self, url, timeout):
+        self.calls.append(url)
+        answer = self.answers[url]
+        if answer is None:
+            self.released.wait()
+            raise OSError('timed out')
+        if isinstance(answer, Exception):
+            raise answer
+        delay, text = answer
+        time.sleep(delay)
+        return Response(text)
+
+
+@pytest.fixture
+def session_for():
+    sessions = []
+
+    def make(answers):
+        sessions.append(FakeSession(answers))
+        return sessions[-1]
+
+    yield make
+    for session in sessions:
+        session.released.set()
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_fastest_answer_wins(session_for):
+    session = session_for({'a': (1.0, '198.51.100.1'), 'b': (0.0, '198.51.100.2'), 'c': None})
+    started = time.monotonic()
+    assert resolve_public_ip(['a', 'b', 'c'], timeout=2, session=session) == '198.51.100.2'
+    assert time.monotonic() - started < 0.9
+
+
+def test_quorum_needs_agreement(session_for):
+    session = session_for({'a': (0.0, '198.51.100.1'), 'b': (0.05, '198.51.100.2'), 'c': (0.1, '198.51.100.1')})
+    assert resolve_public_ip(['a', 'b', 'c'], timeout=1, quorum=2, session=session) == '198.51.100.1'
+
+    session = session_for({'a': (0.0, '198.51.100.1'), 'b': (0.0, '198.51.100.2')})
+    assert resolve_public_ip(['a', 'b'], timeout=1, quorum=2, session=session) is None
+
+
+def test_junk_and_wrong_family_are_rejected(session_for):
+    session = session_for({'a': (0.0, '<html>portal</html>'), 'b': (0.0, '2001:db8::1'), 'c': (0.1, '198.51.100.1')})
+    assert resolve_public_ip(['a', 'b', 'c'], timeout=1, session=session, version=4) == '198.51.100.1'
+
+
+def test_budget_ends_the_lookup(session_for):
+    session = session_for({'a': None, 'b': ValueError('HTTP 503')})
+    started = time.monotonic()
+    assert resolve_public_ip(['a', 'b'], timeout=0.2, session=session) is None
+    assert time.monotonic() - started < 1
+
+
+def test_ranked_order_decides_who_is_asked(session_for):
+    registry = ProviderRegistry(['a', 'b', 'c'])
+    registry.record_success('c', 0.01)
+    registry.record_success('a', 0.5)
+    session = session_for({'a': (0.0, '198.51.100.1'), 'b': (0.0, '198.51.100.1'), 'c': (0.0, '198.51.100.1')})
+    assert resolve_public_ip(timeout=1, registry=registry, session=session, hedge_delay=0.5) == '198.51.100.1'
+    assert session.calls == ['c']
+
+
+def test_failure_starts_the_next_ranked_service(session_for):
+    registry = ProviderRegistry(['a', 'b'])
+    registry.record_success('a', 0.01)
+    session = session_for({'a': ValueError('HTTP 500'), 'b': (0.0, '198.51.100.1')})
+    started = time.monotonic()
+    assert resolve_public_ip(timeout=1, registry=registry, session=session, hedge_delay=5) == '198.51.100.1'
+    assert time.monotonic() - started < 1
+    assert registry.health['a'].consecutive_failures == 1
+
+
+def test_blackholed_provider_trips_its_breaker(tmp_path, session_for):
+    state_path = tmp_path / 'providers.json'
+    registry = ProviderRegistry(['a', 'b'], state_path=str(state_path))
+    # a looks far better than b, so it stays first until its breaker opens
+    registry.record_success('a', 0.001)
+    registry.record_success('b', 0.1)
+    session = session_for({'a': None, 'b': (0.0, '198.51.100.1')})
+
+    for n in range(1, BREAKER_THRESHOLD + 1):
+        # The hedge gets the answer from b; a is charged once its budget runs out
+        assert resolve_public_ip(timeout=0.2, registry=registry, session=session, hedge_delay=0.05) == '198.51.100.1'
+        wait_until(lambda: registry.health['a'].consecutive_failures == n)
+        if n < BREAKER_THRESHOLD:
+            # Health is only saved when a breaker changes state
+            assert not os.path.exists(state_path)
+
+    assert registry.health['a'].is_open(time.time())
+    assert registry.ranked() == ['b']
+    assert os.path.exists(state_path)
+    assert ProviderRegistry(['a', 'b'], state_path=str(state_path)).health['a'].trips == 1
+
+    session.calls.clear()
+    assert resolve_public_ip(timeout=0.2, registry=registry, session=session, hedge_delay=0.05) == '198.51.100.1'
+    assert session.calls == ['b']
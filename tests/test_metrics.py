@@ -0,0 +1,97 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from ipreport import metrics
+from ipreport.metrics import Registry
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counters_and_gauges_render_in_text_format(registry):
+    requests = metrics.Counter(registry, 'test_requests_total', 'Requests.', ['backend'])
+    started = metrics.Counter(registry, 'test_starts_total', 'Starts.')
+    age = metrics.Gauge(registry, 'test_age_seconds', 'Age.')
+    requests.inc(backend='ftps')
+    requests.inc(2, backend='sftp')
+    age.set(1.5)
+    assert registry.render() == (
+        '# HELP test_requests_total Requests.\n'
+        '# TYPE test_requests_total counter\n'
+        'test_requests_total{backend="ftps"} 1\n'
+        'test_requests_total{backend="sftp"} 2\n'
+        '# HELP test_starts_total Starts.\n'
+        '# TYPE test_starts_total counter\n'
+        'test_starts_total 0\n'
+        '# HELP test_age_seconds Age.\n'
+        '# TYPE test_age_seconds gauge\n'
+        'test_age_seconds 1.5\n'
+    )
+    assert started.labelnames == ()
+
+
+def test_label_values_are_escaped(registry):
+    errors = metrics.Counter(registry, 'test_errors_total', 'Errors.', ['reason'])
+    errors.inc(reason='bad "quote"\\\n')
+    assert 'test_errors_total{reason="bad \\"quote\\"\\\\\\n"} 1' in registry.render()
+
+
+def test_wrong_labels_are_refused(registry):
+    errors = metrics.Counter(registry, 'test_errors_total', 'Errors.', ['reason'])
+    with pytest.raises(ValueError):
+        errors.inc(backend='ftps')
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = metrics.Histogram(registry, 'test_seconds', 'Latency.', ['op'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value, op='get')
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'test_seconds_bucket{op="get",le="0.1"} 1',
+        'test_seconds_bucket{op="get",le="1.0"} 3',
+        'test_seconds_bucket{op="get",le="+Inf"} 4',
+        'test_seconds_sum{op="get"} 4.25',
+        'test_seconds_count{op="get"} 4',
+    ]
+
+
+def test_gauge_functions_are_read_at_scrape_time(registry):
+    age = metrics.Gauge(registry, 'test_age_seconds', 'Age.')
+    values = iter([1, None])
+    age.set_function(lambda: next(values))
+    assert registry.render().endswith('gauge\ntest_age_seconds 1\n')
+    # None and failing callbacks leave the gauge out of that scrape
+    assert registry.render().endswith('gauge\n')
+    age.set_function(lambda: 1 / 0)
+    assert registry.render().endswith('gauge\n')
+
+
+def help_lines(text):
+    return [line for line in text.splitlines() if line.startswith('# HELP ')]
+
+
+def test_serve_and_textfile(tmp_path):
+    server = metrics.serve(port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}"
+        with urllib.request.urlopen(f"{url}/metrics") as reply:
+            assert reply.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            body = reply.read().decode()
+        # Scrape-time gauges (memory use) move between two renders, so compare which metrics are there
+        assert help_lines(body) == help_lines(metrics.render())
+        with pytest.raises(urllib.error.HTTPError) as refused:
+            urllib.request.urlopen(f"{url}/other")
+        assert refused.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    path = tmp_path / 'ipreport.prom'
+    metrics.write_textfile(str(path))
+    assert help_lines(path.read_text()) == help_lines(metrics.render())
+    assert [p.name for p in tmp_path.iterdir()] == ['ipreport.prom']
@@ -0,0 +1,111 @@
+import socket
+import struct
+
+from ipreport.netevents import (
+    IFA_LOCAL,
+    IFADDRMSG,
+    IFF_LOOPBACK,
+    IFF_RUNNING,
+    IFINFOMSG,
+    IFLA_IFNAME,
+    NLMSG_DONE,
+    NLMSGHDR,
+    RT_SCOPE_UNIVERSE,
+    RT_TABLE_MAIN,
+    RTA_GATEWAY,
+    RTA_OIF,
+    RTATTR,
+    RTM_DELADDR,
+    RTM_DELROUTE,
+    RTM_NEWADDR,
+    RTM_NEWLINK,
+    RTM_NEWROUTE,
+    RTMSG,
+    NetlinkMonitor,
+    _messages,
+)
+
+
+def attribute(kind, value):
+    data = RTATTR.pack(RTATTR.size + len(value), kind) + value
+    return data + b'\0' * (-len(data) % 4)
+
+
+def message(msg_type, payload, seq=0):
+    data = NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, 0, seq, 0) + payload
+    return data + b'\0' * (-len(data) % 4)
+
+
+def address(msg_type, ip, prefixlen=24, index=2, scope=RT_SCOPE_UNIVERSE):
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    payload = IFADDRMSG.pack(family, prefixlen, 0, scope, index) + attribute(IFA_LOCAL, socket.inet_pton(family, ip))
+    return message(msg_type, payload)
+
+
+def route(msg_type, gateway, oif=2, dst_len=0, table=RT_TABLE_MAIN):
+    payload = RTMSG.pack(socket.AF_INET, dst_len, 0, 0, table, 0, 0, 1, 0)
+    payload += attribute(RTA_GATEWAY, socket.inet_aton(gateway)) + attribute(RTA_OIF, struct.pack('=I', oif))
+    return message(msg_type, payload)
+
+
+def link(name, flags, index=2):
+    payload = IFINFOMSG.pack(socket.AF_UNSPEC, 1, index, flags, 0) + attribute(IFLA_IFNAME, name + b'\0')
+    return message(RTM_NEWLINK, payload)
+
+
+def monitor_reading():
+    """A monitor whose socket is one end of a datagram pair; returns it and the other end."""
+    ours, kernel = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    ours.setblocking(False)
+    monitor = NetlinkMonitor()
+    monitor.sock = ours
+    return monitor, kernel
+
+
+def test_messages_are_split_on_aligned_lengths():
+    data = address(RTM_NEWADDR, '192.0.2.10') + message(NLMSG_DONE, b'\1\2\3', seq=7)
+    parsed = list(_messages(data))
+    assert [(t, s) for t, s, _ in parsed] == [(RTM_NEWADDR, 0), (NLMSG_DONE, 7)]
+    assert parsed[1][2] == b'\1\2\3'
+    # A truncated trailing header is ignored rather than misread
+    assert len(list(_messages(data + b'\0' * 8))) == 2
+
+
+def test_only_real_address_changes_are_reported():
+    monitor, kernel = monitor_reading()
+    kernel.send(address(RTM_NEWADDR, '192.0.2.10') + address(RTM_NEWADDR, '192.0.2.10'))
+    kernel.send(address(RTM_NEWADDR, 'fe80::1', prefixlen=64, scope=253))
+    changes = monitor.read()
+    assert len(changes) == 1
+    assert changes[0].startswith('address 192.0.2.10/24 added on ')
+
+    kernel.send(address(RTM_DELADDR, '192.0.2.10') + address(RTM_DELADDR, '198.51.100.1'))
+    changes = monitor.read()
+    assert len(changes) == 1 and changes[0].startswith('address 192.0.2.10/24 removed from ')
+    monitor.close()
+    kernel.close()
+
+
+def test_only_main_table_default_routes_count():
+    monitor, kernel = monitor_reading()
+    kernel.send(route(RTM_NEWROUTE, '192.0.2.1') + route(RTM_NEWROUTE, '192.0.2.1', dst_len=24)
+                + route(RTM_NEWROUTE, '192.0.2.254', table=100))
+    changes = monitor.read()
+    assert len(changes) == 1 and changes[0].startswith('default route via 192.0.2.1 dev ')
+
+    kernel.send(route(RTM_DELROUTE, '192.0.2.1'))
+    assert monitor.read()[0].endswith(' removed')
+    monitor.close()
+    kernel.close()
+
+
+def test_link_state_is_reported_on_transitions_only():
+    monitor, kernel = monitor_reading()
+    kernel.send(link(b'eth0', IFF_RUNNING) + link(b'eth0', IFF_RUNNING) + link(b'lo', IFF_LOOPBACK, index=1))
+    assert monitor.read() == []  # first sight is the starting state
+    kernel.send(link(b'eth0', 0))
+    assert monitor.read() == ['link eth0 down']
+    kernel.send(link(b'eth0', IFF_RUNNING))
+    assert monitor.read() == ['link eth0 up']
+    monitor.close()
+    kernel.close()
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from ipreport.outbox import Outbox
+
+
+def make_outbox(tmp_path, **kwargs):
+    return Outbox(str(tmp_path / 'outbox.jsonl'), 'test', **kwargs)
+
+
+def test_only_changes_are_queued(tmp_path):
+    outbox = make_outbox(tmp_path, last_published_ip='198.51.100.1')
+    assert not outbox.enqueue('198.51.100.1', datetime(2026, 1, 1, 12))
+    assert outbox.enqueue('198.51.100.2', datetime(2026, 1, 1, 12, 1))
+    assert not outbox.enqueue('198.51.100.2', datetime(2026, 1, 1, 12, 2))
+    assert outbox.enqueue('198.51.100.1', datetime(2026, 1, 1, 12, 3))
+    assert [e.ip for e in outbox.pending()] == ['198.51.100.2', '198.51.100.1']
+
+
+def test_queue_is_replayed_after_a_restart(tmp_path):
+    outbox = make_outbox(tmp_path)
+    outbox.enqueue('198.51.100.1', datetime(2026, 1, 1, 12))
+    outbox.enqueue('198.51.100.2', datetime(2026, 1, 1, 13))
+
+    replayed = make_outbox(tmp_path).pending()
+    assert [(e.timestamp, e.ip) for e in replayed] == [
+        (datetime(2026, 1, 1, 12), '198.51.100.1'),
+        (datetime(2026, 1, 1, 13), '198.51.100.2'),
+    ]
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    outbox = make_outbox(tmp_path)
+    outbox.enqueue('198.51.100.1', datetime(2026, 1, 1, 12))
+    with open(outbox.path, 'a', encoding='utf-8') as f:
+        f.write('{"timestamp": "2026-01-01T13:00:00", "ip": "198.5')  # crash mid-write
+
+    replayed = make_outbox(tmp_path)
+    assert [e.ip for e in replayed.pending()] == ['198.51.100.1']
+    # New changes still go in after the damaged line
+    replayed.enqueue('198.51.100.3', datetime(2026, 1, 1, 14))
+    assert [e.ip for e in make_outbox(tmp_path).pending()] == ['198.51.100.1', '198.51.100.3']
+
+
+def test_last_line_without_its_newline_is_kept(tmp_path):
+    outbox = make_outbox(tmp_path)
+    outbox.enqueue('198.51.100.1', datetime(2026, 1, 1, 12))
+    with open(outbox.path, 'a', encoding='utf-8') as f:
+        f.write('{"timestamp": "2026-01-01T13:00:00", "ip": "198.51.100.2"}')  # crash before the newline
+
+    replayed = make_outbox(tmp_path)
+    replayed.enqueue('198.51.100.3', datetime(2026, 1, 1, 14))
+    assert [e.ip for e in make_outbox(tmp_path).pending()] == ['198.51.100.1', '198.51.100.2', '198.51.100.3']
+
+
+def test_commit_forgets_published_changes(tmp_path):
+    outbox = make_outbox(tmp_path)
+    outbox.enqueue('198.51.100.1', datetime(2026, 1, 1, 12))
+    outbox.enqueue('198.51.100.2', datetime(2026, 1, 1, 13))
+    outbox.commit(1)
+    assert [e.ip for e in outbox.pending()] == ['198.51.100.2']
+    assert outbox.last_published_ip == '198.51.100.1'
+    assert [e.ip for e in make_outbox(tmp_path).pending()] == ['198.51.100.2']
+
+
+def test_oldest_changes_are_dropped_beyond_the_limit(tmp_path):
+    outbox = make_outbox(tmp_path, max_events=3)
+    for n in range(5):
+        outbox.enqueue(f"198.51.100.{n}", datetime(2026, 1, 1, 12, n))
+    assert [e.ip for e in outbox.pending()] == ['198.51.100.2', '198.51.100.3', '198.51.100.4']
+    assert len(make_outbox(tmp_path, max_events=3).pending()) == 3
@@ -0,0 +1,75 @@
+import os
+import time
+
+from ipreport.config import DEFAULTS, Config
+from ipreport.daemon import ConnectivityTask, ProbeTask
+from ipreport.probecache import FILE_SIZE, ProbeCache
+
+
+def counting(value):
+    calls = []
+
+    def probe():
+        calls.append(value)
+        return value
+    return probe, calls
+
+
+def test_fresh_result_is_reused(tmp_path):
+    cache = ProbeCache(str(tmp_path / 'probes'), ttl=60).open()
+    probe, calls = counting({'ip': '198.51.100.7'})
+    first = cache.get_or_probe('ip', probe)
+    second = cache.get_or_probe('ip', probe)
+    assert calls == [{'ip': '198.51.100.7'}]
+    assert second.value == first.value and second.generation == first.generation
+    assert second.pid == os.getpid()
+    cache.close()
+
+
+def test_result_older_than_the_ttl_is_probed_again(tmp_path):
+    cache = ProbeCache(str(tmp_path / 'probes'), ttl=60).open()
+    cache.get_or_probe('ip', lambda: {'ip': '198.51.100.7'})
+    time.sleep(0.05)
+    entry = cache.get_or_probe('ip', lambda: {'ip': '198.51.100.8'}, ttl=0.01)
+    assert entry.value == {'ip': '198.51.100.8'}
+    cache.close()
+
+
+def test_results_from_before_not_before_are_ignored(tmp_path):
+    cache = ProbeCache(str(tmp_path / 'probes'), ttl=60).open()
+    cache.get_or_probe('ip', lambda: {'ip': '198.51.100.7'})
+    changed = time.monotonic()
+    entry = cache.get_or_probe('ip', lambda: {'ip': '198.51.100.8'}, not_before=changed)
+    assert entry.value == {'ip': '198.51.100.8'}
+    cache.close()
+
+
+def test_processes_share_one_file(tmp_path):
+    path = str(tmp_path / 'probes')
+    writer = ProbeCache(path, ttl=60).open()
+    reader = ProbeCache(path, ttl=60).open()
+    writer.get_or_probe('connectivity', lambda: {'up': True})
+    probe, calls = counting({'up': False})
+    assert reader.get_or_probe('connectivity', probe).value == {'up': True}
+    assert calls == []
+    assert reader.read('ip') is None
+    writer.close()
+    reader.close()
+
+
+def test_unknown_layout_is_reinitialised(tmp_path):
+    path = tmp_path / 'probes'
+    path.write_bytes(b'not a probe cache')
+    cache = ProbeCache(str(path), ttl=60).open()
+    assert path.stat().st_size == FILE_SIZE
+    assert cache.read('ip') is None
+    cache.close()
+
+
+def test_tasks_never_reuse_a_result_for_a_whole_interval():
+    config = Config(**dict(DEFAULTS, check_interval=2, probe_cache_ttl=25))
+    assert ProbeTask(config, registry=None).cache_ttl == 1
+    assert ConnectivityTask(config, checker=None).cache_ttl == 1
+
+    config = Config(**dict(DEFAULTS, check_interval=300, probe_cache_ttl=25))
+    assert ProbeTask(config, registry=None).cache_ttl == 25
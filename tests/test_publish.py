@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from ipreport.history import RECORD_SIZE, DEFAULT_FILE as HISTORY_FILE
+from ipreport.outbox import Outbox
+from ipreport.publish import LocalDirPublisher
+from ipreport.state import PublishState
+
+
+def make_publisher(tmp_path):
+    state = PublishState(str(tmp_path / 'state.json'))
+    publisher = LocalDirPublisher(state, str(tmp_path / 'published'))
+    publisher.outbox = Outbox(str(tmp_path / 'outbox.jsonl'), 'local', state.ip)
+    return publisher
+
+
+def test_changes_are_published_with_their_own_time(tmp_path):
+    publisher = make_publisher(tmp_path)
+    publisher.outbox.enqueue('198.51.100.1', datetime(2026, 1, 1, 12))
+    publisher.outbox.enqueue('198.51.100.2', datetime(2026, 1, 1, 13))
+    assert publisher.attempt('198.51.100.2')
+
+    published = tmp_path / 'published'
+    assert (published / 'ip.txt').read_text() == '198.51.100.2'
+    assert (published / 'log.txt').read_text() == (
+        '2026-01-01T12:00:00 - 198.51.100.1\n2026-01-01T13:00:00 - 198.51.100.2\n')
+    assert (published / HISTORY_FILE).stat().st_size == 2 * RECORD_SIZE
+    assert publisher.outbox.pending() == []
+    # Nothing to do until the heartbeat is due
+    assert publisher.attempt('198.51.100.2')
+    assert (published / 'log.txt').read_text().count('\n') == 2
+
+
+def test_retry_after_a_failed_append_does_not_duplicate_lines(tmp_path, monkeypatch):
+    publisher = make_publisher(tmp_path)
+    publisher.outbox.enqueue('198.51.100.1', datetime(2026, 1, 1, 12))
+    append_history = publisher.append_history
+
+    def failing_history(record, append, files=None):
+        def append_or_fail(filename, data):
+            if filename == HISTORY_FILE:
+                raise OSError('550 APPE refused')
+            append(filename, data)
+        append_history(record, append_or_fail)
+
+    monkeypatch.setattr(publisher, 'append_history', failing_history)
+    assert not publisher.attempt('198.51.100.1')
+    assert len(publisher.outbox.pending()) == 1
+
+    # Restarted, with another change queued meanwhile
+    publisher = make_publisher(tmp_path)
+    publisher.outbox.enqueue('198.51.100.2', datetime(2026, 1, 1, 13))
+    assert publisher.attempt('198.51.100.2')
+
+    published = tmp_path / 'published'
+    assert (published / 'log.txt').read_text() == (
+        '2026-01-01T12:00:00 - 198.51.100.1\n2026-01-01T13:00:00 - 198.51.100.2\n')
+    assert (published / HISTORY_FILE).stat().st_size == 2 * RECORD_SIZE
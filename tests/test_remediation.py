@@ -0,0 +1,107 @@
+import pytest
+
+from ipreport.remediation import RemediationLadder, default_interface, parse_ladder
+
+LADDER = 'reprobe:0,flush-dns:60,bounce-interface:120,reboot:900'
+
+
+def make_ladder(tmp_path, spec=LADDER, **kwargs):
+    return RemediationLadder(parse_ladder(spec), state_path=str(tmp_path / 'ladder.json'), **kwargs)
+
+
+def test_parse_ladder():
+    steps = parse_ladder('reprobe, flush-dns:60')
+    assert [(s.action, s.cooldown) for s in steps] == [('reprobe', 0.0), ('flush-dns', 60.0)]
+    with pytest.raises(ValueError):
+        parse_ladder('reprobe,format-disk:10')
+    with pytest.raises(ValueError):
+        parse_ladder(' , ')
+
+
+def test_escalates_after_each_cooldown(tmp_path):
+    ladder = make_ladder(tmp_path)
+    assert ladder.due(now=1000.0).action == 'reprobe'
+    ladder.escalate()
+    assert ladder.due(now=1001.0).action == 'flush-dns'
+    ladder.escalate()
+    # flush-dns gets 60s to take effect before the interface is bounced
+    assert ladder.due(now=1030.0) is None
+    assert ladder.due(now=1061.0).action == 'bounce-interface'
+    ladder.escalate()
+    assert ladder.due(now=1100.0) is None
+    assert ladder.due(now=1181.0).action == 'reboot'
+    ladder.escalate()
+    # The last step repeats
+    assert ladder.position == 3
+
+
+def test_reset_starts_from_the_bottom(tmp_path):
+    ladder = make_ladder(tmp_path)
+    ladder.due(now=1000.0)
+    ladder.escalate()
+    ladder.reset()
+    assert ladder.due(now=1001.0).action == 'reprobe'
+
+
+def test_position_survives_a_restart(tmp_path):
+    ladder = make_ladder(tmp_path)
+    ladder.due(now=1000.0)
+    ladder.escalate()
+    ladder.remember_interface('eth0')
+    again = make_ladder(tmp_path)
+    assert again.position == 1
+    assert again.last_run == 1000.0
+    assert again.interface == 'eth0'
+
+
+def test_reboots_are_capped_within_the_window(tmp_path):
+    ladder = make_ladder(tmp_path, 'reprobe:0,reboot:100', max_reboots=2, reboot_window=3600)
+    now = 10_000.0
+    ladder.position = 1
+    assert ladder.due(now=now).action == 'reboot'
+    # The next reboot waits twice the cooldown: one recent reboot
+    assert ladder.due(now=now + 150) is None
+    assert ladder.due(now=now + 201).action == 'reboot'
+    # Two reboots within the hour: start over from the bottom instead
+    assert ladder.due(now=now + 1000).action == 'reprobe'
+    assert ladder.position == 0
+    assert len(ladder.reboots) == 2
+    # Once the window has passed, rebooting is allowed again
+    ladder.position = 1
+    assert ladder.due(now=now + 4000).action == 'reboot'
+
+
+def test_steps_that_cannot_run_are_skipped(tmp_path):
+    ladder = make_ladder(tmp_path)
+    ladder.position = 2
+    assert ladder.due(now=1000.0, skip={'bounce-interface'}).action == 'reboot'
+
+
+def test_skipped_last_step_runs_nothing(tmp_path):
+    ladder = make_ladder(tmp_path, 'reprobe:0,bounce-interface:60')
+    ladder.position = 1
+    assert ladder.due(now=1000.0, skip={'bounce-interface'}) is None
+
+
+def test_default_interface_needs_a_default_route(tmp_path):
+    route = tmp_path / 'route'
+    route.write_text('Iface\tDestination\tGateway\nwlan0\t0000A8C0\t00000000\n')
+    assert default_interface(str(route)) is None
+    route.write_text('Iface\tDestination\tGateway\nwlan0\t0000A8C0\t00000000\neth0\t00000000\t0101A8C0\n')
+    assert default_interface(str(route)) == 'eth0'
+    assert default_interface(str(tmp_path / 'missing')) is None
+
+
+def test_state_is_only_written_when_it_changes(tmp_path):
+    ladder = make_ladder(tmp_path)
+    state = tmp_path / 'ladder.json'
+    ladder.due(now=1000.0)
+    ladder.escalate()
+    ladder.due(now=1001.0)
+    state.unlink()
+    # Waiting out a cooldown, a reset with nothing to reset and a known interface change nothing
+    assert ladder.due(now=1030.0) is None
+    ladder.remember_interface(None)
+    assert not state.exists()
+    ladder.remember_interface('eth0')
+    assert state.exists()
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from ipreport.schedule import Schedule
+
+
+def test_deadlines_stay_on_the_grid():
+    schedule = Schedule(30, start=100.0)
+    assert schedule.first() == 100.0
+    # A run that takes 5s doesn't push the next one back
+    assert schedule.advance(105.0) == 130.0
+    assert schedule.advance(131.0) == 160.0
+    assert schedule.missed == 0
+
+
+def test_skip_drops_missed_slots():
+    schedule = Schedule(30, start=0.0, catch_up='skip')
+    # The run of slot 0 overran slots 30, 60 and 90
+    assert schedule.advance(95.0) == 120.0
+    assert schedule.missed == 3
+
+
+def test_burst_runs_missed_slots_back_to_back():
+    schedule = Schedule(30, start=0.0, catch_up='burst', max_burst=3)
+    assert schedule.advance(65.0) == 65.0  # slot 30
+    assert schedule.advance(66.0) == 66.0  # slot 60
+    assert schedule.advance(67.0) == 90.0  # back on the grid
+    assert schedule.missed == 0
+
+
+def test_burst_is_capped():
+    schedule = Schedule(10, start=0.0, catch_up='burst', max_burst=2)
+    # Slots 10..90 were missed, only the last two are caught up
+    assert schedule.advance(95.0) == 95.0
+    assert schedule.slot == 80.0
+    assert schedule.missed == 7
+    assert schedule.advance(96.0) == 96.0
+    assert schedule.advance(97.0) == 100.0
+
+
+def test_delay_starts_a_new_grid():
+    schedule = Schedule(30, start=0.0, catch_up='delay')
+    assert schedule.advance(70.0) == 100.0
+    assert schedule.missed == 2
+    assert schedule.advance(101.0) == 130.0
+
+
+def test_jitter_stays_within_bounds_and_does_not_accumulate():
+    schedule = Schedule(10, start=0.0, jitter=0.5, rng=random.Random(1))
+    for n in range(1, 200):
+        deadline = schedule.advance(schedule.slot + 1.0)
+        assert n * 10 <= deadline <= n * 10 + 5
+    assert schedule.slot == 1990.0
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Schedule(30, start=0.0, catch_up='later')
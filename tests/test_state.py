@@ -0,0 +1,74 @@
+from datetime import datetime
+
+from ipreport.history import Entry
+from ipreport.state import HEARTBEAT_FILE, IP_FILE, LOG_FILE, UPLINKS_FILE, PublishState
+
+
+def make_state(tmp_path, heartbeat_interval=600):
+    return PublishState(str(tmp_path / 'state.json'), heartbeat_interval=heartbeat_interval)
+
+
+def test_new_ip_is_pending_everywhere(tmp_path):
+    state = make_state(tmp_path)
+    assert state.pending('198.51.100.1', now=1000.0) == {IP_FILE, HEARTBEAT_FILE, LOG_FILE}
+
+
+def test_heartbeat_only_when_due(tmp_path):
+    state = make_state(tmp_path)
+    state.mark_published('198.51.100.1', now=1000.0)
+    assert state.pending('198.51.100.1', now=1300.0) == set()
+    assert state.pending('198.51.100.1', now=1600.0) == {HEARTBEAT_FILE}
+
+
+def test_clock_stepped_back_sends_a_heartbeat(tmp_path):
+    state = make_state(tmp_path)
+    state.mark_published('198.51.100.1', now=1000.0)
+    assert state.pending('198.51.100.1', now=900.0) == {HEARTBEAT_FILE}
+
+
+def test_state_survives_a_restart(tmp_path):
+    state = make_state(tmp_path)
+    state.mark_published('198.51.100.1', now=1000.0, uplinks={'eth0': {'ipv4': '198.51.100.1'}})
+    again = make_state(tmp_path)
+    assert again.ip == '198.51.100.1'
+    assert again.uplinks == {'eth0': {'ipv4': '198.51.100.1'}}
+    assert again.pending('198.51.100.1', now=1100.0) == set()
+
+
+def test_merge_uplinks_keeps_addresses_of_failed_lookups(tmp_path):
+    state = make_state(tmp_path)
+    state.uplinks = {'eth0': {'ipv4': '198.51.100.1', 'ipv6': '2001:db8::1'}}
+    merged = state.merge_uplinks({'eth0': {'ipv4': None, 'ipv6': '2001:db8::2'}, 'wwan0': {'ipv4': None}})
+    assert merged == {
+        'eth0': {'ipv4': '198.51.100.1', 'ipv6': '2001:db8::2'},
+        'wwan0': {'ipv4': None},
+    }
+    # The published state itself is untouched
+    assert state.uplinks['eth0']['ipv6'] == '2001:db8::1'
+
+
+def test_uplink_change_is_pending_without_an_ip_change(tmp_path):
+    state = make_state(tmp_path)
+    uplinks = {'eth0': {'ipv4': '198.51.100.1'}}
+    state.mark_published('198.51.100.1', now=1000.0, uplinks=uplinks)
+    assert state.pending('198.51.100.1', now=1010.0, uplinks=state.merge_uplinks(uplinks)) == set()
+
+    changed = state.merge_uplinks({'eth0': {'ipv4': '198.51.100.1'}, 'wwan0': {'ipv4': '203.0.113.7'}})
+    assert state.changed_uplinks(changed) == ['wwan0']
+    assert state.pending('198.51.100.1', now=1010.0, uplinks=changed) == {UPLINKS_FILE, HEARTBEAT_FILE}
+
+
+def test_appended_changes_are_tracked_until_published(tmp_path):
+    state = make_state(tmp_path)
+    first = [Entry(datetime(2026, 1, 1, 12), '198.51.100.1')]
+    state.mark_appended(LOG_FILE, first)
+
+    later = first + [Entry(datetime(2026, 1, 1, 13), '198.51.100.2')]
+    assert make_state(tmp_path).appended_count(LOG_FILE, later) == 1
+    assert state.appended_count('history.bin', later) == 0
+    # Without an outbox a retry stamps the same change afresh
+    assert state.appended_count(LOG_FILE, [Entry(datetime(2026, 1, 1, 12, 5), '198.51.100.1')]) == 1
+    assert state.appended_count(LOG_FILE, [Entry(datetime(2026, 1, 1, 12, 5), '198.51.100.9')]) == 0
+
+    state.mark_published('198.51.100.2', now=1000.0)
+    assert make_state(tmp_path).appended_count(LOG_FILE, later) == 0
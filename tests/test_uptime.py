@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from ipreport.uptime import CHECK, OUTAGE, PROBE, REMEDIATION, UptimeRecorder, main
+
+
+def test_outages_are_opened_and_closed_by_checks(tmp_path):
+    recorder = UptimeRecorder(str(tmp_path / 'uptime.bin'), capacity=64).open()
+    start = time.time()
+    recorder.record_check(start + 1, True, 0.02, 'dns')
+    recorder.record_check(start + 2, False, 0.9, 'https')
+    recorder.record_check(start + 3, False, 0.9, 'https')
+    recorder.record_check(start + 62, True, 0.03, 'dns')
+    recorder.record_probe(start + 63, True, 0.2)
+    recorder.record_remediation(start + 61, 'bounce-interface', True)
+
+    assert [e.kind for e in recorder.events()] == [CHECK, CHECK, CHECK, CHECK, OUTAGE, PROBE, REMEDIATION]
+    assert recorder.outages() == [(start + 2, 60.0, False)]
+    report = recorder.report(days=1, now=start + 120)
+    assert report['outages']['count'] == 1 and report['outages']['downtime_seconds'] == 60
+    assert report['checks']['total'] == 4 and report['checks']['failed'] == 2
+    assert report['checks']['decided_by'] == {'dns': 2, 'https': 2}
+    assert report['remediations'] == {'bounce-interface': {'runs': 1, 'helped': 1}}
+    recorder.close()
+
+
+def test_ongoing_outage_and_totals_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'uptime.bin')
+    recorder = UptimeRecorder(path, capacity=64).open()
+    start = time.time()
+    recorder.record_check(start, False, 0.9, 'https')
+    recorder.close()
+
+    recorder = UptimeRecorder(path, capacity=64).open()
+    assert recorder.outages(now=start + 30) == [(start, 30.0, True)]
+    recorder.record_check(start + 40, True, 0.02, 'dns')
+    assert recorder.report(now=start + 50)['lifetime']['outages'] == 1
+    recorder.close()
+
+
+def test_the_ring_keeps_the_newest_records(tmp_path):
+    recorder = UptimeRecorder(str(tmp_path / 'uptime.bin'), capacity=8).open()
+    start = time.time()
+    for n in range(20):
+        recorder.record_probe(start + n, True, 0.1)
+    assert [e.timestamp - start for e in recorder.events()] == list(range(12, 20))
+    assert [e.timestamp - start for e in recorder.events(since=start + 17)] == [17, 18, 19]
+    recorder.close()
+
+
+def test_reports_never_rewrite_the_file(tmp_path, capsys):
+    path = tmp_path / 'uptime.bin'
+    recorder = UptimeRecorder(str(path), capacity=16).open()
+    recorder.record_check(time.time(), True, 0.02, 'dns')
+    recorder.close()
+    assert main(['--file', str(path), 'report']) == 0
+    assert 'checks 1 (0 failed)' in capsys.readouterr().out
+
+    # Another version's layout, or a file cut short: refused, not reinitialised
+    data = path.read_bytes()
+    path.write_bytes(data[:-1])
+    assert main(['--file', str(path), 'report']) == 1
+    assert 'not an uptime record' in capsys.readouterr().err
+    assert path.read_bytes() == data[:-1]
+    with pytest.raises(ValueError):
+        UptimeRecorder(str(path), capacity=None).open(readonly=True)